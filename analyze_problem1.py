@@ -5,110 +5,72 @@ This script compares commuting hours versus non-commuting hours in the control g
 (i.e., with 2-minute wait times) for Uber Express POOL data.
 """
 
+import argparse
+
 import pandas as pd
-import numpy as np
-from scipy import stats
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-# Set styling for plots
-sns.set(style="whitegrid")
-plt.rcParams.update({'font.size': 12})
+import profiling
+from column_store import load_columns
+from metric_engine import PROBLEM1_METRICS, base_columns, compare_groups, get_metrics, metric_matrix
+from plotting import get_pyplot
+from resampling import resample_groups
+from results_io import city_label, render_summary, table_to_records, write_results
 
-# Load data
-def load_data(file_path):
-    """Load the CSV data with correct delimiter and decimal point formatting."""
-    df = pd.read_csv(file_path, delimiter=';')
-    
-    # Convert columns that might have commas instead of dots as decimal separator
-    if 'total_driver_payout' in df.columns:
-        df['total_driver_payout'] = df['total_driver_payout'].str.replace(',', '.').astype(float)
-    
-    # Convert boolean columns
-    if 'treat' in df.columns:
-        df['treat'] = df['treat'].astype(bool)
-    if 'commute' in df.columns:
-        df['commute'] = df['commute'].astype(bool)
-    
-    return df
+# Table fields unpacked for each metric compared in Problem 1
+RESULT_FIELDS = ['mean_a', 'mean_b', 'difference', 't_stat', 'p_value', 'significant']
+RESULTS_PATH = 'problem1_results.jsonl'
 
-# Helper function for t-test analysis
-def run_ttest(group1, group2):
+# Main analysis function
+def analyze_problem1(df=None, n_resamples=0, plot=False, results_path=RESULTS_PATH):
     """
-    Run t-test between two groups and return t-statistic, p-value, and significance at 5% level.
+    Compare commuting and non-commuting hours in the control group.
+    
+    Args:
+        df (DataFrame): Switchback data; memory-mapped from the column store if not given
+        n_resamples (int): If positive, also run permutation tests and bootstrap CIs
+            with this many resamples for every metric
+        plot (bool): Render problem1_visualizations.png
+        results_path (str): Where to write the raw result records (JSON Lines, or
+            a Parquet dataset directory if it ends in '.parquet')
+    
+    Returns:
+        dict: Dictionary with analysis results
     """
-    t_stat, p_val = stats.ttest_ind(group1, group2, equal_var=False)
-    significant = p_val < 0.05
-    return t_stat, p_val, significant
-
-# Main analysis function
-def analyze_problem1():
-    # Load data
-    df = load_data('data/switchbacks.csv')
+    metrics = get_metrics(PROBLEM1_METRICS)
     
-    # Filter for control group (2-minute wait times)
-    control_df = df[df['treat'] == False].copy()
+    # Load data: memory-map only the columns the metrics need
+    with profiling.stage('problem1/load') as record:
+        if df is None:
+            df = load_columns(['city_id', 'treat', 'commute'] + base_columns(metrics))
+        record['rows'] = len(df)
     
-    # Split control group by commute/non-commute
-    commute_df = control_df[control_df['commute'] == True].copy()
-    non_commute_df = control_df[control_df['commute'] == False].copy()
+    # Control group (2-minute wait times), split by commute/non-commute
+    control = ~df['treat'].to_numpy()
+    commute_mask = control & df['commute'].to_numpy()
+    non_commute_mask = control & ~df['commute'].to_numpy()
     
     # Print sample sizes
-    print(f"Sample sizes: Commuting hours: {len(commute_df)}, Non-commuting hours: {len(non_commute_df)}")
-    
-    # 1. Compare number of ridesharing trips (Pool + Express)
-    commute_df['total_rides'] = commute_df['trips_pool'] + commute_df['trips_express']
-    non_commute_df['total_rides'] = non_commute_df['trips_pool'] + non_commute_df['trips_express']
+    print(f"Sample sizes: Commuting hours: {commute_mask.sum()}, Non-commuting hours: {non_commute_mask.sum()}")
     
-    # 2. Calculate the difference
-    mean_rides_commute = commute_df['total_rides'].mean()
-    mean_rides_non_commute = non_commute_df['total_rides'].mean() 
-    ride_difference = mean_rides_commute - mean_rides_non_commute
+    # Compute every metric, group statistic and t-test in one vectorized pass
+    with profiling.stage('problem1/test', rows=int(commute_mask.sum() + non_commute_mask.sum())):
+        table = compare_groups(df, metrics, commute_mask, non_commute_mask)
     
-    # 3. Run t-test to check if difference is statistically significant
-    t_stat_rides, p_val_rides, sig_rides = run_ttest(
-        commute_df['total_rides'], 
-        non_commute_df['total_rides']
-    )
-    
-    # 4-6. Compare Express trip rates
-    commute_df['express_share'] = commute_df['trips_express'] / commute_df['total_rides']
-    non_commute_df['express_share'] = non_commute_df['trips_express'] / non_commute_df['total_rides']
+    # 1-3. Number of ridesharing trips (Pool + Express)
+    mean_rides_commute, mean_rides_non_commute, ride_difference, t_stat_rides, p_val_rides, sig_rides = \
+        table.loc['total_rides', RESULT_FIELDS]
     
-    mean_express_share_commute = commute_df['express_share'].mean()
-    mean_express_share_non_commute = non_commute_df['express_share'].mean()
-    express_share_difference = mean_express_share_commute - mean_express_share_non_commute
-    
-    t_stat_express, p_val_express, sig_express = run_ttest(
-        commute_df['express_share'], 
-        non_commute_df['express_share']
-    )
+    # 4-6. Express trip rates
+    mean_express_share_commute, mean_express_share_non_commute, express_share_difference, \
+        t_stat_express, p_val_express, sig_express = table.loc['express_share', RESULT_FIELDS]
     
     # 7-8. Revenue comparison (assuming $12.5 for POOL, $10 for Express)
-    commute_df['revenue'] = (commute_df['trips_pool'] * 12.5) + (commute_df['trips_express'] * 10)
-    non_commute_df['revenue'] = (non_commute_df['trips_pool'] * 12.5) + (non_commute_df['trips_express'] * 10)
-    
-    mean_revenue_commute = commute_df['revenue'].mean()
-    mean_revenue_non_commute = non_commute_df['revenue'].mean()
-    revenue_difference = mean_revenue_commute - mean_revenue_non_commute
-    
-    t_stat_revenue, p_val_revenue, sig_revenue = run_ttest(
-        commute_df['revenue'], 
-        non_commute_df['revenue']
-    )
+    mean_revenue_commute, mean_revenue_non_commute, revenue_difference, \
+        t_stat_revenue, p_val_revenue, sig_revenue = table.loc['revenue', RESULT_FIELDS]
     
     # 9-10. Profit per trip comparison
-    commute_df['profit_per_trip'] = (commute_df['revenue'] - commute_df['total_driver_payout']) / commute_df['total_rides']
-    non_commute_df['profit_per_trip'] = (non_commute_df['revenue'] - non_commute_df['total_driver_payout']) / non_commute_df['total_rides']
-    
-    mean_profit_per_trip_commute = commute_df['profit_per_trip'].mean()
-    mean_profit_per_trip_non_commute = non_commute_df['profit_per_trip'].mean()
-    profit_per_trip_difference = mean_profit_per_trip_commute - mean_profit_per_trip_non_commute
-    
-    t_stat_profit, p_val_profit, sig_profit = run_ttest(
-        commute_df['profit_per_trip'], 
-        non_commute_df['profit_per_trip']
-    )
+    mean_profit_per_trip_commute, mean_profit_per_trip_non_commute, profit_per_trip_difference, \
+        t_stat_profit, p_val_profit, sig_profit = table.loc['profit_per_trip', RESULT_FIELDS]
     
     # Print results
     print("\n===== PROBLEM 1: Comparing Commuting vs. Non-Commuting Hours (Control Group) =====\n")
@@ -152,16 +114,32 @@ def analyze_problem1():
     print("\n10. Is the difference statistically significant at the 5% confidence level?")
     print(f"Answer: {'YES' if sig_profit else 'NO'} (p-value: {p_val_profit:.4f}, t-statistic: {t_stat_profit:.4f})")
     
-    # Create visualizations
-    create_visualizations(commute_df, non_commute_df)
-    
-    # Create a comprehensive summary table for the report
-    create_summary_table(
-        mean_rides_commute, mean_rides_non_commute, ride_difference, sig_rides, p_val_rides,
-        mean_express_share_commute, mean_express_share_non_commute, express_share_difference, sig_express, p_val_express,
-        mean_revenue_commute, mean_revenue_non_commute, revenue_difference, sig_revenue, p_val_revenue,
-        mean_profit_per_trip_commute, mean_profit_per_trip_non_commute, profit_per_trip_difference, sig_profit, p_val_profit
+    # Optional resampling checks, robust to the small, non-normal samples
+    resampling = None
+    if n_resamples > 0:
+        with profiling.stage('problem1/resample'):
+            resampling = resample_groups(df, metrics, commute_mask, non_commute_mask, n_resamples)
+        print(f"\n===== RESAMPLING ({n_resamples} permutations / bootstrap draws) =====")
+        print(resampling.to_string())
+    
+    # Create visualizations from the per-period metric values
+    if plot:
+        with profiling.stage('problem1/plot'):
+            names = [metric.name for metric in metrics]
+            values = metric_matrix(df, metrics)
+            commute_df = pd.DataFrame(values[commute_mask], columns=names)
+            non_commute_df = pd.DataFrame(values[non_commute_mask], columns=names)
+            create_visualizations(commute_df, non_commute_df)
+    
+    # Save raw results, then render the summary table for the report from them
+    records = table_to_records(
+        table, experiment='problem1', city_id=city_label(df), segment='control',
+        group_a='commute', group_b='non-commute'
     )
+    with profiling.stage('problem1/write_results', rows=len(records)):
+        write_results(records, results_path, append=False)
+    print(f"Results saved as '{results_path}'")
+    create_summary_table(records)
     
     # Return results as a dictionary for potential further use
     return {
@@ -172,11 +150,14 @@ def analyze_problem1():
         'revenue_difference': revenue_difference,
         'sig_revenue': sig_revenue,
         'profit_per_trip_difference': profit_per_trip_difference,
-        'sig_profit': sig_profit
+        'sig_profit': sig_profit,
+        'resampling': resampling
     }
 
 def create_visualizations(commute_df, non_commute_df):
     """Create visualizations to support the analysis"""
+    plt = get_pyplot()
+    
     # Set up the plots
     fig, axes = plt.subplots(2, 2, figsize=(16, 12))
     
@@ -210,60 +191,18 @@ def create_visualizations(commute_df, non_commute_df):
     ax.set_ylabel('Profit per Trip ($)')
     
     plt.tight_layout()
-    plt.savefig('problem1_visualizations.png')
+    with profiling.stage('problem1/savefig'):
+        plt.savefig('problem1_visualizations.png')
+    plt.close(fig)
     print("\nVisualizations saved as 'problem1_visualizations.png'")
     
-def create_summary_table(
-    mean_rides_commute, mean_rides_non_commute, ride_difference, sig_rides, p_val_rides,
-    mean_express_share_commute, mean_express_share_non_commute, express_share_difference, sig_express, p_val_express,
-    mean_revenue_commute, mean_revenue_non_commute, revenue_difference, sig_revenue, p_val_revenue,
-    mean_profit_per_trip_commute, mean_profit_per_trip_non_commute, profit_per_trip_difference, sig_profit, p_val_profit
-):
-    """Create a summary table for the report"""
-    
-    # Create a summary DataFrame
-    summary_data = {
-        'Metric': [
-            'Total Rides', 
-            'Express Share (%)', 
-            'Revenue ($)', 
-            'Profit per Trip ($)'
-        ],
-        'Commuting Hours': [
-            f"{mean_rides_commute:.2f}",
-            f"{mean_express_share_commute*100:.2f}%",
-            f"${mean_revenue_commute:.2f}",
-            f"${mean_profit_per_trip_commute:.4f}"
-        ],
-        'Non-Commuting Hours': [
-            f"{mean_rides_non_commute:.2f}",
-            f"{mean_express_share_non_commute*100:.2f}%",
-            f"${mean_revenue_non_commute:.2f}",
-            f"${mean_profit_per_trip_non_commute:.4f}"
-        ],
-        'Difference': [
-            f"{ride_difference:.2f}",
-            f"{express_share_difference*100:.2f}%",
-            f"${revenue_difference:.2f}",
-            f"${profit_per_trip_difference:.4f}"
-        ],
-        'Significant at 5%': [
-            'YES' if sig_rides else 'NO',
-            'YES' if sig_express else 'NO',
-            'YES' if sig_revenue else 'NO',
-            'YES' if sig_profit else 'NO'
-        ],
-        'p-value': [
-            f"{p_val_rides:.4f}",
-            f"{p_val_express:.4f}",
-            f"{p_val_revenue:.4f}",
-            f"{p_val_profit:.4f}"
-        ]
-    }
-    
-    # Create DataFrame and save to CSV
-    summary_df = pd.DataFrame(summary_data)
-    summary_df.to_csv('problem1_summary.csv', index=False)
+def create_summary_table(records):
+    """Render the summary table for the report from the raw result records"""
+    with profiling.stage('problem1/tabulate', rows=len(records)):
+        summary_df = render_summary(records, ('Commuting Hours', 'Non-Commuting Hours'))
+        
+        # Save to CSV
+        summary_df.to_csv('problem1_summary.csv', index=False)
     print("Summary table saved as 'problem1_summary.csv'")
     
     # Print the table to console in a formatted way
@@ -271,4 +210,20 @@ def create_summary_table(
     print(summary_df.to_string(index=False))
 
 if __name__ == "__main__":
-    analyze_problem1() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--resamples', type=int, default=0,
+                        help='permutation/bootstrap resamples per metric (0 disables resampling)')
+    parser.add_argument('--plot', action='store_true',
+                        help='render problem1_visualizations.png')
+    parser.add_argument('--results', default=RESULTS_PATH,
+                        help='raw results output (.jsonl, or a .parquet dataset directory)')
+    parser.add_argument('--profile', default=None,
+                        help='record per-stage timings here (.json for a Chrome trace, else JSON Lines)')
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    analyze_problem1(n_resamples=args.resamples, plot=args.plot, results_path=args.results)
+    if args.profile:
+        profiling.write(args.profile)
+        print(f"\nProfile saved as '{args.profile}'")
+        print(profiling.summary().to_string(index=False))
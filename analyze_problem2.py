@@ -5,39 +5,28 @@ This script estimates the effect of extending waiting times from 2 minutes (cont
 to 5 minutes (treatment group) separately for commuting and non-commuting hours.
 """
 
+import argparse
+
 import pandas as pd
-import numpy as np
-from scipy import stats
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-# Set styling for plots
-sns.set(style="whitegrid")
-plt.rcParams.update({'font.size': 12})
+import profiling
+from column_store import load_columns
+from cuped import cuped_values
+from metric_engine import PROBLEM2_METRICS, base_columns, compare_groups, compare_values, get_metrics
+from plotting import CONTROL_COLOR, TREATMENT_COLOR, get_pyplot
+from resampling import resample_groups
+from results_io import city_label, render_summary, table_to_records, write_results
 
-def load_data(file_path):
-    """Load the CSV data with correct delimiter and decimal point formatting."""
-    df = pd.read_csv(file_path, delimiter=';')
-    
-    # Convert columns that might have commas instead of dots as decimal separator
-    if 'total_driver_payout' in df.columns:
-        df['total_driver_payout'] = df['total_driver_payout'].str.replace(',', '.').astype(float)
-    
-    # Convert boolean columns
-    if 'treat' in df.columns:
-        df['treat'] = df['treat'].astype(bool)
-    if 'commute' in df.columns:
-        df['commute'] = df['commute'].astype(bool)
-    
-    return df
-
-def run_ttest(group1, group2):
-    """
-    Run t-test between two groups and return t-statistic, p-value, and significance at 5% level.
-    """
-    t_stat, p_val = stats.ttest_ind(group1, group2, equal_var=False)
-    significant = p_val < 0.05
-    return t_stat, p_val, significant
+# Keys used in the results dict for each metric compared in Problem 2:
+# (key for means/tests, key for the difference)
+RESULT_KEYS = {
+    'total_rides': ('rides', 'ride'),
+    'rider_cancellations': ('cancellations', 'cancellation'),
+    'driver_payout_per_trip': ('payout', 'payout'),
+    'match_rate': ('match_rate', 'match_rate'),
+    'double_match_rate': ('double_match_rate', 'double_match_rate'),
+}
+RESULTS_PATH = 'problem2_results.jsonl'
 
 def calculate_match_rate(df):
     """Calculate the overall match rate for each observation."""
@@ -51,125 +40,80 @@ def calculate_driver_payout_per_trip(df):
     """Calculate driver payout per trip for each observation."""
     return df['total_driver_payout'] / (df['trips_pool'] + df['trips_express'])
 
-def analyze_waiting_times(commute_value=True):
+def required_columns(metrics, cuped=False):
+    """Columns analyze_waiting_times reads for the given metrics."""
+    lag_columns = ['period_start'] if cuped else []
+    return ['city_id', 'treat', 'commute'] + lag_columns + base_columns(metrics)
+
+def analyze_waiting_times(commute_value=True, df=None, n_resamples=0, cuped=False):
     """
     Analyze the effect of extending waiting times for either commuting or non-commuting hours.
     
     Args:
         commute_value (bool): Whether to analyze commuting hours (True) or non-commuting hours (False)
+        df (DataFrame): Switchback data; memory-mapped from the column store if not given
+        n_resamples (int): If positive, also run permutation tests and bootstrap CIs
+            with this many resamples for every metric
+        cuped (bool): Test CUPED-adjusted values (see cuped.py), using the matching
+            earlier period of each metric as covariate; resampling stays unadjusted
     
     Returns:
         dict: Dictionary with analysis results
     """
-    # Load data
-    df = load_data('data/switchbacks.csv')
-    
-    # Filter data for selected commute hours
-    filtered_df = df[df['commute'] == commute_value].copy()
-    
-    # Split into treatment and control groups
-    treatment_df = filtered_df[filtered_df['treat'] == True].copy()  # 5-minute wait times
-    control_df = filtered_df[filtered_df['treat'] == False].copy()   # 2-minute wait times
-    
-    # Print sample sizes
-    print(f"Sample sizes: Treatment group: {len(treatment_df)}, Control group: {len(control_df)}")
-    
-    # Calculate metrics
-    for df in [treatment_df, control_df]:
-        df['total_rides'] = df['trips_pool'] + df['trips_express'] 
-        df['match_rate'] = calculate_match_rate(df)
-        df['double_match_rate'] = calculate_double_match_rate(df)
-        df['driver_payout_per_trip'] = calculate_driver_payout_per_trip(df)
-    
-    # Store results
-    results = {}
-    
-    # 1-2. Effect on total rides
-    mean_rides_treatment = treatment_df['total_rides'].mean()
-    mean_rides_control = control_df['total_rides'].mean()
-    ride_difference = mean_rides_treatment - mean_rides_control
-    
-    t_stat_rides, p_val_rides, sig_rides = run_ttest(
-        treatment_df['total_rides'], 
-        control_df['total_rides']
-    )
+    metrics = get_metrics(PROBLEM2_METRICS)
     
-    results['ride_difference'] = ride_difference
-    results['sig_rides'] = sig_rides
-    results['p_val_rides'] = p_val_rides
-    results['t_stat_rides'] = t_stat_rides
+    segment_label = 'commute' if commute_value else 'non-commute'
     
-    # 3-4. Effect on rider cancellations
-    mean_cancellations_treatment = treatment_df['rider_cancellations'].mean()
-    mean_cancellations_control = control_df['rider_cancellations'].mean()
-    cancellation_difference = mean_cancellations_treatment - mean_cancellations_control
+    # Load data: memory-map only the columns the metrics need
+    with profiling.stage(f'problem2/{segment_label}/load') as record:
+        if df is None:
+            df = load_columns(required_columns(metrics, cuped))
+        record['rows'] = len(df)
     
-    t_stat_cancellations, p_val_cancellations, sig_cancellations = run_ttest(
-        treatment_df['rider_cancellations'], 
-        control_df['rider_cancellations']
-    )
-    
-    results['cancellation_difference'] = cancellation_difference
-    results['sig_cancellations'] = sig_cancellations
-    results['p_val_cancellations'] = p_val_cancellations
-    results['t_stat_cancellations'] = t_stat_cancellations
-    
-    # 5-6. Effect on driver payout per trip
-    mean_payout_treatment = treatment_df['driver_payout_per_trip'].mean()
-    mean_payout_control = control_df['driver_payout_per_trip'].mean()
-    payout_difference = mean_payout_treatment - mean_payout_control
-    
-    t_stat_payout, p_val_payout, sig_payout = run_ttest(
-        treatment_df['driver_payout_per_trip'], 
-        control_df['driver_payout_per_trip']
-    )
+    # Select treatment (5-minute wait) and control (2-minute wait) rows for the chosen commute hours
+    segment = df['commute'].to_numpy() == commute_value
+    treatment_mask = segment & df['treat'].to_numpy()
+    control_mask = segment & ~df['treat'].to_numpy()
     
-    results['payout_difference'] = payout_difference
-    results['sig_payout'] = sig_payout
-    results['p_val_payout'] = p_val_payout
-    results['t_stat_payout'] = t_stat_payout
-    
-    # 7-8. Effect on match rate
-    mean_match_rate_treatment = treatment_df['match_rate'].mean()
-    mean_match_rate_control = control_df['match_rate'].mean()
-    match_rate_difference = mean_match_rate_treatment - mean_match_rate_control
-    
-    t_stat_match_rate, p_val_match_rate, sig_match_rate = run_ttest(
-        treatment_df['match_rate'], 
-        control_df['match_rate']
+    # Print sample sizes
+    print(f"Sample sizes: Treatment group: {treatment_mask.sum()}, Control group: {control_mask.sum()}")
+    
+    # Compute every metric, group statistic and t-test in one vectorized pass
+    with profiling.stage(f'problem2/{segment_label}/test', rows=int(treatment_mask.sum() + control_mask.sum())):
+        if cuped:
+            adjusted, _ = cuped_values(df, metrics)
+            table = compare_values(adjusted, PROBLEM2_METRICS, treatment_mask, control_mask)
+        else:
+            table = compare_groups(df, metrics, treatment_mask, control_mask)
+    results = results_from_table(table)
+    results['records'] = table_to_records(
+        table, experiment='problem2_cuped' if cuped else 'problem2', city_id=city_label(df), segment=segment_label,
+        group_a='treatment', group_b='control'
     )
     
-    results['match_rate_difference'] = match_rate_difference
-    results['sig_match_rate'] = sig_match_rate
-    results['p_val_match_rate'] = p_val_match_rate
-    results['t_stat_match_rate'] = t_stat_match_rate
-    
-    # 9-10. Effect on double match rate
-    mean_double_match_rate_treatment = treatment_df['double_match_rate'].mean()
-    mean_double_match_rate_control = control_df['double_match_rate'].mean()
-    double_match_rate_difference = mean_double_match_rate_treatment - mean_double_match_rate_control
+    # Optional resampling checks, robust to the small, non-normal samples
+    results['resampling'] = None
+    if n_resamples > 0:
+        with profiling.stage(f'problem2/{segment_label}/resample'):
+            results['resampling'] = resample_groups(df, metrics, treatment_mask, control_mask, n_resamples)
     
-    t_stat_double_match_rate, p_val_double_match_rate, sig_double_match_rate = run_ttest(
-        treatment_df['double_match_rate'], 
-        control_df['double_match_rate']
-    )
-    
-    results['double_match_rate_difference'] = double_match_rate_difference
-    results['sig_double_match_rate'] = sig_double_match_rate
-    results['p_val_double_match_rate'] = p_val_double_match_rate
-    results['t_stat_double_match_rate'] = t_stat_double_match_rate
+    return results
+
+def results_from_table(table):
+    """Convert a treatment-vs-control comparison table into the results dict used for reporting."""
+    # Store results under the keys used by the reporting functions
+    results = {}
+    for metric, (key, difference_key) in RESULT_KEYS.items():
+        row = table.loc[metric]
+        results[f'{difference_key}_difference'] = row['difference']
+        results[f'sig_{key}'] = row['significant']
+        results[f'p_val_{key}'] = row['p_value']
+        results[f't_stat_{key}'] = row['t_stat']
     
     # Store means for reporting
-    results['mean_rides_treatment'] = mean_rides_treatment
-    results['mean_rides_control'] = mean_rides_control
-    results['mean_cancellations_treatment'] = mean_cancellations_treatment
-    results['mean_cancellations_control'] = mean_cancellations_control
-    results['mean_payout_treatment'] = mean_payout_treatment
-    results['mean_payout_control'] = mean_payout_control
-    results['mean_match_rate_treatment'] = mean_match_rate_treatment
-    results['mean_match_rate_control'] = mean_match_rate_control
-    results['mean_double_match_rate_treatment'] = mean_double_match_rate_treatment
-    results['mean_double_match_rate_control'] = mean_double_match_rate_control
+    for metric, (key, _) in RESULT_KEYS.items():
+        results[f'mean_{key}_treatment'] = table.loc[metric, 'mean_a']
+        results[f'mean_{key}_control'] = table.loc[metric, 'mean_b']
     
     return results
 
@@ -314,102 +258,16 @@ def print_non_commuting_results(results):
     print(f"Explanation: {positive_metrics} out of 5 key metrics support extending waiting times.")
 
 def create_summary_tables(commuting_results, non_commuting_results):
-    """Create and save summary tables for both analyses."""
-    # Create summary for commuting hours
-    commuting_summary = pd.DataFrame({
-        'Metric': [
-            'Total Rides', 
-            'Rider Cancellations',
-            'Driver Payout per Trip ($)',
-            'Match Rate (%)',
-            'Double Match Rate (%)'
-        ],
-        '5-min Wait (Treatment)': [
-            f"{commuting_results['mean_rides_treatment']:.2f}",
-            f"{commuting_results['mean_cancellations_treatment']:.2f}",
-            f"${commuting_results['mean_payout_treatment']:.4f}",
-            f"{commuting_results['mean_match_rate_treatment']*100:.2f}%",
-            f"{commuting_results['mean_double_match_rate_treatment']*100:.2f}%"
-        ],
-        '2-min Wait (Control)': [
-            f"{commuting_results['mean_rides_control']:.2f}",
-            f"{commuting_results['mean_cancellations_control']:.2f}",
-            f"${commuting_results['mean_payout_control']:.4f}",
-            f"{commuting_results['mean_match_rate_control']*100:.2f}%",
-            f"{commuting_results['mean_double_match_rate_control']*100:.2f}%"
-        ],
-        'Difference': [
-            f"{commuting_results['ride_difference']:.2f}",
-            f"{commuting_results['cancellation_difference']:.2f}",
-            f"${commuting_results['payout_difference']:.4f}",
-            f"{commuting_results['match_rate_difference']*100:.2f}%",
-            f"{commuting_results['double_match_rate_difference']*100:.2f}%"
-        ],
-        'Significant at 5%': [
-            'YES' if commuting_results['sig_rides'] else 'NO',
-            'YES' if commuting_results['sig_cancellations'] else 'NO',
-            'YES' if commuting_results['sig_payout'] else 'NO',
-            'YES' if commuting_results['sig_match_rate'] else 'NO',
-            'YES' if commuting_results['sig_double_match_rate'] else 'NO'
-        ],
-        'p-value': [
-            f"{commuting_results['p_val_rides']:.4f}",
-            f"{commuting_results['p_val_cancellations']:.4f}",
-            f"{commuting_results['p_val_payout']:.4f}",
-            f"{commuting_results['p_val_match_rate']:.4f}",
-            f"{commuting_results['p_val_double_match_rate']:.4f}"
-        ]
-    })
-    
-    # Create summary for non-commuting hours
-    non_commuting_summary = pd.DataFrame({
-        'Metric': [
-            'Total Rides', 
-            'Rider Cancellations',
-            'Driver Payout per Trip ($)',
-            'Match Rate (%)',
-            'Double Match Rate (%)'
-        ],
-        '5-min Wait (Treatment)': [
-            f"{non_commuting_results['mean_rides_treatment']:.2f}",
-            f"{non_commuting_results['mean_cancellations_treatment']:.2f}",
-            f"${non_commuting_results['mean_payout_treatment']:.4f}",
-            f"{non_commuting_results['mean_match_rate_treatment']*100:.2f}%",
-            f"{non_commuting_results['mean_double_match_rate_treatment']*100:.2f}%"
-        ],
-        '2-min Wait (Control)': [
-            f"{non_commuting_results['mean_rides_control']:.2f}",
-            f"{non_commuting_results['mean_cancellations_control']:.2f}",
-            f"${non_commuting_results['mean_payout_control']:.4f}",
-            f"{non_commuting_results['mean_match_rate_control']*100:.2f}%",
-            f"{non_commuting_results['mean_double_match_rate_control']*100:.2f}%"
-        ],
-        'Difference': [
-            f"{non_commuting_results['ride_difference']:.2f}",
-            f"{non_commuting_results['cancellation_difference']:.2f}",
-            f"${non_commuting_results['payout_difference']:.4f}",
-            f"{non_commuting_results['match_rate_difference']*100:.2f}%",
-            f"{non_commuting_results['double_match_rate_difference']*100:.2f}%"
-        ],
-        'Significant at 5%': [
-            'YES' if non_commuting_results['sig_rides'] else 'NO',
-            'YES' if non_commuting_results['sig_cancellations'] else 'NO',
-            'YES' if non_commuting_results['sig_payout'] else 'NO',
-            'YES' if non_commuting_results['sig_match_rate'] else 'NO',
-            'YES' if non_commuting_results['sig_double_match_rate'] else 'NO'
-        ],
-        'p-value': [
-            f"{non_commuting_results['p_val_rides']:.4f}",
-            f"{non_commuting_results['p_val_cancellations']:.4f}",
-            f"{non_commuting_results['p_val_payout']:.4f}",
-            f"{non_commuting_results['p_val_match_rate']:.4f}",
-            f"{non_commuting_results['p_val_double_match_rate']:.4f}"
-        ]
-    })
-    
-    # Save to CSV
-    commuting_summary.to_csv('problem2_commuting_summary.csv', index=False)
-    non_commuting_summary.to_csv('problem2_non_commuting_summary.csv', index=False)
+    """Render and save summary tables for both analyses from the raw result records."""
+    group_labels = ('5-min Wait (Treatment)', '2-min Wait (Control)')
+    rows = len(commuting_results['records']) + len(non_commuting_results['records'])
+    with profiling.stage('problem2/tabulate', rows=rows):
+        commuting_summary = render_summary(commuting_results['records'], group_labels)
+        non_commuting_summary = render_summary(non_commuting_results['records'], group_labels)
+        
+        # Save to CSV
+        commuting_summary.to_csv('problem2_commuting_summary.csv', index=False)
+        non_commuting_summary.to_csv('problem2_non_commuting_summary.csv', index=False)
     
     # Print to console
     print("\n===== COMMUTING HOURS SUMMARY =====")
@@ -422,6 +280,8 @@ def create_summary_tables(commuting_results, non_commuting_results):
 
 def create_visualizations(commuting_results, non_commuting_results):
     """Create visualizations comparing the treatment and control groups."""
+    plt = get_pyplot()
+    
     # Setup
     fig, axes = plt.subplots(5, 2, figsize=(18, 24))
     
@@ -439,7 +299,7 @@ def create_visualizations(commuting_results, non_commuting_results):
         # Commuting hours
         ax = axes[i, 0]
         data = [commuting_results[treat_key], commuting_results[control_key]]
-        bars = ax.bar(['5-min Wait', '2-min Wait'], data, color=['skyblue', 'lightgreen'])
+        bars = ax.bar(['5-min Wait', '2-min Wait'], data, color=[TREATMENT_COLOR, CONTROL_COLOR])
         ax.set_title(f'{title} - Commuting Hours')
         ax.grid(True, alpha=0.3)
         
@@ -452,7 +312,7 @@ def create_visualizations(commuting_results, non_commuting_results):
         # Non-commuting hours
         ax = axes[i, 1]
         data = [non_commuting_results[treat_key], non_commuting_results[control_key]]
-        bars = ax.bar(['5-min Wait', '2-min Wait'], data, color=['skyblue', 'lightgreen'])
+        bars = ax.bar(['5-min Wait', '2-min Wait'], data, color=[TREATMENT_COLOR, CONTROL_COLOR])
         ax.set_title(f'{title} - Non-Commuting Hours')
         ax.grid(True, alpha=0.3)
         
@@ -463,25 +323,66 @@ def create_visualizations(commuting_results, non_commuting_results):
                   f'{height:.2f}', ha='center', va='bottom', fontweight='bold')
     
     plt.tight_layout()
-    plt.savefig('problem2_visualizations.png')
+    with profiling.stage('problem2/savefig'):
+        plt.savefig('problem2_visualizations.png')
+    plt.close(fig)
     print("\nVisualizations saved as 'problem2_visualizations.png'")
 
-def main():
+def print_resampling_results(results, label):
+    """Print permutation p-values and bootstrap CIs, if they were computed."""
+    if results['resampling'] is None:
+        return
+    print(f"\n===== RESAMPLING CHECKS - {label} =====")
+    print(results['resampling'].to_string())
+
+def main(n_resamples=0, plot=False, results_path=RESULTS_PATH, cuped=False):
+    # Load the columns once and share them between both segments
+    with profiling.stage('problem2/load') as record:
+        df = load_columns(required_columns(get_metrics(PROBLEM2_METRICS), cuped))
+        record['rows'] = len(df)
+
     # Analyze for commuting hours
     print("Analyzing commuting hours...")
-    commuting_results = analyze_waiting_times(commute_value=True)
+    commuting_results = analyze_waiting_times(commute_value=True, df=df, n_resamples=n_resamples, cuped=cuped)
     print_commuting_results(commuting_results)
+    print_resampling_results(commuting_results, 'Commuting Hours')
     
     # Analyze for non-commuting hours
     print("\nAnalyzing non-commuting hours...")
-    non_commuting_results = analyze_waiting_times(commute_value=False)
+    non_commuting_results = analyze_waiting_times(commute_value=False, df=df, n_resamples=n_resamples, cuped=cuped)
     print_non_commuting_results(non_commuting_results)
+    print_resampling_results(non_commuting_results, 'Non-Commuting Hours')
     
-    # Create summary tables
+    # Save raw results, then render the summary tables from them
+    records = commuting_results['records'] + non_commuting_results['records']
+    with profiling.stage('problem2/write_results', rows=len(records)):
+        write_results(records, results_path, append=False)
+    print(f"\nResults saved as '{results_path}'")
     create_summary_tables(commuting_results, non_commuting_results)
     
     # Create visualizations
-    create_visualizations(commuting_results, non_commuting_results)
+    if plot:
+        with profiling.stage('problem2/plot'):
+            create_visualizations(commuting_results, non_commuting_results)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--resamples', type=int, default=0,
+                        help='permutation/bootstrap resamples per metric (0 disables resampling)')
+    parser.add_argument('--plot', action='store_true',
+                        help='render problem2_visualizations.png')
+    parser.add_argument('--results', default=RESULTS_PATH,
+                        help='raw results output (.jsonl, or a .parquet dataset directory)')
+    parser.add_argument('--cuped', action='store_true',
+                        help='reduce variance with lagged-period covariates (CUPED)')
+    parser.add_argument('--profile', default=None,
+                        help='record per-stage timings here (.json for a Chrome trace, else JSON Lines)')
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    main(n_resamples=args.resamples, plot=args.plot, results_path=args.results, cuped=args.cuped)
+    if args.profile:
+        profiling.write(args.profile)
+        print(f"\nProfile saved as '{args.profile}'")
+        print(profiling.summary().to_string(index=False))
+ 
\ No newline at end of file
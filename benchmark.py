@@ -0,0 +1,184 @@
+"""
+Benchmark harness for the switchback analysis pipeline.
+
+For each input size, a synthetic CSV is generated (see synthetic.py) and the
+pipeline stages are timed separately: load, metric computation, statistical
+testing and result output. In 'stream' mode loading and metric computation are
+a single chunked pass (see streaming.py). Wall time and peak traced memory are
+recorded per stage and appended to a history file together with the code
+version, so regressions between versions show up in the report.
+
+Usage:
+    python benchmark.py [--sizes 1e3 1e4 1e5 1e6] [--modes memory stream]
+    python benchmark.py --report
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data_loader import read_switchbacks
+from metric_engine import METRICS, compare_groups, metric_matrix
+from results_io import table_to_records, write_jsonl
+from streaming import GROUPS, stream_stats
+from synthetic import write_synthetic_csv
+
+HISTORY_PATH = 'benchmarks/history.jsonl'
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+# Stage slowdowns above this ratio are flagged by the report
+REGRESSION_THRESHOLD = 1.2
+
+# Comparisons run in the 'test' stage: (label, group a, group b) as (treat, commute) cells
+COMPARISONS = [
+    ('problem1', (False, True), (False, False)),
+    ('problem2 commute', (True, True), (False, True)),
+    ('problem2 non-commute', (True, False), (False, False)),
+]
+
+def code_version():
+    """Short git commit of the working tree, or 'unknown' outside a checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+@contextmanager
+def stage(timings, name):
+    """Record wall time and peak traced memory of the enclosed block in timings[name]."""
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    timings[name] = {'seconds': seconds, 'peak_mb': peak / 2 ** 20}
+
+def _cell_mask(df, cell):
+    treat, commute = cell
+    return (df['treat'].to_numpy() == treat) & (df['commute'].to_numpy() == commute)
+
+def run_memory(csv_path, output_path):
+    """Time the in-memory pipeline: load_data, metric_matrix, compare_groups, records output."""
+    timings = {}
+    metrics = list(METRICS.values())
+    with stage(timings, 'load'):
+        df = read_switchbacks(csv_path)
+    with stage(timings, 'metrics'):
+        metric_matrix(df, metrics)
+    with stage(timings, 'test'):
+        tables = [
+            (label, compare_groups(df, metrics, _cell_mask(df, a), _cell_mask(df, b)))
+            for label, a, b in COMPARISONS
+        ]
+    with stage(timings, 'output'):
+        for label, table in tables:
+            write_jsonl(table_to_records(table, experiment=label), output_path)
+    return timings
+
+def run_stream(csv_path, output_path):
+    """Time the streaming pipeline: one chunked pass, then tests and output from running totals."""
+    timings = {}
+    metrics = list(METRICS.values())
+    names = [metric.name for metric in metrics]
+    with stage(timings, 'load+metrics'):
+        running = stream_stats(metrics, csv_path)
+    with stage(timings, 'test'):
+        tables = [
+            (label, running.compare(GROUPS.index(a), GROUPS.index(b), names))
+            for label, a, b in COMPARISONS
+        ]
+    with stage(timings, 'output'):
+        for label, table in tables:
+            write_jsonl(table_to_records(table, experiment=label), output_path)
+    return timings
+
+RUNNERS = {'memory': run_memory, 'stream': run_stream}
+
+def run_benchmarks(sizes=DEFAULT_SIZES, modes=('memory', 'stream'), n_cities=10,
+                   history_path=HISTORY_PATH, data_dir=None):
+    """
+    Run every mode at every size and append one record per stage to history_path.
+
+    Generated CSVs are kept in data_dir (reused across runs) or a temporary directory.
+
+    Returns:
+        DataFrame: The records of this run
+    """
+    version = code_version()
+    timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    environment = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        tracemalloc.start()
+        try:
+            for rows in sizes:
+                n_periods = max(1, rows // n_cities)
+                csv_path = os.path.join(data_dir, f'synthetic_{n_periods * n_cities}.csv')
+                if not os.path.exists(csv_path):
+                    write_synthetic_csv(csv_path, n_periods, n_cities, seed=0)
+                for mode in modes:
+                    output_path = os.path.join(tmp, f'results_{mode}.jsonl')
+                    timings = RUNNERS[mode](csv_path, output_path)
+                    for name, timing in timings.items():
+                        record = {'version': version, 'timestamp': timestamp, 'mode': mode,
+                                  'rows': n_periods * n_cities, 'stage': name, **timing, **environment}
+                        records.append(record)
+                        print(f"{mode:>6} {record['rows']:>11,} rows  {name:<13}"
+                              f"{timing['seconds']:9.3f} s  {timing['peak_mb']:9.1f} MB peak")
+        finally:
+            tracemalloc.stop()
+
+    os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+    write_jsonl(records, history_path)
+    return pd.DataFrame(records)
+
+def report(history_path=HISTORY_PATH):
+    """
+    Compare the two most recent versions in the history, per mode, size and stage.
+
+    Returns:
+        DataFrame: seconds for both versions, their ratio and a regression flag
+    """
+    history = pd.read_json(history_path, lines=True, dtype=False)
+    versions = history.drop_duplicates('version', keep='last').sort_values('timestamp')['version']
+    if len(versions) < 2:
+        return history.groupby(['mode', 'rows', 'stage'])[['seconds', 'peak_mb']].last()
+    previous, current = versions.iloc[-2], versions.iloc[-1]
+    latest = history.groupby(['version', 'mode', 'rows', 'stage'])['seconds'].last()
+    table = pd.DataFrame({previous: latest[previous], current: latest[current]}).dropna()
+    table['ratio'] = table[current] / table[previous]
+    table['regression'] = table['ratio'] > REGRESSION_THRESHOLD
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help='input sizes in rows (e.g. 1e3 1e6 1e8)')
+    parser.add_argument('--modes', nargs='+', default=['memory', 'stream'], choices=list(RUNNERS))
+    parser.add_argument('--cities', type=int, default=10, help='number of synthetic cities')
+    parser.add_argument('--history', default=HISTORY_PATH, help='benchmark history file')
+    parser.add_argument('--data-dir', default=None, help='keep generated CSVs here for reuse')
+    parser.add_argument('--report', action='store_true', help='only compare the last two versions')
+    args = parser.parse_args()
+    if not args.report:
+        run_benchmarks([int(size) for size in args.sizes], args.modes, args.cities,
+                       args.history, args.data_dir)
+    print("\n===== BENCHMARK REPORT =====")
+    print(report(args.history).to_string())
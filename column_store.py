@@ -0,0 +1,105 @@
+"""
+Columnar on-disk cache for parsed switchback data.
+
+The validated, normalized table produced by data_loader.load_data is written
+once to a directory holding one .npy file per column plus a small JSON
+manifest. Later runs memory-map only the columns they need instead of
+re-parsing the CSV. The manifest records the size and mtime of the source CSV,
+so the store is rebuilt automatically whenever the CSV changes.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_PATH, load_data
+
+MANIFEST = 'manifest.json'
+
+def store_path(file_path):
+    """Default store directory for a CSV: data/.cache/<file name without extension>."""
+    directory, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(directory, '.cache', os.path.splitext(name)[0])
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_fresh(file_path=DATA_PATH, store_dir=None):
+    """Return True if the store exists and was built from the current version of the CSV."""
+    manifest = _read_manifest(store_dir or store_path(file_path))
+    return manifest is not None and manifest['source'] == _source_signature(file_path)
+
+def write_column_store(file_path=DATA_PATH, store_dir=None, df=None):
+    """
+    Convert the switchback CSV into a memory-mappable column store.
+
+    Args:
+        file_path (str): Source CSV
+        store_dir (str): Output directory; defaults to store_path(file_path)
+        df (DataFrame): Already-parsed table to write instead of re-reading the CSV
+
+    Returns:
+        str: The store directory
+    """
+    store_dir = store_dir or store_path(file_path)
+    os.makedirs(store_dir, exist_ok=True)
+    # Take the signature before parsing so a concurrent edit leaves the store stale
+    source = _source_signature(file_path)
+    if df is None:
+        df = load_data(file_path)
+
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(store_dir, f'{name}.npy'), column.cat.codes.to_numpy())
+            columns[name] = {'kind': 'category', 'categories': [str(c) for c in column.cat.categories]}
+        else:
+            np.save(os.path.join(store_dir, f'{name}.npy'), column.to_numpy())
+            columns[name] = {'kind': 'array'}
+
+    # Write the manifest last: a store without one is treated as missing
+    manifest = {'source': source, 'rows': len(df), 'columns': columns}
+    tmp_path = os.path.join(store_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST))
+    return store_dir
+
+def load_columns(columns=None, file_path=DATA_PATH, store_dir=None):
+    """
+    Memory-map the requested columns of the switchback table.
+
+    The store is (re)built first if it is missing or older than the CSV.
+
+    Args:
+        columns (list): Columns to read; all columns if None
+        file_path (str): Source CSV
+        store_dir (str): Store directory; defaults to store_path(file_path)
+
+    Returns:
+        DataFrame: Read-only frame backed by the memory-mapped column files
+    """
+    store_dir = store_dir or store_path(file_path)
+    if not is_fresh(file_path, store_dir):
+        write_column_store(file_path, store_dir)
+    manifest = _read_manifest(store_dir)
+
+    data = {}
+    for name in columns or list(manifest['columns']):
+        spec = manifest['columns'][name]
+        values = np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r')
+        if spec['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, spec['categories'])
+        data[name] = values
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,208 @@
+"""
+Pre-aggregated cube of sufficient statistics for arbitrary slice comparisons.
+
+Periods are aggregated once into cells indexed by city x service date x
+period-of-day x treat x commute (weekday is carried along as a function of the
+date). Each cell holds the row count and, for every base column of
+switchbacks.csv and every per-period metric in metric_engine.METRICS, the
+number of finite values, their sum and their sum of squared deviations
+from the cell mean, so a ratio metric that is undefined in some periods (no
+requests, no trips) only drops those periods. The cross-products of the base
+columns are stored too, so that ratio metrics can be tested as ratios of
+totals (compare_ratio_slices). Any two-group comparison, such as treatment vs. control
+on Mondays during commuting hours, is answered by rolling up matching cells,
+so query latency depends on the number of cells, not on the number of rows.
+Cells are pooled with the pairwise (Chan et al.) update, and cubes can be
+merged the same way as new data arrives.
+
+Usage:
+    python cube.py [path/to/switchbacks.csv] [cube.csv]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_loader import COUNT_COLUMNS, DATA_PATH, load_data, period_of_day, service_day
+from metric_engine import METRICS, PROBLEM2_METRICS, get_metrics, group_sums, metric_matrix, ratio_stats, summarize_groups
+
+DIMENSIONS = ['city_id', 'date', 'period_of_day', 'weekday', 'treat', 'commute']
+BASE_COLUMNS = COUNT_COLUMNS + ['total_driver_payout']
+# Metrics that are not simply a base column (rider_cancellations is both)
+METRIC_COLUMNS = [name for name in METRICS if name not in BASE_COLUMNS]
+MEASURES = BASE_COLUMNS + METRIC_COLUMNS
+# Pairs of base columns whose cross-products are stored as 'xp_<a>:<b>'
+CROSS_PRODUCTS = [(a, b) for i, a in enumerate(BASE_COLUMNS) for b in BASE_COLUMNS[i + 1:]]
+
+def _statistic_columns():
+    return (['n'] + [f'n_{m}' for m in MEASURES] + [f'sum_{m}' for m in MEASURES]
+            + [f'm2_{m}' for m in MEASURES] + [f'xp_{a}:{b}' for a, b in CROSS_PRODUCTS])
+
+def _pool(cells, codes, n_groups):
+    """
+    Pool the statistics of cells into n_groups groups.
+
+    Counts, sums and cross-products add up; the squared deviations of each
+    measure also collect the spread of the cell means around the group mean.
+
+    Returns:
+        DataFrame: n_groups rows of statistic columns
+    """
+    k = len(MEASURES)
+    stats = cells[_statistic_columns()].to_numpy(dtype=float)
+    counts, sums, m2 = stats[:, 1:1 + k], stats[:, 1 + k:1 + 2 * k], stats[:, 1 + 2 * k:1 + 3 * k]
+    _, totals = group_sums(stats, codes, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = totals[:, 1 + k:1 + 2 * k] / totals[:, 1:1 + k]
+        spread = np.where(counts > 0, counts * (sums / counts - means[codes]) ** 2, 0.0)
+    totals[:, 1 + 2 * k:1 + 3 * k] += group_sums(spread, codes, n_groups)[1]
+    return pd.DataFrame(totals, columns=_statistic_columns())
+
+def _aggregate(cells):
+    """Pool cells with the same DIMENSIONS (sorted by them)."""
+    groups = cells.groupby(DIMENSIONS, sort=True)
+    keys = groups.size().reset_index()[DIMENSIONS]
+    codes = groups.ngroup().to_numpy()
+    pooled = _pool(cells, codes, len(keys))
+    for column in ['n'] + [f'n_{m}' for m in MEASURES]:
+        pooled[column] = pooled[column].astype('int64')
+    return pd.concat([keys, pooled], axis=1)
+
+def build_cube(df):
+    """
+    Aggregate switchback periods into cube cells.
+
+    Returns:
+        DataFrame: One row per non-empty cell with the DIMENSIONS, 'n', and
+        'n_<measure>' (finite values), 'sum_<measure>' and 'm2_<measure>'
+        (sum of squared deviations from the cell mean) for every measure, and
+        'xp_<a>:<b>' for every pair in CROSS_PRODUCTS
+    """
+    days = service_day(df['period_start'])
+    base = df[BASE_COLUMNS].to_numpy(dtype=float)
+    values = np.column_stack([base, metric_matrix(df, get_metrics(METRIC_COLUMNS))])
+    valid = np.isfinite(values)
+    left = [BASE_COLUMNS.index(a) for a, _ in CROSS_PRODUCTS]
+    right = [BASE_COLUMNS.index(b) for _, b in CROSS_PRODUCTS]
+    rows = pd.DataFrame({
+        'city_id': df['city_id'].astype(str).to_numpy(),
+        'date': days.to_numpy(),
+        'period_of_day': period_of_day(df['period_start']).to_numpy(),
+        'weekday': days.dt.dayofweek.to_numpy(),
+        'treat': df['treat'].to_numpy(),
+        'commute': df['commute'].to_numpy(),
+        'n': 1,
+    })
+    # Each period is a cell of its own (no spread), pooled into the cube's cells
+    stats = np.column_stack([valid, np.where(valid, values, 0), np.zeros_like(values),
+                             base[:, left] * base[:, right]])
+    rows = pd.concat([rows, pd.DataFrame(stats, columns=_statistic_columns()[1:])], axis=1)
+    return _aggregate(rows)
+
+def merge_cubes(*cubes):
+    """Combine cubes built from disjoint sets of periods."""
+    return _aggregate(pd.concat(cubes, ignore_index=True))
+
+def save_cube(cube, path):
+    cube.to_csv(path, index=False)
+    return path
+
+def load_cube(path):
+    return pd.read_csv(path, parse_dates=['date'], dtype={'city_id': str})
+
+def select(cube, **filters):
+    """
+    Boolean mask of cells matching all filters.
+
+    Each filter is a dimension name mapped to a single value, a list of values,
+    or, for 'date', a (start, end) tuple of inclusive bounds.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    for dimension, condition in filters.items():
+        column = cube[dimension]
+        if dimension == 'date' and isinstance(condition, tuple):
+            start, end = condition
+            mask &= (column >= pd.Timestamp(start)).to_numpy() & (column <= pd.Timestamp(end)).to_numpy()
+        elif isinstance(condition, (list, set, np.ndarray)):
+            mask &= column.isin(list(condition)).to_numpy()
+        else:
+            mask &= (column == condition).to_numpy()
+    return mask
+
+def rollup(cube, **filters):
+    """Pool the statistics of all cells matching filters (see select) into one Series."""
+    cells = cube.loc[select(cube, **filters)]
+    return _pool(cells, np.zeros(len(cells), dtype=int), 1).iloc[0]
+
+def moments(totals, measures):
+    """(count, mean, sample variance) arrays for the given measures from rolled-up totals."""
+    n = totals[[f'n_{m}' for m in measures]].to_numpy(dtype=float)
+    sums = totals[[f'sum_{m}' for m in measures]].to_numpy(dtype=float)
+    m2 = totals[[f'm2_{m}' for m in measures]].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return n, sums / n, m2 / (n - 1)
+
+def compare_slices(cube, measures, filters_a, filters_b, alpha=0.05):
+    """
+    Welch comparison of two cube slices on every measure.
+
+    Args:
+        cube (DataFrame): Output of build_cube
+        measures (list): Names from MEASURES (base columns or METRICS)
+        filters_a (dict): Filters selecting the first group (see select)
+        filters_b (dict): Filters selecting the second group
+
+    Returns:
+        DataFrame: Same layout as metric_engine.compare_groups
+    """
+    stats_a = moments(rollup(cube, **filters_a), measures)
+    stats_b = moments(rollup(cube, **filters_b), measures)
+    counts, means, variances = (np.vstack(pair) for pair in zip(stats_a, stats_b))
+    return summarize_groups(counts, means, variances, list(measures), alpha)
+
+def gram(totals):
+    """Gram matrix over BASE_COLUMNS plus a constant (see metric_engine.group_gram) from rolled-up totals."""
+    k = len(BASE_COLUMNS)
+    matrix = np.empty((k + 1, k + 1))
+    matrix[-1, -1] = totals['n']
+    for i, column in enumerate(BASE_COLUMNS):
+        matrix[i, -1] = matrix[-1, i] = totals[f'sum_{column}']
+        matrix[i, i] = totals[f'm2_{column}'] + totals[f'sum_{column}'] ** 2 / totals['n']
+    for a, b in CROSS_PRODUCTS:
+        i, j = BASE_COLUMNS.index(a), BASE_COLUMNS.index(b)
+        matrix[i, j] = matrix[j, i] = totals[f'xp_{a}:{b}']
+    return matrix
+
+def compare_ratio_slices(cube, metrics, filters_a, filters_b, alpha=0.05):
+    """
+    Like compare_slices, but tests metrics from metric_engine.METRICS as ratios
+    of totals with delta-method standard errors (see metric_engine.ratio_stats).
+    """
+    grams = np.stack([gram(rollup(cube, **filters_a)), gram(rollup(cube, **filters_b))])
+    return summarize_groups(*ratio_stats(grams, metrics, BASE_COLUMNS), list(metrics), alpha)
+
+def main(file_path=DATA_PATH, cube_path=None):
+    cube = build_cube(load_data(file_path))
+    print(f"Cube: {len(cube)} cells")
+    if cube_path:
+        save_cube(cube, cube_path)
+        print(f"Cube saved as '{cube_path}'")
+
+    metrics = PROBLEM2_METRICS
+    print("\n===== 5-min vs. 2-min Wait, Commuting Hours (from cube) =====")
+    print(compare_slices(cube, metrics, {'treat': True, 'commute': True},
+                         {'treat': False, 'commute': True}).to_string())
+
+    print("\n===== 5-min vs. 2-min Wait, Weekday Evenings (period 4+) in the First Week =====")
+    evening = {'period_of_day': [4, 5, 6, 7, 8], 'weekday': [0, 1, 2, 3, 4],
+               'date': ('2018-02-19', '2018-02-25')}
+    print(compare_slices(cube, metrics, dict(evening, treat=True),
+                         dict(evening, treat=False)).to_string())
+
+    print("\n===== 5-min vs. 2-min Wait, Commuting Hours (ratio of totals, delta method) =====")
+    print(compare_ratio_slices(cube, metrics, {'treat': True, 'commute': True},
+                               {'treat': False, 'commute': True}).to_string())
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,127 @@
+"""
+Shared loader for the switchback experiment data.
+
+Both analysis scripts read data/switchbacks.csv through load_data, which parses
+the semicolon-separated, comma-decimal file with explicit dtypes and keeps the
+parsed frame in an in-process cache keyed by file path and modification time.
+By default rows that break a validation rule are quarantined (see validation.py)
+and only clean rows are returned.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_PATH = 'data/switchbacks.csv'
+
+# Raw file format
+SEPARATOR = ';'
+DECIMAL = ','
+PERIOD_START_FORMAT = '%d.%m.%Y %H:%M'
+
+COUNT_COLUMNS = [
+    'trips_pool',
+    'trips_express',
+    'rider_cancellations',
+    'total_matches',
+    'total_double_matches',
+]
+
+DTYPES = {
+    'city_id': 'category',
+    'period_start': str,
+    'wait_time': 'category',
+    'treat': bool,
+    'commute': bool,
+    'total_driver_payout': 'float64',
+    **{column: 'int32' for column in COUNT_COLUMNS},
+}
+
+# Each service day starts with the 7:00 period and has nine 160-minute periods,
+# so periods after midnight belong to the previous day's schedule
+SERVICE_DAY_START = pd.Timedelta(hours=7)
+PERIOD_LENGTH = pd.Timedelta(minutes=160)
+PERIODS_PER_DAY = 9
+# Commute periods are the 7:00 and 15:00 periods of weekdays
+COMMUTE_PERIODS = (0, 3)
+
+# (absolute path, mtime in ns) -> parsed DataFrame
+_cache = {}
+
+def _cache_key(file_path):
+    path = os.path.abspath(file_path)
+    return path, os.stat(path).st_mtime_ns
+
+def read_switchbacks(file_path, **kwargs):
+    """
+    Parse a switchbacks CSV without caching.
+
+    Extra keyword arguments are passed to pandas.read_csv (e.g. usecols, chunksize).
+    """
+    usecols = kwargs.get('usecols')
+    dtypes = DTYPES if usecols is None else {c: t for c, t in DTYPES.items() if c in usecols}
+    reader = pd.read_csv(
+        file_path,
+        sep=SEPARATOR,
+        decimal=DECIMAL,
+        dtype=dtypes,
+        encoding='utf-8-sig',
+        **kwargs,
+    )
+    if kwargs.get('chunksize') is not None:
+        return (normalize(chunk) for chunk in reader)
+    return normalize(reader)
+
+def normalize(df):
+    """Parse period_start into timestamps, in place, and return df."""
+    if 'period_start' in df.columns:
+        df['period_start'] = pd.to_datetime(df['period_start'], format=PERIOD_START_FORMAT)
+    return df
+
+def service_day(period_start):
+    """Service day (as a midnight timestamp) that each period belongs to."""
+    return (pd.Series(period_start) - SERVICE_DAY_START).dt.floor('D')
+
+def period_of_day(period_start):
+    """Index (0-8) of each period within its service day, 0 being the 7:00 period."""
+    offset = pd.Series(period_start) - SERVICE_DAY_START - service_day(period_start)
+    return (offset // PERIOD_LENGTH).astype('int32')
+
+def period_numbers(period_start):
+    """Global index of each period's slot: service days since the epoch times PERIODS_PER_DAY plus the slot."""
+    offset = (pd.Series(period_start) - SERVICE_DAY_START).to_numpy().astype('datetime64[m]').astype(np.int64)
+    day, minute = np.divmod(offset, 24 * 60)
+    return day * PERIODS_PER_DAY + minute // int(PERIOD_LENGTH.total_seconds() // 60)
+
+def is_commute(period_start):
+    """Whether each period is a commute period (see COMMUTE_PERIODS)."""
+    weekday = service_day(period_start).dt.dayofweek < 5
+    return period_of_day(period_start).isin(COMMUTE_PERIODS) & weekday
+
+def load_data(file_path=DATA_PATH, validate=True):
+    """
+    Load the switchback CSV, reusing the already-parsed frame if the file is unchanged.
+
+    With validate, bad rows are written to validation.QUARANTINE_PATH and dropped
+    (see validation.load_validated). The returned DataFrame is shared between
+    callers and must not be modified in place.
+    """
+    key = _cache_key(file_path) + (validate,)
+    df = _cache.get(key)
+    if df is None:
+        if validate:
+            # Imported here because validation builds on this module
+            from validation import load_validated
+            df = load_validated(file_path)
+        else:
+            df = read_switchbacks(file_path)
+        # Drop stale entries for the same path before caching the new version
+        for stale in [k for k in _cache if k[0] == key[0] and k[1] != key[1]]:
+            del _cache[stale]
+        _cache[key] = df
+    return df
+
+def clear_cache():
+    """Forget all cached frames."""
+    _cache.clear()
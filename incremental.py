@@ -0,0 +1,166 @@
+"""
+Incremental update of experiment results as new switchback periods arrive.
+
+Per-(city, treat, commute) sufficient statistics (count, mean and M2 of every
+metric) are kept in a small JSON state file. Each delta CSV of new periods is
+folded into the state with the same mergeable update as streaming.py, so an
+update costs time proportional to the delta, not the full history. Updated
+Problem 1 and Problem 2 comparisons (differences and Welch t-tests) are then
+computed from the state alone. Undefined ratio values (periods without
+requests or trips) are skipped per metric, so they never reach the state.
+
+Usage:
+    python incremental.py state.json delta.csv [delta.csv ...] [--results results.jsonl]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import read_switchbacks
+from metric_engine import PROBLEM1_METRICS, PROBLEM2_METRICS, base_columns, get_metrics, metric_matrix
+from results_io import table_to_records, write_results
+from streaming import GROUPS, RunningStats, group_codes
+
+STATE_METRICS = list(dict.fromkeys(PROBLEM1_METRICS + PROBLEM2_METRICS))
+
+# (experiment, segment, (label, cell) of group a, (label, cell) of group b, metrics),
+# with cells as (treat, commute)
+COMPARISONS = [
+    ('problem1', 'control', ('commute', (False, True)), ('non-commute', (False, False)), PROBLEM1_METRICS),
+    ('problem2', 'commute', ('treatment', (True, True)), ('control', (False, True)), PROBLEM2_METRICS),
+    ('problem2', 'non-commute', ('treatment', (True, False)), ('control', (False, False)), PROBLEM2_METRICS),
+]
+
+class ExperimentState:
+    """Running statistics per city and (treat, commute) cell, plus the deltas already applied."""
+
+    def __init__(self, metrics=STATE_METRICS):
+        self.metrics = list(metrics)
+        self.cities = []
+        self.running = RunningStats(0, len(self.metrics))
+        self.applied = []
+
+    def city_index(self, city):
+        """Index of city, adding empty groups for a city seen for the first time."""
+        if city not in self.cities:
+            self.cities.append(city)
+            self.running.resize(len(self.cities) * len(GROUPS))
+        return self.cities.index(city)
+
+    def fold(self, df):
+        """Fold a frame of new periods into the state."""
+        cities = df['city_id'].astype(str).to_numpy()
+        names, inverse = np.unique(cities, return_inverse=True)
+        city_ids = np.array([self.city_index(name) for name in names])
+        codes = city_ids[inverse] * len(GROUPS) + group_codes(df['treat'], df['commute'])
+        # Undefined ratios come out as NaN or inf and are skipped by RunningStats
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = metric_matrix(df, get_metrics(self.metrics))
+        self.running.update(values, codes)
+        return self
+
+    def compare(self, city, group_a, group_b, metrics):
+        """Welch comparison table between two cells of one city, for the given metrics."""
+        offset = self.cities.index(city) * len(GROUPS)
+        table = self.running.compare(
+            offset + GROUPS.index(group_a), offset + GROUPS.index(group_b), self.metrics
+        )
+        return table.loc[metrics]
+
+    def save(self, path):
+        """Write the state atomically to path."""
+        data = {'metrics': self.metrics, 'cities': self.cities,
+                'applied': self.applied, 'running': self.running.to_dict()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, allow_nan=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a state saved with save, or return an empty state if path does not exist.
+
+        Raises:
+            ValueError: If the saved statistics are not finite (a state written before
+                undefined values were skipped); rebuild it from the delta files
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        state = cls(data['metrics'])
+        state.cities = data['cities']
+        state.applied = data['applied']
+        state.running = RunningStats.from_dict(data['running'])
+        if not all(np.isfinite(x).all() for x in (state.running.count, state.running.mean, state.running.m2)):
+            raise ValueError(f"State '{path}' holds non-finite statistics; rebuild it from the delta files")
+        state.running.resize(len(state.cities) * len(GROUPS))
+        return state
+
+def file_digest(path):
+    """SHA-256 of a file, used to refuse folding the same delta twice."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def apply_delta(state, delta_path):
+    """
+    Fold a delta CSV of new periods into state.
+
+    Returns:
+        bool: False if this exact file was already applied (state unchanged)
+    """
+    digest = file_digest(delta_path)
+    if digest in state.applied:
+        return False
+    columns = ['city_id', 'treat', 'commute'] + base_columns(get_metrics(state.metrics))
+    state.fold(read_switchbacks(delta_path, usecols=columns))
+    state.applied.append(digest)
+    return True
+
+def current_results(state):
+    """
+    Problem 1 and Problem 2 comparisons for every city, from the state alone.
+
+    Returns:
+        list: Result records (see results_io.table_to_records)
+    """
+    records = []
+    for city in state.cities:
+        for experiment, segment, (label_a, cell_a), (label_b, cell_b), metrics in COMPARISONS:
+            table = state.compare(city, cell_a, cell_b, metrics)
+            records.extend(table_to_records(
+                table, experiment=experiment, city_id=city, segment=segment,
+                group_a=label_a, group_b=label_b
+            ))
+    return records
+
+def update(state_path, delta_paths, results_path=None):
+    """Apply delta files to the state file and return the updated results as a DataFrame."""
+    state = ExperimentState.load(state_path)
+    for delta_path in delta_paths:
+        if not apply_delta(state, delta_path):
+            print(f"Skipping '{delta_path}': already applied")
+    state.save(state_path)
+    records = current_results(state)
+    if results_path:
+        write_results(records, results_path)
+    return pd.DataFrame(records)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('state', help='state file (created if missing)')
+    parser.add_argument('deltas', nargs='*', help='CSV files with new periods')
+    parser.add_argument('--results', default=None, help='append updated result records here')
+    args = parser.parse_args()
+    results = update(args.state, args.deltas, args.results)
+    columns = ['experiment', 'city_id', 'segment', 'metric', 'n_a', 'n_b', 'difference', 't_stat', 'p_value']
+    print(results[columns].to_string(index=False))
@@ -0,0 +1,273 @@
+"""
+Discrete-event simulator of POOL matching under arbitrary wait windows.
+
+The experiment only observed 2- and 5-minute windows. This simulator replays
+ride requests (synthetic, or recorded with the columns of REQUEST_COLUMNS)
+through a pooling matcher with a configurable maximum wait, and reports each
+period in the switchbacks.csv schema so simulated 3-, 4- or 8-minute arms can
+be analyzed with the same scripts.
+
+Matcher:
+- Requests are processed in arrival order. A new request joins the open group
+  of the nearest earlier request within match_radius in (origin, destination)
+  space whose window has not expired; otherwise it waits to be joined.
+- A group is dispatched when it is full (3 riders) or when the wait window of
+  its first rider runs out. Riders in groups of two or more are matches, riders
+  in groups of three are double matches.
+- Every rider has an exponentially distributed patience. A rider whose patience
+  runs out while still alone cancels.
+
+Candidate partners are found with k-d trees (scipy.spatial.cKDTree) over
+time buckets one wait window wide: each request is compared with its
+nearest requests from its own and the previous bucket, and joins the group of
+the nearest eligible one. When all of those candidates are ineligible (later,
+expired or in a full group) and more requests may lie within match_radius,
+the whole radius is searched, so no eligible partner is ever dropped.
+
+Usage:
+    python matching_simulator.py [n_days] [wait minutes ...] [output.csv]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from data_loader import COMMUTE_PERIODS, PERIOD_LENGTH, PERIODS_PER_DAY, SERVICE_DAY_START
+from synthetic import START_DAY, to_raw_csv
+
+REQUEST_COLUMNS = ['time', 'origin_x', 'origin_y', 'dest_x', 'dest_y', 'express', 'patience']
+
+# Default matcher and rider assumptions (distances in km, times in seconds)
+MATCH_RADIUS_KM = 2.0
+GROUP_CAPACITY = 3
+PATIENCE_MEAN = 30 * 60
+MAX_CANDIDATES = 16
+# Driver payout per dispatched vehicle: base plus per km of the longest member trip
+PAYOUT_BASE = 3.0
+PAYOUT_PER_KM = 1.2
+CONTROL_WAIT = '2 mins'
+
+# Synthetic demand: requests per period (commute, non-commute), express share and
+# hotspot centers (km) that origins and destinations are drawn around
+REQUESTS_PER_PERIOD = (5300, 3900)
+EXPRESS_SHARE = 0.67
+HOTSPOTS = np.array([[0.0, 0.0], [3.0, 1.0], [-2.0, 2.5], [1.0, -3.0], [-3.0, -2.0]])
+HOTSPOT_SD_KM = 1.2
+
+def generate_requests(n_requests, duration=PERIOD_LENGTH.total_seconds(), express_share=EXPRESS_SHARE,
+                      patience_mean=PATIENCE_MEAN, seed=None):
+    """
+    Draw ride requests for one period: uniform arrival times, origins and
+    destinations scattered around HOTSPOTS.
+
+    Returns:
+        DataFrame: REQUEST_COLUMNS, sorted by time
+    """
+    rng = np.random.default_rng(seed)
+    origin = HOTSPOTS[rng.integers(len(HOTSPOTS), size=n_requests)]
+    dest = HOTSPOTS[rng.integers(len(HOTSPOTS), size=n_requests)]
+    origin = origin + rng.normal(0, HOTSPOT_SD_KM, (n_requests, 2))
+    dest = dest + rng.normal(0, HOTSPOT_SD_KM, (n_requests, 2))
+    return pd.DataFrame({
+        'time': np.sort(rng.uniform(0, duration, n_requests)),
+        'origin_x': origin[:, 0], 'origin_y': origin[:, 1],
+        'dest_x': dest[:, 0], 'dest_y': dest[:, 1],
+        'express': rng.random(n_requests) < express_share,
+        'patience': rng.exponential(patience_mean, n_requests),
+    })
+
+def _nearest_earlier(tree, offset, query, query_index, earliest, k, radius):
+    """
+    Up to k nearest requests of a bucket's tree for each query point, as global
+    indices and distances, with later or out-of-window requests masked out (-1, inf).
+
+    Also returns, per query point, the distance up to which the candidates are
+    complete: the k-th distance if all k were within radius (there may be more
+    beyond it), else inf.
+    """
+    k = min(k, tree.n)
+    distance, index = tree.query(query, k=k, distance_upper_bound=radius, workers=-1)
+    distance, index = distance.reshape(len(query), k), index.reshape(len(query), k)
+    found = index < tree.n
+    complete_to = np.where(found[:, -1] & (k < tree.n), distance[:, -1], np.inf)
+    index = np.where(found, index + offset, -1)
+    valid = found & (index < query_index[:, None]) & (index >= earliest[:, None])
+    return np.where(valid, index, -1), np.where(valid, distance, np.inf), complete_to
+
+def _within_radius(trees, points, i, earliest, radius):
+    """All earlier in-window requests within radius of request i in the given (tree, offset) buckets, nearest first."""
+    index = np.concatenate([np.asarray(tree.query_ball_point(points[i], radius), dtype=int) + offset
+                            for tree, offset in trees])
+    index = index[(index < i) & (index >= earliest)]
+    distance = np.linalg.norm(points[index] - points[i], axis=1)
+    return index[np.argsort(distance, kind='stable')]
+
+def simulate_period(requests, max_wait, radius=MATCH_RADIUS_KM, capacity=GROUP_CAPACITY,
+                    max_candidates=MAX_CANDIDATES):
+    """
+    Run the matcher over one period of requests.
+
+    Requests are processed one wait window (time bucket) at a time, so memory
+    is bounded by the busiest window rather than by the period volume.
+
+    Args:
+        requests (DataFrame): REQUEST_COLUMNS (any order of rows)
+        max_wait (float): Wait window in seconds
+        radius (float): Match radius in (origin, destination) space, km
+        capacity (int): Riders per vehicle
+        max_candidates (int): Nearest requests fetched per bucket searched before
+            falling back to a full radius search
+
+    Returns:
+        dict: Period totals in the switchbacks.csv schema (count columns and payout)
+    """
+    requests = requests.sort_values('time', kind='stable')
+    times = requests['time'].to_numpy(dtype=float)
+    patience = requests['patience'].to_numpy(dtype=float)
+    points = requests[['origin_x', 'origin_y', 'dest_x', 'dest_y']].to_numpy(dtype=float)
+    n = len(times)
+
+    group = np.full(n, -1)
+    group_size = []
+    group_deadline = []
+
+    def join(i, j):
+        """Add request i to the group of earlier request j if that group is still open."""
+        g = group[j]
+        if g < 0:
+            # Still alone: must neither have given up nor timed out
+            if times[i] - times[j] >= min(patience[j], max_wait):
+                return False
+            g = group[j] = len(group_size)
+            group_size.append(1)
+            group_deadline.append(times[j] + max_wait)
+        elif group_size[g] >= capacity or times[i] >= group_deadline[g]:
+            return False
+        group[i] = g
+        group_size[g] += 1
+        return True
+
+    earliest = np.searchsorted(times, times - max_wait)
+    buckets = (times // max_wait).astype(np.int64)
+    starts = np.searchsorted(buckets, np.arange(buckets[-1] + 2)) if n else np.zeros(1, dtype=int)
+    previous = None
+    for bucket in range(len(starts) - 1):
+        lo, hi = starts[bucket], starts[bucket + 1]
+        if lo == hi:
+            previous = None
+            continue
+        tree = cKDTree(points[lo:hi])
+        query_index = np.arange(lo, hi)
+        trees = [(tree, lo)] if previous is None else [(tree, lo), previous]
+        # Candidate partners: nearest earlier requests of this and the previous window
+        index, distance, complete_to = _nearest_earlier(tree, lo, points[lo:hi], query_index, earliest[lo:hi],
+                                                        max_candidates + 1, radius)
+        if previous is not None:
+            prev_index, prev_distance, prev_complete_to = _nearest_earlier(
+                *previous, points[lo:hi], query_index, earliest[lo:hi], max_candidates, radius)
+            index = np.hstack([index, prev_index])
+            distance = np.hstack([distance, prev_distance])
+            complete_to = np.minimum(complete_to, prev_complete_to)
+        order = np.argsort(distance, axis=1, kind='stable')
+        index = np.take_along_axis(index, order, axis=1)
+        distance = np.take_along_axis(distance, order, axis=1)
+
+        for k, i in enumerate(query_index):
+            joined = False
+            for j, d in zip(index[k], distance[k]):
+                # Beyond complete_to, closer requests may not have been fetched
+                if j < 0 or d > complete_to[k]:
+                    break
+                if join(i, j):
+                    joined = True
+                    break
+            if not joined and np.isfinite(complete_to[k]):
+                for j in _within_radius(trees, points, i, earliest[i], radius):
+                    if join(i, j):
+                        break
+        previous = (tree, lo)
+
+    group_size = np.append(np.asarray(group_size, dtype=int), 0)
+    size = group_size[group]
+    cancelled = (group < 0) & (patience < max_wait)
+    riding = ~cancelled
+    express = requests['express'].to_numpy(dtype=bool)
+
+    # One vehicle per group and per unmatched rider, paid by its longest member trip
+    distance = np.hypot(points[:, 2] - points[:, 0], points[:, 3] - points[:, 1])
+    vehicle = np.where(group >= 0, group, len(group_size) + np.arange(n))[riding]
+    _, vehicle = np.unique(vehicle, return_inverse=True)
+    longest = np.zeros(vehicle.max() + 1 if len(vehicle) else 0)
+    np.maximum.at(longest, vehicle, distance[riding])
+    payout = (PAYOUT_BASE + PAYOUT_PER_KM * longest).sum()
+
+    return {
+        'trips_pool': int((riding & ~express).sum()),
+        'trips_express': int((riding & express).sum()),
+        'rider_cancellations': int(cancelled.sum()),
+        'total_driver_payout': round(float(payout), 5),
+        'total_matches': int((size >= 2).sum()),
+        'total_double_matches': int((size >= 3).sum()),
+    }
+
+def wait_label(minutes):
+    return f'{minutes:g} mins'
+
+def simulate_switchbacks(n_days, wait_minutes=(2, 5), requests_per_period=REQUESTS_PER_PERIOD,
+                         city='Boston', seed=None, radius=MATCH_RADIUS_KM):
+    """
+    Simulate a switchback experiment that randomly assigns each 160-minute
+    period to one of the wait windows.
+
+    Args:
+        n_days (int): Service days to simulate
+        wait_minutes (list): Wait windows in minutes; '2 mins' is the control arm
+        requests_per_period (tuple): Requests per (commute, non-commute) period
+
+    Returns:
+        DataFrame: Normalized switchback table (same columns and dtypes as data_loader.load_data)
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for day in range(n_days):
+        for slot in range(PERIODS_PER_DAY):
+            commute = slot in COMMUTE_PERIODS and (START_DAY + pd.Timedelta(days=day)).dayofweek < 5
+            minutes = wait_minutes[rng.integers(len(wait_minutes))]
+            volume = rng.poisson(requests_per_period[0 if commute else 1])
+            requests = generate_requests(volume, seed=rng.integers(2 ** 63))
+            totals = simulate_period(requests, minutes * 60, radius)
+            start = START_DAY + SERVICE_DAY_START + pd.Timedelta(days=day) + slot * PERIOD_LENGTH
+            rows.append({'city_id': city, 'period_start': start, 'wait_time': wait_label(minutes),
+                         'treat': wait_label(minutes) != CONTROL_WAIT, 'commute': commute, **totals})
+
+    df = pd.DataFrame(rows)
+    labels = [wait_label(m) for m in sorted(set(wait_minutes))]
+    df['city_id'] = df['city_id'].astype('category')
+    df['wait_time'] = pd.Categorical(df['wait_time'], categories=labels)
+    count_columns = ['trips_pool', 'trips_express', 'rider_cancellations', 'total_matches', 'total_double_matches']
+    df[count_columns] = df[count_columns].astype('int32')
+    return df
+
+def main(n_days=14, wait_minutes=(2, 3, 4, 5, 8), output=None):
+    df = simulate_switchbacks(n_days, wait_minutes, seed=0)
+    rides = df['trips_pool'] + df['trips_express']
+    summary = pd.DataFrame({
+        'periods': df.groupby('wait_time', observed=True).size(),
+        'rides': rides.groupby(df['wait_time'], observed=True).mean(),
+        'match_rate': (df['total_matches'] / rides).groupby(df['wait_time'], observed=True).mean(),
+        'double_match_rate': (df['total_double_matches'] / rides).groupby(df['wait_time'], observed=True).mean(),
+        'cancellations': df.groupby('wait_time', observed=True)['rider_cancellations'].mean(),
+    })
+    print("===== SIMULATED PERIOD AVERAGES BY WAIT WINDOW =====")
+    print(summary.to_string())
+    if output:
+        to_raw_csv(df, output)
+        print(f"Simulated switchbacks saved as '{output}'")
+
+if __name__ == "__main__":
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    waits = [float(w) for w in sys.argv[2:] if not w.endswith('.csv')] or (2, 3, 4, 5, 8)
+    output = next((w for w in sys.argv[2:] if w.endswith('.csv')), None)
+    main(n_days, waits, output)
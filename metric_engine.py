@@ -0,0 +1,286 @@
+"""
+Vectorized metric engine for the switchback analyses.
+
+Every metric is declared once as a ratio of two linear combinations of the raw
+columns in switchbacks.csv. The engine turns the declarations into weight
+matrices, evaluates all metrics for all rows with two matrix products, and then
+computes group counts, means, variances and Welch t-tests for every metric in a
+single NumPy pass.
+
+Ratio metrics can also be estimated as ratios of totals, with delta-method
+variances computed from per-group sums, sums of squares and cross-products
+alone (ratio_stats), so aggregated backends never need the rows.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Average prices paid by riders (Problem 1 assumption)
+POOL_PRICE = 12.5
+EXPRESS_PRICE = 10.0
+
+# A metric is numerator / denominator, where both are {column: weight} dicts.
+# A denominator of None means the metric is the numerator itself.
+Metric = namedtuple('Metric', ['name', 'numerator', 'denominator'])
+
+RIDES = {'trips_pool': 1.0, 'trips_express': 1.0}
+REVENUE = {'trips_pool': POOL_PRICE, 'trips_express': EXPRESS_PRICE}
+
+METRICS = {
+    'total_rides': Metric('total_rides', RIDES, None),
+    'express_share': Metric('express_share', {'trips_express': 1.0}, RIDES),
+    'revenue': Metric('revenue', REVENUE, None),
+    'profit_per_trip': Metric(
+        'profit_per_trip', dict(REVENUE, total_driver_payout=-1.0), RIDES
+    ),
+    'match_rate': Metric('match_rate', {'total_matches': 1.0}, RIDES),
+    'double_match_rate': Metric('double_match_rate', {'total_double_matches': 1.0}, RIDES),
+    'driver_payout_per_trip': Metric(
+        'driver_payout_per_trip', {'total_driver_payout': 1.0}, RIDES
+    ),
+    'rider_cancellations': Metric('rider_cancellations', {'rider_cancellations': 1.0}, None),
+}
+
+# Metrics compared in Problem 1 (commute vs non-commute) and Problem 2 (5- vs 2-minute wait)
+PROBLEM1_METRICS = ['total_rides', 'express_share', 'revenue', 'profit_per_trip']
+PROBLEM2_METRICS = ['total_rides', 'rider_cancellations', 'driver_payout_per_trip', 'match_rate', 'double_match_rate']
+
+def get_metrics(names):
+    """Look up metric declarations by name."""
+    return [METRICS[name] for name in names]
+
+def base_columns(metrics):
+    """Return the raw columns needed to evaluate the given metrics, in a stable order."""
+    columns = []
+    for metric in metrics:
+        for weights in (metric.numerator, metric.denominator or {}):
+            for column in weights:
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+def build_weights(metrics, columns):
+    """
+    Build numerator and denominator weight matrices of shape (len(columns) + 1, len(metrics)).
+
+    The extra last row is a constant term, used to give metrics without a
+    denominator a denominator of one.
+    """
+    index = {column: i for i, column in enumerate(columns)}
+    numerator = np.zeros((len(columns) + 1, len(metrics)))
+    denominator = np.zeros((len(columns) + 1, len(metrics)))
+    for j, metric in enumerate(metrics):
+        for column, weight in metric.numerator.items():
+            numerator[index[column], j] = weight
+        if metric.denominator is None:
+            denominator[-1, j] = 1.0
+        else:
+            for column, weight in metric.denominator.items():
+                denominator[index[column], j] = weight
+    return numerator, denominator
+
+def column_matrix(df, columns):
+    """Stack the given columns into a float matrix with a trailing constant column."""
+    values = np.empty((len(df), len(columns) + 1))
+    for i, column in enumerate(columns):
+        values[:, i] = df[column].to_numpy(dtype=float)
+    values[:, -1] = 1.0
+    return values
+
+def metric_matrix(df, metrics):
+    """Evaluate all metrics for every row of df, returning an (n_rows, n_metrics) array."""
+    columns = base_columns(metrics)
+    numerator, denominator = build_weights(metrics, columns)
+    values = column_matrix(df, columns)
+    return (values @ numerator) / (values @ denominator)
+
+def group_sums(values, codes, n_groups):
+    """
+    Per-group row counts and column sums of values.
+
+    Rows are sorted by group once and summed with np.add.reduceat, so the cost
+    is O(n_rows log n_rows) regardless of the number of groups.
+
+    Args:
+        values (ndarray): (n_rows, n_metrics) values
+        codes (ndarray): integer group code per row; rows with a negative code are ignored
+        n_groups (int): number of groups
+
+    Returns:
+        tuple: (counts of shape (n_groups,), sums of shape (n_groups, n_metrics))
+    """
+    codes = np.asarray(codes)
+    valid = codes >= 0
+    order = np.argsort(codes[valid], kind='stable')
+    sorted_codes = codes[valid][order]
+    sorted_values = values[valid][order]
+    counts = np.bincount(sorted_codes, minlength=n_groups).astype(float)
+    sums = np.zeros((n_groups, values.shape[1]))
+    if len(sorted_codes):
+        present = counts > 0
+        starts = np.searchsorted(sorted_codes, np.flatnonzero(present))
+        sums[present] = np.add.reduceat(sorted_values, starts, axis=0)
+    return counts, sums
+
+def group_stats(values, codes, n_groups):
+    """
+    Compute per-group count, mean and sample variance for every column of values.
+
+    Args:
+        values (ndarray): (n_rows, n_metrics) metric values
+        codes (ndarray): integer group code per row; rows with a negative code are ignored
+        n_groups (int): number of groups
+
+    Returns:
+        tuple: (counts, means, variances), each of shape (n_groups, n_metrics)
+    """
+    codes = np.asarray(codes)
+    counts, sums = group_sums(values, codes, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts[:, None]
+    # Center before squaring so large-valued metrics (revenue) keep their precision
+    valid = codes >= 0
+    centered = np.zeros_like(values)
+    centered[valid] = values[valid] - means[codes[valid]]
+    _, squares = group_sums(centered ** 2, codes, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variances = squares / (counts[:, None] - 1)
+    counts = np.repeat(counts[:, None], values.shape[1], axis=1)
+    return counts, means, variances
+
+def group_gram(values, codes, n_groups):
+    """
+    Per-group cross-product (Gram) matrices Z'Z of a column_matrix.
+
+    Because values carries a trailing constant column, each Gram matrix holds
+    the row count ([-1, -1]), the column sums ([-1, :]) and all sums of squares
+    and cross-products. Gram matrices of disjoint row sets merge by addition.
+
+    Returns:
+        ndarray: (n_groups, n_columns, n_columns)
+    """
+    k = values.shape[1]
+    products = (values[:, :, None] * values[:, None, :]).reshape(len(values), k * k)
+    _, sums = group_sums(products, codes, n_groups)
+    return sums.reshape(n_groups, k, k)
+
+def ratio_stats(gram, metrics, columns):
+    """
+    Ratio-of-totals estimates with delta-method variances from Gram matrices.
+
+    Each metric is estimated as sum(numerator) / sum(denominator) over the
+    group's periods instead of the mean of per-period ratios. The returned
+    variance is the per-period variance of the linearized metric
+    (u - R v) / mean(v), so var / n is the delta-method variance of R and the
+    arrays plug directly into summarize_groups. Metrics without a denominator
+    reduce to the ordinary mean and sample variance.
+
+    Args:
+        gram (ndarray): (n_groups, len(columns) + 1, len(columns) + 1), see group_gram
+        metrics (list): Metric declarations (or names from METRICS)
+        columns (list): Raw columns the Gram matrices were built from, in order
+
+    Returns:
+        tuple: (counts, ratios, variances), each of shape (n_groups, n_metrics)
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    numerator, denominator = build_weights(metrics, columns)
+    n = gram[:, -1, -1][:, None]
+    sums = gram[:, -1, :]
+    sum_u, sum_v = sums @ numerator, sums @ denominator
+    sum_uu = np.einsum('km,gkl,lm->gm', numerator, gram, numerator)
+    sum_vv = np.einsum('km,gkl,lm->gm', denominator, gram, denominator)
+    sum_uv = np.einsum('km,gkl,lm->gm', numerator, gram, denominator)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_u, mean_v = sum_u / n, sum_v / n
+        var_u = (sum_uu - n * mean_u ** 2) / (n - 1)
+        var_v = (sum_vv - n * mean_v ** 2) / (n - 1)
+        cov_uv = (sum_uv - n * mean_u * mean_v) / (n - 1)
+        ratios = sum_u / sum_v
+        variances = (var_u - 2 * ratios * cov_uv + ratios ** 2 * var_v) / mean_v ** 2
+    counts = np.repeat(n, len(metrics), axis=1)
+    return counts, ratios, np.maximum(variances, 0)
+
+def welch_parts(var_a, n_a, var_b, n_b):
+    """Standard error of the difference in means and Welch-Satterthwaite degrees of freedom."""
+    se_a = var_a / n_a
+    se_b = var_b / n_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+    return np.sqrt(se_a + se_b), dof
+
+def welch_ttest(mean_a, var_a, n_a, mean_b, var_b, n_b):
+    """Welch's unequal-variance t-test on summary statistics, vectorized over arrays."""
+    std_error, dof = welch_parts(var_a, n_a, var_b, n_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = (mean_a - mean_b) / std_error
+    p_val = 2 * stats.t.sf(np.abs(t_stat), dof)
+    return t_stat, p_val
+
+def compare_groups(df, metrics, group_a, group_b, alpha=0.05):
+    """
+    Compare two row subsets of df on every metric at once.
+
+    Args:
+        df (DataFrame): switchback data
+        metrics (list): Metric declarations (or names from METRICS)
+        group_a (array-like of bool): mask selecting the first group
+        group_b (array-like of bool): mask selecting the second group
+        alpha (float): significance level
+
+    Returns:
+        DataFrame: one row per metric, indexed by metric name, with counts,
+        means, variances, difference (a - b), its standard error, Welch degrees
+        of freedom and confidence interval, t-statistic, p-value and significance
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    return compare_values(metric_matrix(df, metrics), [m.name for m in metrics], group_a, group_b, alpha)
+
+def compare_values(values, names, group_a, group_b, alpha=0.05):
+    """compare_groups on precomputed (n_rows, n_metrics) metric values, e.g. adjusted ones."""
+    codes = np.full(len(values), -1)
+    codes[np.asarray(group_b, dtype=bool)] = 1
+    codes[np.asarray(group_a, dtype=bool)] = 0
+    return summarize_groups(*group_stats(values, codes, 2), names, alpha)
+
+def compare_ratios(df, metrics, group_a, group_b, alpha=0.05):
+    """
+    Like compare_groups, but tests ratio-of-totals estimates with delta-method
+    standard errors (see ratio_stats) instead of means of per-period ratios.
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    columns = base_columns(metrics)
+    codes = np.full(len(df), -1)
+    codes[np.asarray(group_b, dtype=bool)] = 1
+    codes[np.asarray(group_a, dtype=bool)] = 0
+    gram = group_gram(column_matrix(df, columns), codes, 2)
+    return summarize_groups(*ratio_stats(gram, metrics, columns), [m.name for m in metrics], alpha)
+
+def summarize_groups(counts, means, variances, names, alpha=0.05):
+    """Turn two-group (count, mean, variance) arrays into the tidy comparison table."""
+    t_stat, p_val = welch_ttest(
+        means[0], variances[0], counts[0], means[1], variances[1], counts[1]
+    )
+    std_error, dof = welch_parts(variances[0], counts[0], variances[1], counts[1])
+    margin = stats.t.ppf(1 - alpha / 2, dof) * std_error
+    table = pd.DataFrame({
+        'metric': names,
+        'n_a': counts[0].astype(int),
+        'mean_a': means[0],
+        'var_a': variances[0],
+        'n_b': counts[1].astype(int),
+        'mean_b': means[1],
+        'var_b': variances[1],
+        'difference': means[0] - means[1],
+        'std_error': std_error,
+        'dof': dof,
+        'ci_low': means[0] - means[1] - margin,
+        'ci_high': means[0] - means[1] + margin,
+        't_stat': t_stat,
+        'p_value': p_val,
+        'significant': p_val < alpha,
+    })
+    return table.set_index('metric')
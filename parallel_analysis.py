@@ -0,0 +1,154 @@
+"""
+Multi-city, multi-segment waiting-time analysis across a process pool.
+
+Runs the Problem 2 comparison (5-minute vs. 2-minute wait) for every city and
+every value of each segment cut (commute/non-commute, weekday, hour of day).
+The parent process sorts rows by city once and hands each worker only the row
+indices of its city; workers memory-map the column store, so no table is
+pickled between processes and total work stays proportional to the row count.
+
+Usage:
+    python parallel_analysis.py [--workers N] [--results PATH] [--plot-dir DIR]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analyze_problem2 import results_from_table
+from column_store import load_columns
+from data_loader import DATA_PATH, service_day
+from metric_engine import PROBLEM2_METRICS, base_columns, get_metrics, group_stats, metric_matrix, summarize_groups
+from plotting import plot_segment_comparison, render_parallel
+from results_io import city_label, table_to_records, write_results
+
+# Segment cuts: name -> function returning one label per row. Weekday is that of the
+# service day, so the periods after midnight count toward the day they close.
+SEGMENTS = {
+    'all': lambda df: np.full(len(df), 'all'),
+    'commute': lambda df: np.where(df['commute'].to_numpy(), 'commute', 'non-commute'),
+    'weekday': lambda df: service_day(df['period_start']).dt.day_name().to_numpy(),
+    'hour': lambda df: df['period_start'].dt.hour.to_numpy(),
+}
+
+METRICS = get_metrics(PROBLEM2_METRICS)
+COLUMNS = ['city_id', 'period_start', 'treat', 'commute'] + base_columns(METRICS)
+
+# Per-worker memory-mapped table, set by _init_worker
+_df = None
+
+def _init_worker(file_path):
+    global _df
+    _df = load_columns(COLUMNS, file_path)
+
+def analyze_segments(df, segments):
+    """
+    Compare treatment and control within every value of each segment cut.
+
+    All segment values of one cut are handled in a single group_stats call, with
+    treatment and control of segment value k mapped to groups 2k and 2k + 1.
+
+    Returns:
+        tuple: (rows, records). rows holds one results dict (as from
+        analyze_waiting_times) per (segment, value), with 'segment', 'value',
+        'n_treatment' and 'n_control' added; records holds the raw result
+        records (see results_io) for every metric
+    """
+    names = [metric.name for metric in METRICS]
+    values = metric_matrix(df, METRICS)
+    control = (~df['treat'].to_numpy()).astype(int)
+    city = city_label(df)
+    rows = []
+    records = []
+    for segment in segments:
+        labels, inverse = np.unique(SEGMENTS[segment](df), return_inverse=True)
+        counts, means, variances = group_stats(values, 2 * inverse + control, 2 * len(labels))
+        for k, label in enumerate(labels):
+            cells = slice(2 * k, 2 * k + 2)
+            table = summarize_groups(counts[cells], means[cells], variances[cells], names)
+            results = {'segment': segment, 'value': label}
+            results['n_treatment'] = int(counts[2 * k, 0])
+            results['n_control'] = int(counts[2 * k + 1, 0])
+            results.update(results_from_table(table))
+            rows.append(results)
+            records.extend(table_to_records(
+                table, experiment='problem2', city_id=city, segment=f'{segment}={label}',
+                group_a='treatment', group_b='control'
+            ))
+    return rows, records
+
+def _analyze_city(task):
+    city, index, segments = task
+    rows, records = analyze_segments(_df.take(index), segments)
+    for results in rows:
+        results['city_id'] = city
+    return rows, records
+
+def run_parallel(segments=('all', 'commute', 'weekday', 'hour'), file_path=DATA_PATH, max_workers=None,
+                 results_path=None):
+    """
+    Fan (city x segment) analyses out over a process pool.
+
+    Args:
+        segments (tuple): Names from SEGMENTS
+        file_path (str): Switchbacks CSV (read through the column store)
+        max_workers (int): Pool size; defaults to the number of CPUs
+        results_path (str): If given, raw result records are appended there
+            (see results_io.write_results) as each city finishes
+
+    Returns:
+        DataFrame: One row per (city, segment, value) with the results dict fields as columns
+    """
+    # Build (or refresh) the column store once, before the workers map it
+    cities = load_columns(['city_id'], file_path)['city_id']
+    codes = cities.cat.codes.to_numpy()
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(cities.cat.categories) + 1))
+    tasks = [
+        (city, order[bounds[i]:bounds[i + 1]], segments)
+        for i, city in enumerate(cities.cat.categories)
+        if bounds[i + 1] > bounds[i]
+    ]
+
+    max_workers = min(max_workers or os.cpu_count(), len(tasks))
+    rows = []
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(file_path,)) as pool:
+        for city_rows, records in pool.map(_analyze_city, tasks):
+            rows.extend(city_rows)
+            if results_path:
+                write_results(records, results_path)
+
+    combined = pd.DataFrame(rows)
+    leading = ['city_id', 'segment', 'value', 'n_treatment', 'n_control']
+    return combined[leading + [c for c in combined.columns if c not in leading]]
+
+def plot_segments(combined, output_dir, max_workers=None):
+    """
+    Render one figure per (city, segment cut) in parallel worker processes.
+
+    Returns:
+        list: Paths of the written PNG files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for (city, segment), group in combined.groupby(['city_id', 'segment'], sort=False):
+        path = os.path.join(output_dir, f'{city}_{segment}.png')
+        jobs.append((plot_segment_comparison, (city, segment, group.to_dict('records'), path)))
+    return render_parallel(jobs, max_workers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=None, help='process pool size')
+    parser.add_argument('--results', default=None,
+                        help='append raw result records to this .jsonl file or .parquet dataset')
+    parser.add_argument('--plot-dir', default=None,
+                        help='also render one figure per city and segment cut into this directory')
+    args = parser.parse_args()
+    combined = run_parallel(max_workers=args.workers, results_path=args.results)
+    print(combined.to_string(index=False))
+    if args.plot_dir:
+        paths = plot_segments(combined, args.plot_dir, args.workers)
+        print(f"\n{len(paths)} figures saved to '{args.plot_dir}'")
@@ -0,0 +1,355 @@
+"""
+Cached stage graph for the Problem 1 and Problem 2 reports.
+
+Each report is a small dependency graph of stages:
+
+    load -> derive -> test -> tabulate
+                  \\-> plot (Problem 1, from the per-period values)
+                          \\-> plot (Problem 2, from the test results)
+
+A stage's cache key is a hash of its name, the code it calls, its parameters
+(including the metric declarations and prices) and the keys of its inputs. The
+code is the stage function's source plus the source files of the project
+modules whose functions it calls, followed through their calls: the test stage
+depends on metric_engine and results_io, the Problem 1 plot on analyze_problem1
+and plotting, so editing a plot only reruns the plot. The
+load stage is keyed by the content of the CSV. Keys are computed before anything
+runs, so a rerun only evaluates stages whose key is not in the cache, plus
+the cached inputs those stages need. Stages that write files (summary CSVs,
+PNGs) cache the file contents too and restore them on a hit. The cache
+directory is pruned least-recently-used first to stay under a size cap.
+
+Usage:
+    python pipeline.py [problem1|problem2|all] [--plot] [--pool-price 12.5] [--express-price 10]
+"""
+
+import argparse
+import dis
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import analyze_problem1
+import analyze_problem2
+import profiling
+from data_loader import DATA_PATH
+from incremental import file_digest
+from metric_engine import (
+    EXPRESS_PRICE, POOL_PRICE, PROBLEM1_METRICS, PROBLEM2_METRICS, REVENUE, Metric, base_columns, get_metrics,
+    group_stats, metric_matrix, summarize_groups,
+)
+from results_io import city_label, render_summary, table_to_records
+from validation import load_validated
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = '.stage_cache'
+MAX_CACHE_BYTES = 512 * 2 ** 20
+# Bump to invalidate every entry, e.g. when the entry format changes
+CACHE_VERSION = 1
+
+# A stage calls func(*input values, **params); outputs lists files it writes
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'params', 'outputs'])
+
+class StageCache:
+    """Directory of pickled stage results keyed by content hash, pruned LRU to max_bytes."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Load an entry and mark it as recently used."""
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry atomically, then evict least-recently-used entries over the cap."""
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.prune(keep=path)
+
+    def prune(self, keep=None):
+        """Delete the least recently used entries until the directory fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+def _digest(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=repr).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+def _in_project(obj):
+    path = getattr(inspect.getmodule(obj), '__file__', None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR
+
+def _references(func):
+    """Project objects func loads as globals or as attributes of global modules (nested code included)."""
+    found, codes = [], [func.__code__]
+    while codes:
+        code = codes.pop()
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+        instructions = list(dis.get_instructions(code))
+        for instruction, following in zip(instructions, instructions[1:] + [None]):
+            if instruction.opname != 'LOAD_GLOBAL':
+                continue
+            value = func.__globals__.get(instruction.argval)
+            if inspect.ismodule(value) and following is not None and following.opname in ('LOAD_ATTR', 'LOAD_METHOD'):
+                value = getattr(value, following.argval, None)
+            if value is not None and not inspect.ismodule(value) and _in_project(value):
+                found.append(value)
+    return found
+
+def _stage_code(func):
+    """
+    What a stage's result depends on in code: the source of func and of the other
+    functions of its module that it calls, plus the source files of the project
+    modules holding anything else it calls, followed through those calls.
+    """
+    home = inspect.getmodule(func)
+    sources, files, seen = {}, set(), set()
+    pending = [func]
+    while pending:
+        value = inspect.unwrap(pending.pop())
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        module = inspect.getmodule(value)
+        if module is home:
+            sources[value.__qualname__] = inspect.getsource(value)
+        else:
+            files.add(os.path.abspath(module.__file__))
+        if inspect.isfunction(value):
+            pending.extend(_references(value))
+    return sources, sorted(files)
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def stage_keys(stages):
+    """Content hash of every stage, from its code, parameters and upstream keys."""
+    keys = {}
+    digests = {}
+    for stage in stages:
+        sources, files = _stage_code(stage.func)
+        code = []
+        for path in files:
+            if path not in digests:
+                digests[path] = _file_digest(path)
+            code.append((os.path.relpath(path, PROJECT_DIR), digests[path]))
+        keys[stage.name] = _digest(CACHE_VERSION, stage.name, sorted(sources.items()), code, stage.params,
+                                   stage.outputs, [keys[name] for name in stage.inputs])
+    return keys
+
+def _read_outputs(paths):
+    files = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            files[path] = f.read()
+    return files
+
+def _restore_outputs(files):
+    """Rewrite cached output files that are missing or differ on disk."""
+    for path, content in files.items():
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                if f.read() == content:
+                    continue
+        with open(path, 'wb') as f:
+            f.write(content)
+
+def run_pipeline(stages, cache):
+    """
+    Evaluate the stages (in topological order), reusing cached results.
+
+    Returns:
+        dict: stage name -> 'computed', 'cached', or 'skipped' (cached and not needed)
+    """
+    stages = {stage.name: stage for stage in stages}
+    keys = stage_keys(stages.values())
+    values = {}
+    status = {}
+
+    def resolve(name):
+        if name in values:
+            return values[name]
+        stage, key = stages[name], keys[name]
+        if key in cache:
+            value, files = cache.get(key)
+            status.setdefault(name, 'cached')
+        else:
+            inputs = [resolve(upstream) for upstream in stage.inputs]
+            with profiling.stage(f'pipeline/{name}'):
+                value = stage.func(*inputs, **stage.params)
+            files = _read_outputs(stage.outputs)
+            cache.put(key, (value, files))
+            status[name] = 'computed'
+        _restore_outputs(files)
+        values[name] = value
+        return value
+
+    # Only sinks are requested; their cached or computed inputs follow on demand
+    upstream = {name for stage in stages.values() for name in stage.inputs}
+    for name in stages:
+        if name not in upstream:
+            resolve(name)
+    cache.prune()
+    return {name: status.get(name, 'skipped') for name in stages}
+
+def load(file_path, columns, digest):
+    """
+    Validated rows (see validation.load_validated), needed columns only; digest is
+    the file's content hash (part of the cache key).
+    """
+    return load_validated(file_path)[columns]
+
+def derive(df, metrics, groups):
+    """
+    Per-period metric values and group codes for the comparisons.
+
+    Args:
+        groups (dict): Comparison label -> ((treat, commute) of group a, (treat, commute) of group b)
+    """
+    treat, commute = df['treat'].to_numpy(), df['commute'].to_numpy()
+    codes = {}
+    for label, cells in groups.items():
+        code = np.full(len(df), -1)
+        for i, (cell_treat, cell_commute) in enumerate(cells):
+            code[(treat == cell_treat) & (commute == cell_commute)] = i
+        codes[label] = code
+    return {'names': [m.name for m in metrics], 'values': metric_matrix(df, metrics),
+            'codes': codes, 'city_id': city_label(df)}
+
+def compare(derived, experiment, labels):
+    """Welch comparison records for every comparison in derived."""
+    records = {}
+    for segment, code in derived['codes'].items():
+        table = summarize_groups(*group_stats(derived['values'], code, 2), derived['names'])
+        group_a, group_b = labels[segment]
+        records[segment] = table_to_records(table, experiment=experiment, city_id=derived['city_id'],
+                                            segment=segment, group_a=group_a, group_b=group_b)
+    return records
+
+def tabulate(records, group_labels, paths):
+    """Render and save one summary CSV per comparison."""
+    tables = {}
+    for segment, path in paths.items():
+        tables[segment] = render_summary(records[segment], group_labels)
+        tables[segment].to_csv(path, index=False)
+    return tables
+
+def plot_problem1(derived):
+    values, code = derived['values'], derived['codes']['control']
+    analyze_problem1.create_visualizations(
+        pd.DataFrame(values[code == 0], columns=derived['names']),
+        pd.DataFrame(values[code == 1], columns=derived['names']),
+    )
+
+def plot_problem2(records):
+    results = {segment: analyze_problem2.results_from_table(pd.DataFrame(rows).set_index('metric'))
+               for segment, rows in records.items()}
+    analyze_problem2.create_visualizations(results['commute'], results['non-commute'])
+
+def priced_metrics(names, pool_price=POOL_PRICE, express_price=EXPRESS_PRICE):
+    """Metric declarations with the revenue terms (metric_engine.REVENUE) repriced."""
+    revenue = {'trips_pool': pool_price, 'trips_express': express_price}
+    metrics = []
+    for metric in get_metrics(names):
+        numerator = metric.numerator
+        if all(numerator.get(column) == weight for column, weight in REVENUE.items()):
+            numerator = dict(numerator, **revenue)
+        metrics.append(Metric(metric.name, numerator, metric.denominator))
+    return metrics
+
+def problem1_stages(file_path=DATA_PATH, pool_price=POOL_PRICE, express_price=EXPRESS_PRICE, plot=False):
+    metrics = priced_metrics(PROBLEM1_METRICS, pool_price, express_price)
+    columns = ['city_id', 'treat', 'commute'] + base_columns(metrics)
+    stages = [
+        Stage('problem1/load', load, [], {'file_path': file_path, 'columns': columns,
+                                          'digest': file_digest(file_path)}, []),
+        Stage('problem1/derive', derive, ['problem1/load'],
+              {'metrics': metrics, 'groups': {'control': ((False, True), (False, False))}}, []),
+        Stage('problem1/test', compare, ['problem1/derive'],
+              {'experiment': 'problem1', 'labels': {'control': ('commute', 'non-commute')}}, []),
+        Stage('problem1/tabulate', tabulate, ['problem1/test'],
+              {'group_labels': ('Commuting Hours', 'Non-Commuting Hours'),
+               'paths': {'control': 'problem1_summary.csv'}}, ['problem1_summary.csv']),
+    ]
+    if plot:
+        stages.append(Stage('problem1/plot', plot_problem1, ['problem1/derive'], {},
+                            ['problem1_visualizations.png']))
+    return stages
+
+def problem2_stages(file_path=DATA_PATH, plot=False):
+    metrics = get_metrics(PROBLEM2_METRICS)
+    columns = ['city_id', 'treat', 'commute'] + base_columns(metrics)
+    paths = {'commute': 'problem2_commuting_summary.csv', 'non-commute': 'problem2_non_commuting_summary.csv'}
+    stages = [
+        Stage('problem2/load', load, [], {'file_path': file_path, 'columns': columns,
+                                          'digest': file_digest(file_path)}, []),
+        Stage('problem2/derive', derive, ['problem2/load'],
+              {'metrics': metrics, 'groups': {'commute': ((True, True), (False, True)),
+                                              'non-commute': ((True, False), (False, False))}}, []),
+        Stage('problem2/test', compare, ['problem2/derive'],
+              {'experiment': 'problem2', 'labels': {'commute': ('treatment', 'control'),
+                                                    'non-commute': ('treatment', 'control')}}, []),
+        Stage('problem2/tabulate', tabulate, ['problem2/test'],
+              {'group_labels': ('5-min Wait (Treatment)', '2-min Wait (Control)'), 'paths': paths},
+              list(paths.values())),
+    ]
+    if plot:
+        stages.append(Stage('problem2/plot', plot_problem2, ['problem2/test'], {},
+                            ['problem2_visualizations.png']))
+    return stages
+
+def main(reports=('problem1', 'problem2'), plot=False, pool_price=POOL_PRICE, express_price=EXPRESS_PRICE,
+         cache_dir=CACHE_DIR, max_mb=MAX_CACHE_BYTES / 2 ** 20):
+    cache = StageCache(cache_dir, int(max_mb * 2 ** 20))
+    stages = []
+    if 'problem1' in reports:
+        stages += problem1_stages(pool_price=pool_price, express_price=express_price, plot=plot)
+    if 'problem2' in reports:
+        stages += problem2_stages(plot=plot)
+    status = run_pipeline(stages, cache)
+    for name, state in status.items():
+        print(f"{name:<20} {state}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('report', nargs='?', default='all', choices=['problem1', 'problem2', 'all'])
+    parser.add_argument('--plot', action='store_true', help='also render the visualizations')
+    parser.add_argument('--pool-price', type=float, default=POOL_PRICE, help='average POOL fare (Problem 1)')
+    parser.add_argument('--express-price', type=float, default=EXPRESS_PRICE, help='average Express fare (Problem 1)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='stage cache directory')
+    parser.add_argument('--max-mb', type=float, default=MAX_CACHE_BYTES / 2 ** 20, help='cache size cap in MB')
+    args = parser.parse_args()
+    reports = ('problem1', 'problem2') if args.report == 'all' else (args.report,)
+    main(reports, args.plot, args.pool_price, args.express_price, args.cache_dir, args.max_mb)
@@ -0,0 +1,100 @@
+"""
+Lazy, headless plotting helpers.
+
+matplotlib and seaborn are only imported when a figure is actually requested,
+and the non-interactive Agg backend is selected unless pyplot was already
+imported (e.g. inside a notebook). Independent figures can be rendered in
+parallel worker processes with render_parallel.
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Bar colors used across the Problem 2 figures
+TREATMENT_COLOR = 'skyblue'
+CONTROL_COLOR = 'lightgreen'
+
+_pyplot = None
+
+def get_pyplot():
+    """Import and style matplotlib.pyplot on first use, returning the module."""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        if 'matplotlib.pyplot' not in sys.modules:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        # Set styling for plots
+        sns.set(style="whitegrid")
+        plt.rcParams.update({'font.size': 12})
+        _pyplot = plt
+    return _pyplot
+
+def _render(job):
+    function, args = job
+    return function(*args)
+
+def render_parallel(jobs, max_workers=None):
+    """
+    Render figures in worker processes.
+
+    Args:
+        jobs (list): (function, args) pairs; each function must be importable at
+            module level, draw one figure and return its output path
+        max_workers (int): Pool size; defaults to the number of CPUs
+
+    Returns:
+        list: Paths returned by the jobs, in job order
+    """
+    if not jobs:
+        return []
+    max_workers = min(max_workers or os.cpu_count(), len(jobs))
+    with ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(_render, jobs))
+
+def plot_segment_comparison(city, segment, rows, path):
+    """
+    Bar charts of treatment vs. control means for every value of one segment cut.
+
+    Args:
+        city (str): City label for the title
+        segment (str): Segment cut name (e.g. 'weekday')
+        rows (list): Results dicts with 'value' and mean_<key>_treatment/_control fields
+        path (str): Output PNG path
+
+    Returns:
+        str: path
+    """
+    plt = get_pyplot()
+
+    variables = [
+        ('Total Rides', 'rides'),
+        ('Rider Cancellations', 'cancellations'),
+        ('Driver Payout per Trip ($)', 'payout'),
+        ('Match Rate', 'match_rate'),
+        ('Double Match Rate', 'double_match_rate'),
+    ]
+    labels = [str(row['value']) for row in rows]
+    x = np.arange(len(labels))
+    width = 0.4
+
+    fig, axes = plt.subplots(len(variables), 1, figsize=(max(8, 1.2 * len(labels)), 4 * len(variables)))
+    for ax, (title, key) in zip(axes, variables):
+        ax.bar(x - width / 2, [row[f'mean_{key}_treatment'] for row in rows], width,
+               label='5-min Wait', color=TREATMENT_COLOR)
+        ax.bar(x + width / 2, [row[f'mean_{key}_control'] for row in rows], width,
+               label='2-min Wait', color=CONTROL_COLOR)
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels)
+        ax.set_title(f'{title} - {city}, by {segment}')
+        ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return path
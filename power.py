@@ -0,0 +1,202 @@
+"""
+Monte Carlo power and sample-size planning for switchback experiments.
+
+The variance structure of every metric tested by the two analysis scripts is
+estimated from switchbacks.csv: a mean level for commute and non-commute
+periods, a random service-day effect shared by all periods of a day, and the
+remaining within-day noise per segment. Whole experiments of a given number of
+service days are then simulated in batches as (experiments x days x periods x
+metrics) arrays, with each period randomly switched between arms, and
+analyzed with the same Welch t-test as metric_engine.welch_ttest. The noise is
+drawn once per experiment and every relative effect size is applied to it by
+broadcasting, so a grid of effect sizes costs about as much as a single one.
+Simulated days follow the calendar from a start day, so weekend periods are
+non-commute as in the data (see data_loader.is_commute).
+
+Usage:
+    python power.py [--days 7 14 28 56] [--effects 0 0.02 0.05 0.1] [--sims 10000]
+"""
+
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    DATA_PATH, PERIOD_LENGTH, PERIODS_PER_DAY, SERVICE_DAY_START, is_commute, load_data, service_day,
+)
+from metric_engine import (
+    PROBLEM1_METRICS, PROBLEM2_METRICS, get_metrics, group_stats, group_sums, metric_matrix, welch_ttest,
+)
+from resampling import BATCH_ELEMENTS
+
+PLAN_METRICS = list(dict.fromkeys(PROBLEM1_METRICS + PROBLEM2_METRICS))
+SEGMENTS = ('commute', 'non-commute', 'all')
+DEFAULT_DAYS = [7, 14, 28, 56]
+DEFAULT_EFFECTS = [0.0, 0.02, 0.05, 0.1]
+# A Monday
+DEFAULT_START = pd.Timestamp('2024-01-01')
+
+# Per-metric levels and noise: means and within_sd are (2, n_metrics) arrays
+# indexed by commute (0 = non-commute, 1 = commute); day_sd is (n_metrics,)
+VarianceStructure = namedtuple('VarianceStructure', ['metrics', 'means', 'within_sd', 'day_sd'])
+
+def variance_structure(df, metrics=PLAN_METRICS):
+    """
+    Estimate segment means, day-effect and within-day standard deviations of metrics.
+
+    Returns:
+        VarianceStructure
+    """
+    values = metric_matrix(df, get_metrics(metrics))
+    commute = df['commute'].to_numpy().astype(int)
+    _, means, _ = group_stats(values, commute, 2)
+    residuals = values - means[commute]
+
+    _, days = np.unique(service_day(df['period_start']).to_numpy(), return_inverse=True)
+    n_days = days.max() + 1
+    day_counts, day_sums = group_sums(residuals, days, n_days)
+    day_means = day_sums / day_counts[:, None]
+    _, _, within_var = group_stats(residuals - day_means[days], commute, 2)
+    # Day means also carry within-day noise; remove its share from their spread
+    pooled_within = within_var.mean(axis=0)
+    day_var = day_means.var(axis=0, ddof=1) - pooled_within * np.mean(1 / day_counts)
+    return VarianceStructure(list(metrics), means, np.sqrt(within_var), np.sqrt(np.maximum(day_var, 0)))
+
+def _calendar(start_day, n_days):
+    """Commute flag of each period of n_days service days from start_day, as (n_days, PERIODS_PER_DAY)."""
+    offsets = pd.to_timedelta(np.arange(n_days * PERIODS_PER_DAY) * PERIOD_LENGTH)
+    period_start = pd.Timestamp(start_day).normalize() + SERVICE_DAY_START + offsets
+    return is_commute(period_start).to_numpy().reshape(n_days, PERIODS_PER_DAY)
+
+def _segment_slots(segment, commute):
+    return {'commute': commute, 'non-commute': ~commute, 'all': np.ones_like(commute)}[segment]
+
+def _arm_stats(slot_sums, slot_means, slots):
+    """
+    Per-arm count, mean and variance of the values in the selected period slots,
+    plus the mean level, covariance of values with levels and variance of levels
+    (levels being the slot means the relative effect is applied to).
+
+    Args:
+        slot_sums (tuple): (counts, sums, sums of squares) per batch, arm and slot
+        slot_means (ndarray): (n_slots, n_metrics) level of each slot
+        slots (ndarray): Boolean mask of the slots in the segment
+
+    Returns:
+        tuple: Arrays of shape (batch, 2, n_metrics), arm 0 treated and arm 1 control
+    """
+    counts, sums, squares = (x[:, :, slots] for x in slot_sums)
+    levels = slot_means[slots]
+    n = counts.sum(axis=2)[:, :, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums.sum(axis=2) / n
+        level = counts @ levels / n
+        scale = n / (n - 1)
+        variance = (squares.sum(axis=2) / n - mean ** 2) * scale
+        covariance = ((sums * levels).sum(axis=2) / n - mean * level) * scale
+        level_variance = (counts @ levels ** 2 / n - level ** 2) * scale
+    return n, mean, variance, level, covariance, level_variance
+
+def simulate_power(structure, days=DEFAULT_DAYS, effects=DEFAULT_EFFECTS, n_sims=10_000,
+                   segments=SEGMENTS, alpha=0.05, start_day=DEFAULT_START, seed=None):
+    """
+    Simulated power of the treatment vs. control Welch t-test.
+
+    Args:
+        structure (VarianceStructure): Output of variance_structure
+        days (list): Experiment lengths in service days
+        effects (list): Relative treatment effects (0.05 = +5% of the segment's level)
+        n_sims (int): Simulated experiments per experiment length
+        segments (list): Periods tested: 'commute', 'non-commute' and/or 'all'
+        alpha (float): Significance level
+        start_day (Timestamp): First service day of the simulated experiments
+
+    Returns:
+        DataFrame: One row per (metric, segment, days, effect) with the number of
+        periods in the segment and the share of experiments that rejected
+    """
+    rng = np.random.default_rng(seed)
+    effects = np.asarray(effects, dtype=float)[:, None, None]
+    n_metrics = len(structure.metrics)
+
+    rows = []
+    for n_days in days:
+        calendar = _calendar(start_day, n_days)
+        day_means = structure.means[calendar.astype(int)]
+        day_sd = structure.within_sd[calendar.astype(int)]
+        # Days with the same commute pattern (weekdays, weekend days) share their slots
+        patterns, day_pattern = np.unique(calendar, axis=0, return_inverse=True)
+        pattern_days = (day_pattern[:, None] == np.arange(len(patterns))).astype(float)
+        slot_commute = patterns.ravel()
+        slot_means = structure.means[slot_commute.astype(int)]
+        rejections = np.zeros((len(segments), len(effects), n_metrics))
+        batch_size = max(1, BATCH_ELEMENTS // (n_days * PERIODS_PER_DAY * n_metrics))
+        for start in range(0, n_sims, batch_size):
+            batch = min(batch_size, n_sims - start)
+            day_effect = rng.standard_normal((batch, n_days, 1, n_metrics)) * structure.day_sd
+            noise = rng.standard_normal((batch, n_days, PERIODS_PER_DAY, n_metrics)) * day_sd
+            values = day_means + day_effect + noise
+            treat = rng.random((batch, n_days, PERIODS_PER_DAY)) < 0.5
+            # Reduce each simulated experiment to per-arm, per-(day pattern, slot) sums
+            # once; every segment is then a sum over slots
+            arms = np.stack([treat, ~treat], axis=1).astype(float)
+            slot_sums = tuple(x.reshape(batch, 2, len(slot_commute), *x.shape[4:]) for x in (
+                np.einsum('bads,dp->baps', arms, pattern_days, optimize=True),
+                np.einsum('bads,dp,bdsm->bapsm', arms, pattern_days, values, optimize=True),
+                np.einsum('bads,dp,bdsm->bapsm', arms, pattern_days, values ** 2, optimize=True),
+            ))
+
+            for s, segment in enumerate(segments):
+                n, mean, var, level, cov, level_var = _arm_stats(
+                    slot_sums, slot_means, _segment_slots(segment, slot_commute))
+                # Treated periods get effect * their level added: shift mean and variance
+                _, p_value = welch_ttest(
+                    mean[:, 0] + effects * level[:, 0],
+                    var[:, 0] + 2 * effects * cov[:, 0] + effects ** 2 * level_var[:, 0], n[:, 0],
+                    mean[:, 1], var[:, 1], n[:, 1],
+                )
+                rejections[s] += (p_value < alpha).sum(axis=1)
+
+        for s, segment in enumerate(segments):
+            periods = int(_segment_slots(segment, calendar).sum())
+            for e, effect in enumerate(effects[:, 0, 0]):
+                for j, metric in enumerate(structure.metrics):
+                    rows.append({'metric': metric, 'segment': segment, 'days': n_days,
+                                 'periods': periods, 'effect': effect,
+                                 'power': rejections[s, e, j] / n_sims})
+    return pd.DataFrame(rows)
+
+def required_days(power, target=0.8):
+    """
+    Shortest simulated experiment reaching the target power, per metric, segment and effect.
+
+    Returns:
+        DataFrame: days and periods (NaN if no simulated length reaches the target)
+    """
+    reached = power[power['power'] >= target]
+    shortest = reached.loc[reached.groupby(['metric', 'segment', 'effect'])['days'].idxmin()]
+    index = power.set_index(['metric', 'segment', 'effect']).index.unique()
+    return shortest.set_index(['metric', 'segment', 'effect'])[['days', 'periods']].reindex(index).sort_index()
+
+def main(days=DEFAULT_DAYS, effects=DEFAULT_EFFECTS, n_sims=10_000, target=0.8, file_path=DATA_PATH):
+    df = load_data(file_path)
+    structure = variance_structure(df)
+    power = simulate_power(structure, days, effects, n_sims, start_day=service_day(df['period_start']).min(), seed=0)
+
+    print("===== SIMULATED POWER (Welch t-test, alpha = 0.05) =====")
+    table = power.pivot_table(index=['metric', 'segment', 'effect'], columns='days', values='power')
+    print(table.round(3).to_string())
+
+    print(f"\n===== SERVICE DAYS NEEDED FOR {target:.0%} POWER =====")
+    print(required_days(power, target).to_string())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, nargs='+', default=DEFAULT_DAYS, help='experiment lengths in service days')
+    parser.add_argument('--effects', type=float, nargs='+', default=DEFAULT_EFFECTS, help='relative effect sizes')
+    parser.add_argument('--sims', type=int, default=10_000, help='simulated experiments per length')
+    parser.add_argument('--target', type=float, default=0.8, help='target power for the sample-size table')
+    args = parser.parse_args()
+    main(args.days, args.effects, args.sims, args.target)
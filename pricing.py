@@ -0,0 +1,143 @@
+"""
+Vectorized pricing scenario sweep.
+
+Problem 1 values rides at a single price pair ($12.5 POOL, $10 Express). Here
+revenue and profit per trip are evaluated for a whole grid of POOL prices,
+Express prices and driver payout multipliers at once. Both metrics are linear in
+the scenario parameters:
+
+    revenue         = pool_price * trips_pool + express_price * trips_express
+    profit_per_trip = pool_price * (trips_pool / rides) + express_price * (trips_express / rides)
+                      - payout_scale * (total_driver_payout / rides)
+
+So the mean and variance of either metric in any group of periods follow from
+the mean vector and covariance matrix of three per-period columns. The whole
+grid is then a pair of matrix products per group, and the cost does not depend
+on the number of periods. Every scenario gets the commute vs. non-commute
+(control periods) and treatment vs. control (per segment) Welch t-tests.
+
+Usage:
+    python pricing.py [--pool 8 16 0.25] [--express 6 14 0.25] [--payout 0.8 1.2 0.05] [--results pricing.jsonl]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from column_store import load_columns
+from metric_engine import EXPRESS_PRICE, POOL_PRICE, summarize_groups
+from results_io import write_results
+from streaming import GROUPS, group_codes
+
+PRICE_COLUMNS = ['trips_pool', 'trips_express', 'total_driver_payout']
+
+# (comparison, segment, group a, group b) as (treat, commute) cells
+COMPARISONS = [
+    ('commute vs non-commute', 'control', (False, True), (False, False)),
+    ('treatment vs control', 'commute', (True, True), (False, True)),
+    ('treatment vs control', 'non-commute', (True, False), (False, False)),
+]
+
+def price_grid(pool_prices, express_prices, payout_scales):
+    """All combinations of the given prices and payout multipliers, one row per scenario."""
+    pool, express, payout = np.meshgrid(pool_prices, express_prices, payout_scales, indexing='ij')
+    return pd.DataFrame({'pool_price': pool.ravel(), 'express_price': express.ravel(),
+                         'payout_scale': payout.ravel()})
+
+def cell_moments(df):
+    """
+    Per-(treat, commute) count, means and covariance matrices of the period
+    columns the priced metrics are linear in.
+
+    Returns:
+        tuple: (counts (4,), means (4, 2, 3), covariances (4, 2, 3, 3)), the middle
+        axis being the revenue columns (trips_pool, trips_express, payout) and the
+        per-trip columns (the same divided by rides)
+    """
+    totals = df[PRICE_COLUMNS].to_numpy(dtype=float)
+    rides = totals[:, 0] + totals[:, 1]
+    columns = np.stack([totals, totals / rides[:, None]], axis=1)
+    codes = group_codes(df['treat'], df['commute'])
+    counts = np.zeros(len(GROUPS))
+    means = np.zeros((len(GROUPS), 2, len(PRICE_COLUMNS)))
+    covariances = np.zeros((len(GROUPS), 2, len(PRICE_COLUMNS), len(PRICE_COLUMNS)))
+    for code in range(len(GROUPS)):
+        values = columns[codes == code]
+        counts[code] = len(values)
+        if len(values):
+            means[code] = values.mean(axis=0)
+        if len(values) > 1:
+            for k in range(2):
+                covariances[code, k] = np.cov(values[:, k], rowvar=False)
+    return counts, means, covariances
+
+def sweep(df, grid, alpha=0.05):
+    """
+    Evaluate every scenario of grid on df.
+
+    Args:
+        df (DataFrame): Switchback periods with treat, commute and PRICE_COLUMNS
+        grid (DataFrame): pool_price, express_price, payout_scale per scenario (see price_grid)
+
+    Returns:
+        DataFrame: One row per (scenario, metric, comparison, segment) with the
+        scenario parameters and the columns of metric_engine.summarize_groups
+    """
+    counts, means, covariances = cell_moments(df)
+    pool, express, payout = (grid[c].to_numpy(dtype=float) for c in ['pool_price', 'express_price', 'payout_scale'])
+    weights = {
+        # Revenue ignores payout; profit per trip subtracts the scaled payout per trip
+        'revenue': (0, np.stack([pool, express, np.zeros_like(pool)])),
+        'profit_per_trip': (1, np.stack([pool, express, -payout])),
+    }
+
+    tables = []
+    for metric, (k, w) in weights.items():
+        # (cells, scenarios) means and variances of the metric
+        cell_mean = means[:, k] @ w
+        cell_var = np.einsum('is,gij,js->gs', w, covariances[:, k], w)
+        for comparison, segment, group_a, group_b in COMPARISONS:
+            rows = [GROUPS.index(group_a), GROUPS.index(group_b)]
+            cell_counts = np.repeat(counts[rows, None], len(grid), axis=1)
+            table = summarize_groups(cell_counts, cell_mean[rows], cell_var[rows], np.arange(len(grid)), alpha)
+            table = table.reset_index(drop=True)
+            table.insert(0, 'segment', segment)
+            table.insert(0, 'comparison', comparison)
+            table.insert(0, 'metric', metric)
+            tables.append(pd.concat([grid.reset_index(drop=True), table], axis=1))
+    return pd.concat(tables, ignore_index=True)
+
+def main(pool=(8.0, 16.0, 0.25), express=(6.0, 14.0, 0.25), payout=(0.8, 1.2, 0.05), results_path=None):
+    df = load_columns(['treat', 'commute'] + PRICE_COLUMNS)
+    grid = price_grid(*(np.arange(lo, hi + step / 2, step) for lo, hi, step in (pool, express, payout)))
+
+    start = time.perf_counter()
+    results = sweep(df, grid)
+    print(f"Evaluated {len(grid):,} scenarios ({len(results):,} tests) in {time.perf_counter() - start:.2f} s")
+
+    print("\n===== PROBLEM 1 PRICES ($12.5 POOL, $10 EXPRESS, PAYOUT AS RECORDED) =====")
+    baseline = ((results['pool_price'] == POOL_PRICE) & (results['express_price'] == EXPRESS_PRICE)
+                & np.isclose(results['payout_scale'], 1.0))
+    columns = ['metric', 'comparison', 'segment', 'mean_a', 'mean_b', 'difference', 'p_value', 'significant']
+    print(results.loc[baseline, columns].to_string(index=False))
+
+    print("\n===== SHARE OF SCENARIOS WITH A SIGNIFICANT DIFFERENCE =====")
+    print(results.groupby(['metric', 'comparison', 'segment'])['significant'].mean().to_string())
+
+    if results_path:
+        write_results(results.to_dict('records'), results_path)
+        print(f"\nScenario results saved as '{results_path}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pool', type=float, nargs=3, default=(8.0, 16.0, 0.25), metavar=('LOW', 'HIGH', 'STEP'),
+                        help='POOL price range')
+    parser.add_argument('--express', type=float, nargs=3, default=(6.0, 14.0, 0.25), metavar=('LOW', 'HIGH', 'STEP'),
+                        help='Express price range')
+    parser.add_argument('--payout', type=float, nargs=3, default=(0.8, 1.2, 0.05), metavar=('LOW', 'HIGH', 'STEP'),
+                        help='driver payout multiplier range')
+    parser.add_argument('--results', default=None, help='write scenario records here (.jsonl or .parquet)')
+    args = parser.parse_args()
+    main(args.pool, args.express, args.payout, args.results)
@@ -0,0 +1,132 @@
+"""
+Per-stage instrumentation of the analysis pipeline.
+
+Pipeline code wraps its stages in `with profiling.stage(name) as record:` and
+may set record['rows']. While profiling is disabled (the default), stage()
+returns a shared no-op context manager, so instrumented code pays only a
+function call and a flag check per stage. Once enabled, each stage records
+wall time, CPU time, peak traced memory (tracemalloc, including NumPy
+buffers) and row count. Stages may be nested; a parent's peak includes its
+children's.
+
+Records can be written as JSON Lines or as a Chrome trace (open in
+chrome://tracing or https://ui.perfetto.dev).
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from results_io import write_jsonl
+
+_enabled = False
+_trace_memory = False
+_origin = 0.0
+_records = []
+_stack = []
+
+class _NullStage:
+    """Context manager used while profiling is disabled."""
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, name, rows):
+        self.record = {'stage': name, 'rows': rows}
+        self.child_peak = 0
+
+    def __enter__(self):
+        if _trace_memory:
+            # Hand the peak so far to the parent before resetting it for this stage
+            if _stack:
+                _stack[-1].child_peak = max(_stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.record['depth'] = len(_stack)
+        _stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        _stack.pop()
+        record = self.record
+        record['start_s'] = self.wall - _origin
+        record['wall_s'] = wall - self.wall
+        record['cpu_s'] = cpu - self.cpu
+        if _trace_memory:
+            peak = max(self.child_peak, tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = peak / 2 ** 20
+            if _stack:
+                _stack[-1].child_peak = max(_stack[-1].child_peak, peak)
+        record['pid'] = os.getpid()
+        record['thread'] = threading.get_ident()
+        _records.append(record)
+        return False
+
+def stage(name, rows=None):
+    """
+    Context manager timing the enclosed block as stage name.
+
+    Yields:
+        dict: The stage's record; set 'rows' on it to record a row count
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, rows)
+
+def enable(memory=True):
+    """Start recording stages (and tracing memory if memory is True), discarding earlier records."""
+    global _enabled, _trace_memory, _origin
+    _records.clear()
+    _trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _origin = time.perf_counter()
+    _enabled = True
+
+def disable():
+    """Stop recording; records collected so far are kept."""
+    global _enabled
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def records():
+    """Recorded stages in completion order."""
+    return list(_records)
+
+def summary():
+    """Recorded stages as a DataFrame in start order."""
+    columns = ['stage', 'depth', 'start_s', 'wall_s', 'cpu_s', 'peak_mb', 'rows']
+    table = pd.DataFrame(_records, columns=columns)
+    return table.sort_values('start_s', kind='stable').reset_index(drop=True)
+
+def write_chrome_trace(path):
+    """Write the records in Chrome trace event format."""
+    events = [{
+        'name': record['stage'], 'ph': 'X', 'pid': record['pid'], 'tid': record['thread'],
+        'ts': record['start_s'] * 1e6, 'dur': record['wall_s'] * 1e6,
+        'args': {key: record.get(key) for key in ('cpu_s', 'peak_mb', 'rows')},
+    } for record in _records]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+def write(path):
+    """Write the records as a Chrome trace if path ends in '.json', otherwise as JSON Lines."""
+    if path.endswith('.json'):
+        return write_chrome_trace(path)
+    write_jsonl(records(), path, append=False)
+    return path
@@ -0,0 +1,234 @@
+"""
+Read-only HTTP/JSON service for treatment-vs-control comparisons.
+
+The switchback data is loaded once and indexed: rows are sorted by city,
+(treat, commute) cell and period_start, so each city x cell x date range is a
+contiguous slice located with one vectorized binary search, and prefix sums of
+every metric (see metric_engine.METRICS; the same definitions as
+calculate_match_rate and friends in analyze_problem2) turn each slice into
+counts, means and variances without touching the rows. Responses are kept in a
+bounded LRU cache keyed by the normalized query, so repeated questions are
+answered without recomputation. The server handles requests on threads; the
+index is immutable once built.
+
+Endpoints:
+    GET /metrics
+    GET /compare?metric=match_rate[&metric=...][&segment=commute|non-commute|all]
+                [&start=YYYY-MM-DD][&end=YYYY-MM-DD][&city_id=...][&alpha=0.05]
+
+start and end are inclusive service dates (see cube.select). The comparison is
+always 5-minute (treatment) versus 2-minute (control) wait.
+
+Usage:
+    python query_service.py [--host 127.0.0.1] [--port 8000] [--cache-size 1024]
+"""
+
+import argparse
+import json
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from column_store import load_columns
+from data_loader import DATA_PATH, SERVICE_DAY_START
+from metric_engine import METRICS, base_columns, metric_matrix, summarize_groups
+from results_io import table_to_records
+from streaming import GROUPS, group_codes
+
+CACHE_SIZE = 1024
+# Segment -> commute values included
+SEGMENTS = {'commute': (True,), 'non-commute': (False,), 'all': (True, False)}
+
+class SwitchbackIndex:
+    """Prefix sums of every metric over rows sorted by (city, cell, period_start)."""
+
+    def __init__(self, df, metrics=None):
+        metrics = list(METRICS.values()) if metrics is None else metrics
+        self.names = [metric.name for metric in metrics]
+        cities, self.cities = pd.factorize(df['city_id'])
+        self.cities = [str(city) for city in self.cities]
+        cells = group_codes(df['treat'], df['commute'])
+        minutes = df['period_start'].to_numpy().astype('datetime64[m]').astype(np.int64)
+        self.origin = minutes.min()
+        # Block = (city, cell); block * span + minute offset is the sort key
+        self.span = int(minutes.max() - self.origin) + 1
+        keys = (cities * len(GROUPS) + cells) * self.span + (minutes - self.origin)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+
+        # Center before accumulating so squares keep their precision; rows where a
+        # metric is undefined (NaN, e.g. match_rate without trips) add nothing to its
+        # sums and are not counted for it
+        values = metric_matrix(df, metrics)[order]
+        valid = np.isfinite(values)
+        with np.errstate(invalid='ignore'):
+            self.center = np.nan_to_num(np.nanmean(np.where(valid, values, np.nan), axis=0))
+        centered = np.where(valid, values - self.center, 0.0)
+        zeros = np.zeros((1, len(metrics)))
+        self.counts = np.vstack([zeros, np.cumsum(valid, axis=0)])
+        self.sums = np.vstack([zeros, np.cumsum(centered, axis=0)])
+        self.squares = np.vstack([zeros, np.cumsum(centered ** 2, axis=0)])
+
+    def _offset(self, date, days=0):
+        """Minute offset of the start of a service date (clipped to the indexed range)."""
+        minute = (pd.Timestamp(date) + pd.Timedelta(days=days) + SERVICE_DAY_START).to_datetime64()
+        return int(np.clip(minute.astype('datetime64[m]').astype(np.int64) - self.origin, 0, self.span))
+
+    def moments(self, names, commute=(True, False), start=None, end=None, cities=None):
+        """
+        Treatment (index 0) and control (index 1) counts, means and variances.
+
+        Args:
+            names (list): Metric names
+            commute (tuple): Commute values to include
+            start, end: Inclusive service dates; unbounded if None
+            cities (list): City ids to include; all if None
+
+        Returns:
+            tuple: (counts, means, variances), each of shape (2, len(names))
+        """
+        columns = [self.names.index(name) for name in names]
+        city_codes = range(len(self.cities)) if cities is None else [self.cities.index(c) for c in cities]
+        low = 0 if start is None else self._offset(start)
+        high = self.span if end is None else max(self._offset(end, days=1), low)
+        counts, means, variances = (np.zeros((2, len(columns))) for _ in range(3))
+        for arm, treat in enumerate((True, False)):
+            blocks = np.array([city * len(GROUPS) + GROUPS.index((treat, value))
+                               for city in city_codes for value in commute])
+            first = np.searchsorted(self.keys, blocks * self.span + low)
+            last = np.searchsorted(self.keys, blocks * self.span + high)
+            n = (self.counts[last] - self.counts[first]).sum(axis=0)[columns]
+            sums = (self.sums[last] - self.sums[first]).sum(axis=0)[columns]
+            squares = (self.squares[last] - self.squares[first]).sum(axis=0)[columns]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                counts[arm] = n
+                means[arm] = self.center[columns] + sums / n
+                variances[arm] = np.maximum(squares - sums ** 2 / n, 0) / (n - 1)
+        return counts, means, variances
+
+class QueryService:
+    """Validates queries and answers them from a SwitchbackIndex through an LRU cache."""
+
+    def __init__(self, index, cache_size=CACHE_SIZE):
+        self.index = index
+        self._cached_compare = lru_cache(maxsize=cache_size)(self._compare)
+
+    def normalize(self, params):
+        """
+        Canonical, hashable form of parsed query parameters (dict of lists).
+
+        Raises:
+            ValueError: On unknown metrics, segments or cities, or malformed values
+        """
+        metrics = tuple(name for value in params.get('metric', []) for name in value.split(',') if name)
+        if not metrics:
+            raise ValueError("At least one metric is required")
+        unknown = [name for name in metrics if name not in self.index.names]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {unknown}")
+        segment = params.get('segment', ['all'])[-1]
+        if segment not in SEGMENTS:
+            raise ValueError(f"Unknown segment: {segment} (expected one of {list(SEGMENTS)})")
+        dates = []
+        for name in ('start', 'end'):
+            value = params.get(name, [None])[-1]
+            dates.append(None if value is None else pd.Timestamp(value).date().isoformat())
+        cities = params.get('city_id')
+        if cities is not None:
+            unknown = [city for city in cities if city not in self.index.cities]
+            if unknown:
+                raise ValueError(f"Unknown cities: {unknown}")
+            cities = tuple(sorted(set(cities)))
+        if dates[0] is not None and dates[1] is not None and dates[0] > dates[1]:
+            raise ValueError(f"start ({dates[0]}) is after end ({dates[1]})")
+        alpha = float(params.get('alpha', [0.05])[-1])
+        if not 0 < alpha < 1:
+            raise ValueError(f"alpha must be between 0 and 1, got {alpha}")
+        return metrics, segment, dates[0], dates[1], cities, alpha
+
+    def compare(self, params):
+        """JSON response body (bytes) for parsed query parameters."""
+        return self._cached_compare(*self.normalize(params))
+
+    def _compare(self, metrics, segment, start, end, cities, alpha):
+        stats = self.index.moments(metrics, SEGMENTS[segment], start, end, cities)
+        table = summarize_groups(*stats, list(metrics), alpha)
+        query = {'segment': segment, 'start': start, 'end': end,
+                 'city_id': list(cities) if cities else 'all', 'alpha': alpha}
+        records = table_to_records(table, segment=segment, group_a='treatment', group_b='control')
+        # table_to_records maps NaN and infinities to None, so the body is strict JSON
+        return json.dumps({'query': query, 'results': records}, allow_nan=False).encode()
+
+    def cache_info(self):
+        return self._cached_compare.cache_info()
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Routes GET requests to the server's QueryService."""
+
+    # Every response has a Content-Length, so clients may keep connections alive;
+    # headers and body are separate writes, so Nagle's algorithm would delay the body
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        service = self.server.service
+        try:
+            if url.path == '/compare':
+                self._send(200, service.compare(parse_qs(url.query)))
+            elif url.path == '/metrics':
+                self._send(200, json.dumps({'metrics': service.index.names,
+                                            'segments': list(SEGMENTS),
+                                            'cities': service.index.cities}).encode())
+            else:
+                self._send(404, json.dumps({'error': f"Unknown path: {url.path}"}).encode())
+        except ValueError as error:
+            self._send(400, json.dumps({'error': str(error)}).encode())
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under concurrent load
+    request_queue_size = 128
+
+def make_server(service, host='127.0.0.1', port=8000, verbose=False):
+    """Threaded HTTP server answering queries with service (port 0 picks a free port)."""
+    server = QueryServer((host, port), QueryHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+def main(host='127.0.0.1', port=8000, cache_size=CACHE_SIZE, file_path=DATA_PATH, verbose=False):
+    metrics = list(METRICS.values())
+    df = load_columns(['city_id', 'period_start', 'treat', 'commute'] + base_columns(metrics), file_path)
+    server = make_server(QueryService(SwitchbackIndex(df, metrics), cache_size), host, port, verbose)
+    print(f"Serving {len(df):,} periods on http://{host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='cached responses (LRU)')
+    parser.add_argument('--data', default=DATA_PATH, help='switchbacks CSV')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+    main(args.host, args.port, args.cache_size, args.data, args.verbose)
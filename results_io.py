@@ -0,0 +1,139 @@
+"""
+Machine-readable experiment results.
+
+Comparison tables from metric_engine are flattened into one record per
+(experiment, city, segment, metric) holding raw floats: group sizes, means,
+variances, difference, standard error, confidence interval, t-statistic and
+p-value. Records are appended to JSON Lines files, or written as new part files
+of a Parquet dataset directory, so results for thousands of segments can be
+added without rewriting earlier output. The human-readable summary tables are
+rendered from these records by render_summary.
+"""
+
+import json
+import math
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Display label and value format for each metric in the summary tables
+METRIC_DISPLAY = {
+    'total_rides': ('Total Rides', '{:.2f}'),
+    'express_share': ('Express Share (%)', 'percent'),
+    'revenue': ('Revenue ($)', '${:.2f}'),
+    'profit_per_trip': ('Profit per Trip ($)', '${:.4f}'),
+    'rider_cancellations': ('Rider Cancellations', '{:.2f}'),
+    'driver_payout_per_trip': ('Driver Payout per Trip ($)', '${:.4f}'),
+    'match_rate': ('Match Rate (%)', 'percent'),
+    'double_match_rate': ('Double Match Rate (%)', 'percent'),
+}
+
+# Part files written by write_parquet; other files in a dataset directory are never touched
+PART_NAME = re.compile(r'part-[0-9a-f]{32}\.parquet')
+
+def _native(value):
+    """Convert NumPy scalars to JSON-serializable Python values (NaN and infinities become None)."""
+    if isinstance(value, (np.bool_, bool)):
+        return bool(value)
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return float(value) if math.isfinite(value) else None
+    return value
+
+def city_label(df):
+    """City recorded with the results: the single city in df, or 'all' for pooled data."""
+    if 'city_id' not in df.columns:
+        return 'all'
+    cities = pd.unique(df['city_id'])
+    return str(cities[0]) if len(cities) == 1 else 'all'
+
+def table_to_records(table, **keys):
+    """
+    Flatten a comparison table (indexed by metric) into result records.
+
+    Args:
+        table (DataFrame): Output of compare_groups / summarize_groups
+        **keys: Identifying fields added to every record (experiment, city_id, segment, ...)
+
+    Returns:
+        list: One dict per metric
+    """
+    records = []
+    for metric, row in table.iterrows():
+        record = {key: _native(value) for key, value in keys.items()}
+        record['metric'] = metric
+        record.update((column, _native(value)) for column, value in row.items())
+        records.append(record)
+    return records
+
+def write_jsonl(records, path, append=True):
+    """Write records as JSON Lines, appending to an existing file by default."""
+    with open(path, 'a' if append else 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return path
+
+def write_parquet(records, directory):
+    """
+    Add records to a Parquet dataset directory as a new part file.
+
+    Earlier parts are never rewritten. Requires a Parquet engine (pyarrow or fastparquet).
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'part-{uuid.uuid4().hex}.parquet')
+    pd.DataFrame(records).to_parquet(path, index=False)
+    return path
+
+def write_results(records, path, append=True):
+    """
+    Write records to path: a Parquet dataset if it ends in '.parquet', JSON Lines otherwise.
+
+    With append=False an existing dataset's part files (see PART_NAME) are removed first.
+    """
+    if path.endswith('.parquet'):
+        if not append and os.path.isdir(path):
+            for name in os.listdir(path):
+                if PART_NAME.fullmatch(name):
+                    os.remove(os.path.join(path, name))
+        return write_parquet(records, path)
+    return write_jsonl(records, path, append)
+
+def read_results(path):
+    """Load result records written by write_results into a DataFrame."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_json(path, lines=True, dtype=False)
+
+def format_value(metric, value):
+    """Format one raw value for display, using METRIC_DISPLAY."""
+    fmt = METRIC_DISPLAY[metric][1]
+    if fmt == 'percent':
+        return f"{value * 100:.2f}%"
+    return fmt.format(value)
+
+def render_summary(records, group_labels):
+    """
+    Render result records as the human-readable summary table.
+
+    Args:
+        records (DataFrame or list): Result records, one per metric, in display order
+        group_labels (tuple): Column headers for group a and group b
+
+    Returns:
+        DataFrame: String-formatted table with Metric, the two group means,
+        Difference, 'Significant at 5%' and p-value columns
+    """
+    records = pd.DataFrame(records)
+    metrics = records['metric']
+    return pd.DataFrame({
+        'Metric': [METRIC_DISPLAY[m][0] for m in metrics],
+        group_labels[0]: [format_value(m, v) for m, v in zip(metrics, records['mean_a'])],
+        group_labels[1]: [format_value(m, v) for m, v in zip(metrics, records['mean_b'])],
+        'Difference': [format_value(m, v) for m, v in zip(metrics, records['difference'])],
+        'Significant at 5%': ['YES' if sig else 'NO' for sig in records['significant']],
+        'p-value': [f"{p:.4f}" for p in records['p_value']],
+    })
@@ -0,0 +1,172 @@
+"""
+Sequential testing with always-valid p-values for continuous monitoring.
+
+The fixed-horizon Welch t-test is only valid if it is looked at once.
+Here every (experiment, metric) pair is monitored with a mixture sequential
+probability ratio test (mSPRT, normal mixing distribution over the difference
+in means, as in Johari et al., "Always Valid Inference"). Its p-values and
+confidence sequences stay valid however often results are checked, so an
+experiment can be stopped as soon as a decision metric crosses alpha.
+
+State for many concurrent experiments is held in arrays: each new period
+updates its arm's running count, mean and M2 in O(1), and only the touched
+experiments have their test statistics recomputed.
+
+Usage:
+    python sequential.py [path/to/switchbacks.csv]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_PATH, load_data
+from metric_engine import PROBLEM2_METRICS, get_metrics, metric_matrix
+from streaming import RunningStats
+
+# Arms within each experiment
+TREATMENT, CONTROL = 0, 1
+
+class SequentialMonitor:
+    """
+    mSPRT monitor for n_experiments two-arm experiments over a set of metrics.
+
+    Args:
+        n_experiments (int): Number of concurrent experiments
+        metrics (list): Metric names (from metric_engine.METRICS)
+        alpha (float): Significance level for stopping and confidence sequences
+        effect_size (float): Standard deviation of the mixing distribution, in units
+            of the per-period standard deviation of the metric
+        min_periods (int): Periods required in each arm before testing
+        stop_metrics (list): Metrics whose rejection stops an experiment; all if None
+    """
+
+    def __init__(self, n_experiments, metrics, alpha=0.05, effect_size=0.5, min_periods=2,
+                 stop_metrics=None):
+        self.metrics = list(metrics)
+        self.alpha = alpha
+        self.effect_size = effect_size
+        self.min_periods = min_periods
+        stop_metrics = self.metrics if stop_metrics is None else stop_metrics
+        self.stop_columns = [self.metrics.index(m) for m in stop_metrics]
+
+        shape = (n_experiments, len(self.metrics))
+        self.running = RunningStats(2 * n_experiments, len(self.metrics))
+        self.p_value = np.ones(shape)
+        self.ci_low = np.full(shape, -np.inf)
+        self.ci_high = np.full(shape, np.inf)
+        self.stopped = np.zeros(n_experiments, dtype=bool)
+        # Periods the experiment had observed (both arms) when it stopped
+        self.stopped_at = np.full(n_experiments, -1)
+
+    def observe(self, experiments, arms, values):
+        """
+        Add a batch of new periods.
+
+        Args:
+            experiments (ndarray): Experiment index of each period
+            arms (ndarray): TREATMENT or CONTROL for each period
+            values (ndarray): (n_periods, n_metrics) metric values
+
+        Returns:
+            ndarray: Indices of experiments that stopped on this batch
+        """
+        experiments = np.asarray(experiments)
+        active = ~self.stopped[experiments]
+        experiments = experiments[active]
+        # RunningStats.update touches only the (experiment, arm) rows in this batch
+        self.running.update(values[active], 2 * experiments + np.asarray(arms)[active])
+
+        touched = np.unique(experiments)
+        self._refresh(touched)
+        rejected = (self.p_value[np.ix_(touched, self.stop_columns)] < self.alpha).any(axis=1)
+        newly_stopped = touched[rejected]
+        self.stopped[newly_stopped] = True
+        self.stopped_at[newly_stopped] = self.periods(newly_stopped)
+        return newly_stopped
+
+    def periods(self, experiments=slice(None)):
+        """Periods observed so far by each experiment, both arms together."""
+        return self.running.count.reshape(-1, 2, len(self.metrics))[experiments, :, 0].sum(axis=1).astype(int)
+
+    def _refresh(self, experiments):
+        """Recompute the mixture likelihood ratio, p-values and confidence sequences."""
+        count = self.running.count.reshape(-1, 2, len(self.metrics))[experiments]
+        mean = self.running.mean.reshape(-1, 2, len(self.metrics))[experiments]
+        m2 = self.running.m2.reshape(-1, 2, len(self.metrics))[experiments]
+        ready = (count >= self.min_periods).all(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = m2 / (count - 1)
+            # Variance of the difference in means, and of the mixing distribution
+            v = variance[:, TREATMENT] / count[:, TREATMENT] + variance[:, CONTROL] / count[:, CONTROL]
+            pooled_sd = np.sqrt((m2[:, TREATMENT] + m2[:, CONTROL]) / (count.sum(axis=1) - 2))
+            tau2 = (self.effect_size * pooled_sd) ** 2
+            diff = mean[:, TREATMENT] - mean[:, CONTROL]
+            log_lr = 0.5 * np.log(v / (v + tau2)) + tau2 * diff ** 2 / (2 * v * (v + tau2))
+            p_now = np.minimum(1.0, np.exp(-log_lr))
+            # Confidence sequence: all differences not rejected at level alpha
+            radius = np.sqrt(v * (v + tau2) / tau2 * (2 * np.log(1 / self.alpha) + np.log((v + tau2) / v)))
+
+        valid = ready & np.isfinite(p_now) & (v > 0)
+        p_value = self.p_value[experiments]
+        # Always-valid p-values are the running minimum; intervals the running intersection
+        self.p_value[experiments] = np.where(valid, np.minimum(p_value, p_now), p_value)
+        self.ci_low[experiments] = np.where(valid, np.maximum(self.ci_low[experiments], diff - radius),
+                                            self.ci_low[experiments])
+        self.ci_high[experiments] = np.where(valid, np.minimum(self.ci_high[experiments], diff + radius),
+                                             self.ci_high[experiments])
+
+    def summary(self, labels=None):
+        """
+        Current state as a tidy table, one row per (experiment, metric).
+
+        Args:
+            labels (list): Name per experiment; indices if None
+        """
+        n_experiments = len(self.stopped)
+        labels = list(range(n_experiments)) if labels is None else list(labels)
+        count = self.running.count.reshape(-1, 2, len(self.metrics))
+        mean = self.running.mean.reshape(-1, 2, len(self.metrics))
+        index = pd.MultiIndex.from_product([labels, self.metrics], names=['experiment', 'metric'])
+        return pd.DataFrame({
+            'n_treatment': count[:, TREATMENT].ravel().astype(int),
+            'n_control': count[:, CONTROL].ravel().astype(int),
+            'difference': (mean[:, TREATMENT] - mean[:, CONTROL]).ravel(),
+            'always_valid_p': self.p_value.ravel(),
+            'cs_low': self.ci_low.ravel(),
+            'cs_high': self.ci_high.ravel(),
+            'stopped': np.repeat(self.stopped, len(self.metrics)),
+        }, index=index)
+
+def replay(df, metrics, alpha=0.05, stop_metrics=None):
+    """
+    Replay historical periods in time order as if monitored live, one period at a time.
+
+    Experiments are the (city, commute segment) pairs, comparing 5-minute (treatment)
+    with 2-minute (control) waits.
+
+    Returns:
+        tuple: (SequentialMonitor, experiment labels)
+    """
+    df = df.sort_values('period_start', kind='stable')
+    segment = np.where(df['commute'].to_numpy(), 'commute', 'non-commute')
+    keys = df['city_id'].astype(str).to_numpy() + ' / ' + segment
+    labels, experiments = np.unique(keys, return_inverse=True)
+    arms = np.where(df['treat'].to_numpy(), TREATMENT, CONTROL)
+    values = metric_matrix(df, get_metrics(metrics))
+
+    monitor = SequentialMonitor(len(labels), metrics, alpha, stop_metrics=stop_metrics)
+    for i in range(len(df)):
+        for experiment in monitor.observe(experiments[i:i + 1], arms[i:i + 1], values[i:i + 1]):
+            print(f"Stopped '{labels[experiment]}' after {monitor.stopped_at[experiment]} periods")
+    return monitor, labels
+
+def main(file_path=DATA_PATH):
+    monitor, labels = replay(load_data(file_path), PROBLEM2_METRICS)
+    print("\n===== SEQUENTIAL MONITORING (mSPRT, always-valid p-values) =====")
+    print(monitor.summary(labels).to_string())
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
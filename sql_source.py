@@ -0,0 +1,348 @@
+"""
+SQL data source for switchback data, with SQLite as the local backend.
+
+Rows are read straight from a switchbacks table instead of a CSV export. The
+treat / commute / city / date filters and the column projection are pushed
+down into the SELECT, so only the rows and columns an analysis needs leave the
+database. Results are fetched in bounded batches through a small pool of
+connections, and independent segment queries run concurrently on separate
+pooled connections (sqlite3 releases the GIL while a query executes). For
+the treatment-vs-control comparisons the aggregation itself can be pushed
+down as well: each metric becomes a SQL expression and the database returns
+only per-arm counts, means and centered sums of squares (two scans).
+
+import_csv loads a switchbacks CSV into a local SQLite file with indexes on
+the filter columns; ensure_database rebuilds it whenever the CSV changes.
+Queries use only standard SQL with '?' placeholders, so another DB-API driver
+with the qmark parameter style can be plugged in through ConnectionPool's
+connect argument.
+
+Usage:
+    python sql_source.py [path/to/switchbacks.csv] [path/to/switchbacks.sqlite]
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_PATH, DTYPES, SERVICE_DAY_START, read_switchbacks
+from metric_engine import METRICS, PROBLEM2_METRICS, base_columns, get_metrics, metric_matrix, summarize_groups
+from streaming import DEFAULT_CHUNKSIZE, RunningStats
+
+SQLITE_PATH = 'data/switchbacks.sqlite'
+TABLE = 'switchbacks'
+COLUMNS = list(DTYPES)
+POOL_SIZE = 4
+BATCH_SIZE = 50_000
+# period_start is stored as ISO text, which sorts and compares chronologically
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+SQL_TYPES = {'category': 'TEXT', str: 'TEXT', bool: 'INTEGER', 'int32': 'INTEGER', 'float64': 'REAL'}
+INDEXES = {'city_period': ['city_id', 'period_start'], 'treat_commute': ['treat', 'commute']}
+
+class ConnectionPool:
+    """Fixed-size pool of DB-API connections shared between threads."""
+
+    def __init__(self, connect, size=POOL_SIZE):
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(connect())
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting until one is free."""
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+
+def sqlite_pool(db_path=SQLITE_PATH, size=POOL_SIZE):
+    """Pool of read-only connections to a SQLite file."""
+    uri = f'file:{os.path.abspath(db_path)}?mode=ro'
+    return ConnectionPool(lambda: sqlite3.connect(uri, uri=True, check_same_thread=False), size)
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+def import_csv(file_path=DATA_PATH, db_path=SQLITE_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Load a switchbacks CSV into a SQLite table with indexes on the filter columns.
+
+    The database is written to a temporary file and moved into place when complete.
+
+    Returns:
+        str: db_path
+    """
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = _source_signature(file_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        schema = ', '.join(f'{column} {SQL_TYPES[dtype]}' for column, dtype in DTYPES.items())
+        connection.execute(f'CREATE TABLE {TABLE} ({schema})')
+        connection.execute('CREATE TABLE source (signature TEXT)')
+        connection.execute('INSERT INTO source VALUES (?)', (source,))
+        insert = f'INSERT INTO {TABLE} VALUES ({", ".join("?" * len(COLUMNS))})'
+        for chunk in read_switchbacks(file_path, chunksize=chunksize):
+            chunk = chunk[COLUMNS].astype({'city_id': str, 'wait_time': str})
+            chunk['period_start'] = chunk['period_start'].dt.strftime(TIMESTAMP_FORMAT)
+            connection.executemany(insert, chunk.itertuples(index=False, name=None))
+        for name, columns in INDEXES.items():
+            connection.execute(f'CREATE INDEX {name} ON {TABLE} ({", ".join(columns)})')
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+def is_fresh(file_path=DATA_PATH, db_path=SQLITE_PATH):
+    """Return True if the database exists and was imported from the current version of the CSV."""
+    if not os.path.exists(db_path):
+        return False
+    connection = sqlite3.connect(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True)
+    try:
+        row = connection.execute('SELECT signature FROM source').fetchone()
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        connection.close()
+    return row is not None and row[0] == _source_signature(file_path)
+
+def ensure_database(file_path=DATA_PATH, db_path=SQLITE_PATH):
+    """(Re)import the CSV if the database is missing or stale, and return db_path."""
+    if not is_fresh(file_path, db_path):
+        import_csv(file_path, db_path)
+    return db_path
+
+def _where(**filters):
+    """WHERE clause (empty if there are no filters) and parameters, see build_query."""
+    conditions, params = [], []
+    for name, condition in filters.items():
+        if name in ('treat', 'commute'):
+            conditions.append(f'{name} = ?')
+            params.append(int(bool(condition)))
+        elif name == 'city_id':
+            cities = [condition] if isinstance(condition, str) else list(condition)
+            conditions.append(f'city_id IN ({", ".join("?" * len(cities))})')
+            params.extend(str(city) for city in cities)
+        elif name == 'date':
+            # Service date d covers periods starting in [d + 7:00, d + 1 day + 7:00)
+            start, end = condition
+            conditions.append('period_start >= ? AND period_start < ?')
+            params.append((pd.Timestamp(start).normalize() + SERVICE_DAY_START).strftime(TIMESTAMP_FORMAT))
+            params.append((pd.Timestamp(end).normalize() + pd.Timedelta(days=1) + SERVICE_DAY_START)
+                          .strftime(TIMESTAMP_FORMAT))
+        else:
+            raise ValueError(f"Unknown filter: {name}")
+    return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+def _check_columns(columns):
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(unknown)}")
+
+def build_query(columns=None, **filters):
+    """
+    SELECT statement and parameters for the given projection and filters.
+
+    Args:
+        columns (list): Columns to return; all of them if None
+        **filters: treat / commute (bool), city_id (a value or a list of values) and
+            date, a (start, end) tuple of inclusive service dates (see cube.select)
+
+    Returns:
+        tuple: (sql, params)
+    """
+    columns = COLUMNS if columns is None else list(columns)
+    _check_columns(columns)
+    where, params = _where(**filters)
+    return f'SELECT {", ".join(columns)} FROM {TABLE}{where}', params
+
+def metric_sql(metric):
+    """SQL expression evaluating a metric declaration (see metric_engine.Metric) on each row."""
+    def linear(weights):
+        _check_columns(weights)
+        return ' + '.join(f'{float(weight)!r} * {column}' for column, weight in weights.items())
+    if metric.denominator is None:
+        return f'({linear(metric.numerator)})'
+    return f'({linear(metric.numerator)}) / ({linear(metric.denominator)})'
+
+def build_means_query(metrics, **filters):
+    """
+    Aggregate query returning treat, then the count and the mean of the defined values
+    of every metric, per treat arm.
+
+    A ratio metric is NULL in SQLite where its denominator is zero; COUNT and AVG
+    both skip those rows, so each metric gets its own n (as NaN values are skipped
+    in memory).
+
+    Returns:
+        tuple: (sql, params)
+    """
+    where, params = _where(**filters)
+    expressions = [metric_sql(metric) for metric in metrics]
+    counts = ', '.join(f'COUNT({expression})' for expression in expressions)
+    means = ', '.join(f'AVG({expression})' for expression in expressions)
+    return f'SELECT treat, {counts}, {means} FROM {TABLE}{where} GROUP BY treat', params
+
+def build_squares_query(metrics, means, **filters):
+    """
+    Aggregate query returning treat and the sum of squared deviations of every
+    metric from its arm's mean. SUM skips the NULL (undefined) values, like the
+    counts of build_means_query.
+
+    Args:
+        means (dict): treat (bool) -> array of metric means, from build_means_query
+
+    Returns:
+        tuple: (sql, params)
+    """
+    where, params = _where(**filters)
+    deviations = ', '.join(f'{metric_sql(metric)} - (CASE WHEN treat THEN ? ELSE ? END) AS d{j}'
+                           for j, metric in enumerate(metrics))
+    squares = ', '.join(f'SUM(d{j} * d{j})' for j in range(len(metrics)))
+    centers = [float(mean) for j in range(len(metrics)) for mean in (means[True][j], means[False][j])]
+    sql = f'SELECT treat, {squares} FROM (SELECT treat, {deviations} FROM {TABLE}{where}) GROUP BY treat'
+    return sql, centers + params
+
+def _to_frame(rows, columns):
+    """Typed DataFrame (data_loader.DTYPES, parsed period_start) from fetched rows."""
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df = df.astype({column: DTYPES[column] for column in columns if column != 'period_start'})
+    if 'period_start' in df.columns:
+        df['period_start'] = pd.to_datetime(df['period_start'], format=TIMESTAMP_FORMAT)
+    return df
+
+def read_sql_batches(pool, columns=None, batch_size=BATCH_SIZE, **filters):
+    """
+    Stream the matching rows as DataFrames of at most batch_size rows.
+
+    The connection is held until the generator is exhausted or closed.
+    """
+    columns = COLUMNS if columns is None else list(columns)
+    sql, params = build_query(columns, **filters)
+    with pool.connection() as connection:
+        cursor = connection.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield _to_frame(rows, columns)
+        finally:
+            cursor.close()
+
+def read_sql(pool, columns=None, **filters):
+    """All matching rows as one DataFrame (see read_sql_batches)."""
+    columns = COLUMNS if columns is None else list(columns)
+    batches = list(read_sql_batches(pool, columns, **filters))
+    if not batches:
+        return _to_frame([], columns)
+    df = pd.concat(batches, ignore_index=True)
+    # Batches carry their own categories; unify them
+    return df.astype({column: 'category' for column in columns if DTYPES[column] == 'category'})
+
+def run_concurrently(pool, func, segments):
+    """
+    Call func(pool, **filters) for every segment on its own thread.
+
+    Args:
+        segments (dict): Label -> filters
+
+    Returns:
+        dict: Label -> result
+    """
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {label: executor.submit(func, pool, **filters) for label, filters in segments.items()}
+        return {label: future.result() for label, future in futures.items()}
+
+def segment_stats(pool, metrics, batch_size=BATCH_SIZE, **filters):
+    """
+    Running treatment (group 0) and control (group 1) statistics of metrics over the filtered rows.
+
+    Returns:
+        RunningStats: Two groups, indexed by metric in the order given
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    running = RunningStats(2, len(metrics))
+    for batch in read_sql_batches(pool, ['treat'] + base_columns(metrics), batch_size, **filters):
+        # Undefined ratios come out as NaN or inf and are skipped by RunningStats
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = metric_matrix(batch, metrics)
+        running.update(values, (~batch['treat'].to_numpy()).astype(int))
+    return running
+
+def segment_moments(pool, metrics, **filters):
+    """
+    Treatment (index 0) and control (index 1) count, mean and variance of metrics,
+    aggregated inside the database in two passes (means, then centered squares),
+    so no rows are transferred.
+
+    Returns:
+        tuple: (counts, means, variances), each of shape (2, n_metrics)
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    counts = np.zeros((2, len(metrics)))
+    means = np.full((2, len(metrics)), np.nan)
+    squares = np.full((2, len(metrics)), np.nan)
+    with pool.connection() as connection:
+        for treat, *row in connection.execute(*build_means_query(metrics, **filters)):
+            counts[0 if treat else 1] = row[:len(metrics)]
+            means[0 if treat else 1] = np.array(row[len(metrics):], dtype=float)
+        sql, params = build_squares_query(metrics, {True: means[0], False: means[1]}, **filters)
+        for treat, *row in connection.execute(sql, params):
+            squares[0 if treat else 1] = np.array(row, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variances = squares / (counts - 1)
+    return counts, means, variances
+
+def compare_segments(pool, metrics, segments, aggregate=True, alpha=0.05):
+    """
+    Treatment-vs-control comparison in every segment, querying segments concurrently.
+
+    Args:
+        segments (dict): Label -> filters (see build_query)
+        aggregate (bool): Push the aggregation into the database (segment_moments)
+            instead of streaming the rows in batches (segment_stats)
+
+    Returns:
+        dict: Label -> comparison table (see metric_engine.summarize_groups)
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    names = [metric.name for metric in metrics]
+    if aggregate:
+        moments = run_concurrently(pool, lambda pool, **filters: segment_moments(pool, metrics, **filters),
+                                   segments)
+        return {label: summarize_groups(*stats, names, alpha) for label, stats in moments.items()}
+    stats = run_concurrently(pool, lambda pool, **filters: segment_stats(pool, metrics, **filters), segments)
+    return {label: running.compare(0, 1, names, alpha) for label, running in stats.items()}
+
+def main(file_path=DATA_PATH, db_path=SQLITE_PATH):
+    ensure_database(file_path, db_path)
+    metrics = get_metrics(PROBLEM2_METRICS)
+    pool = sqlite_pool(db_path)
+    try:
+        tables = compare_segments(pool, metrics, {'Commuting': {'commute': True},
+                                                  'Non-Commuting': {'commute': False}})
+    finally:
+        pool.close()
+    for label, table in tables.items():
+        print(f"===== PROBLEM 2 FROM '{db_path}': 5-min vs. 2-min Wait, {label} Hours =====")
+        print(table.to_string())
+        print()
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
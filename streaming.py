@@ -0,0 +1,196 @@
+"""
+Streaming analysis mode for switchback exports larger than memory.
+
+The CSV is read in bounded chunks. Each chunk is reduced to per-group count,
+mean and M2 (sum of squared deviations) of the finite values of every metric
+(a ratio metric is undefined in periods without requests or trips), and folded into
+running totals with the parallel form of Welford's algorithm (Chan et al.).
+Running totals from different chunks, files or workers can be merged the same
+way, so peak memory depends only on the chunk size.
+
+Groups are the four (treat, commute) cells of the experiment; any two-group
+comparison used by the analysis scripts is answered from them with the same
+Welch t-test as metric_engine.welch_ttest. For ratio-of-totals inference
+(stream_ratio_compare) the chunks are instead reduced to per-group Gram
+matrices, which merge by plain addition across chunks, files or workers.
+
+Usage:
+    python streaming.py [path/to/switchbacks.csv]
+"""
+
+import sys
+
+import numpy as np
+
+from data_loader import DATA_PATH, read_switchbacks
+from metric_engine import (
+    METRICS, PROBLEM1_METRICS, PROBLEM2_METRICS, base_columns, column_matrix, get_metrics, group_gram, group_sums,
+    metric_matrix, ratio_stats, summarize_groups,
+)
+
+DEFAULT_CHUNKSIZE = 100_000
+
+# Group code for each (treat, commute) cell
+GROUPS = [(False, False), (False, True), (True, False), (True, True)]
+
+def group_codes(treat, commute):
+    """Map treat/commute flags to indices into GROUPS."""
+    return 2 * np.asarray(treat, dtype=int) + np.asarray(commute, dtype=int)
+
+class RunningStats:
+    """Mergeable per-group count, mean and M2 for a set of metrics."""
+
+    def __init__(self, n_groups, n_metrics):
+        self.count = np.zeros((n_groups, n_metrics))
+        self.mean = np.zeros((n_groups, n_metrics))
+        self.m2 = np.zeros((n_groups, n_metrics))
+
+    def update(self, values, codes):
+        """
+        Fold a block of (n_rows, n_metrics) values with per-row group codes into the totals.
+
+        Only the groups present in the block are touched, so the cost depends on the
+        block size, not on the number of groups. Non-finite values (a ratio metric in
+        a period without requests or trips) are skipped and not counted for that metric.
+        """
+        codes = np.asarray(codes)
+        valid = codes >= 0
+        groups, codes = np.unique(codes[valid], return_inverse=True)
+        values = values[valid]
+        finite = np.isfinite(values)
+        _, count = group_sums(finite.astype(float), codes, len(groups))
+        _, sums = group_sums(np.where(finite, values, 0.0), codes, len(groups))
+        mean = np.divide(sums, count, out=np.zeros_like(count), where=count > 0)
+        _, m2 = group_sums(np.where(finite, values - mean[codes], 0.0) ** 2, codes, len(groups))
+        self._combine(count, mean, m2, groups)
+        return self
+
+    def resize(self, n_groups):
+        """Grow the totals to n_groups groups; new groups start empty."""
+        extra = n_groups - self.count.shape[0]
+        if extra > 0:
+            pad = np.zeros((extra, self.count.shape[1]))
+            self.count = np.vstack([self.count, pad])
+            self.mean = np.vstack([self.mean, pad])
+            self.m2 = np.vstack([self.m2, pad])
+        return self
+
+    def to_dict(self):
+        """JSON-serializable form of the totals."""
+        return {'count': self.count.tolist(), 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild totals saved with to_dict."""
+        running = cls(0, 0)
+        running.count = np.array(data['count'], dtype=float)
+        running.mean = np.array(data['mean'], dtype=float)
+        running.m2 = np.array(data['m2'], dtype=float)
+        return running
+
+    def merge(self, other):
+        """Merge running totals computed over a disjoint set of rows."""
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def _combine(self, count, mean, m2, rows=slice(None)):
+        """Chan et al. merge of partial totals into the given group rows."""
+        total = self.count[rows] + count
+        delta = mean - self.mean[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, count / total, 0.0)
+            self.m2[rows] = self.m2[rows] + m2 + delta ** 2 * self.count[rows] * weight
+        self.mean[rows] = self.mean[rows] + delta * weight
+        self.count[rows] = total
+
+    def variance(self):
+        """Sample variance (ddof=1) per group and metric."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.count - 1)
+
+    def compare(self, group_a, group_b, names, alpha=0.05):
+        """Welch t-test table (see metric_engine.summarize_groups) for two group indices."""
+        rows = [group_a, group_b]
+        return summarize_groups(self.count[rows], self.mean[rows], self.variance()[rows], names, alpha)
+
+def stream_stats(metrics, file_path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Accumulate per-(treat, commute) running statistics for metrics over a CSV in chunks.
+
+    Args:
+        metrics (list): Metric declarations (or names from METRICS)
+        file_path (str): Switchbacks CSV
+        chunksize (int): Rows read per chunk
+
+    Returns:
+        RunningStats: Totals indexed by GROUPS
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    usecols = ['treat', 'commute'] + base_columns(metrics)
+    running = RunningStats(len(GROUPS), len(metrics))
+    for chunk in read_switchbacks(file_path, usecols=usecols, chunksize=chunksize):
+        codes = group_codes(chunk['treat'], chunk['commute'])
+        running.update(metric_matrix(chunk, metrics), codes)
+    return running
+
+def stream_compare(metrics, group_a, group_b, file_path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streaming equivalent of metric_engine.compare_groups.
+
+    Args:
+        metrics (list): Metric declarations (or names from METRICS)
+        group_a (tuple): (treat, commute) cell of the first group
+        group_b (tuple): (treat, commute) cell of the second group
+
+    Returns:
+        DataFrame: Tidy comparison table, one row per metric
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    running = stream_stats(metrics, file_path, chunksize)
+    return running.compare(GROUPS.index(group_a), GROUPS.index(group_b), [m.name for m in metrics])
+
+def stream_gram(columns, file_path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Accumulate per-(treat, commute) Gram matrices of columns over a CSV in chunks.
+
+    Returns:
+        ndarray: (len(GROUPS), len(columns) + 1, len(columns) + 1), see metric_engine.group_gram
+    """
+    gram = np.zeros((len(GROUPS), len(columns) + 1, len(columns) + 1))
+    usecols = ['treat', 'commute'] + list(columns)
+    for chunk in read_switchbacks(file_path, usecols=usecols, chunksize=chunksize):
+        codes = group_codes(chunk['treat'], chunk['commute'])
+        gram += group_gram(column_matrix(chunk, columns), codes, len(GROUPS))
+    return gram
+
+def stream_ratio_compare(metrics, group_a, group_b, file_path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streaming equivalent of metric_engine.compare_ratios (ratio of totals, delta method).
+
+    Returns:
+        DataFrame: Tidy comparison table, one row per metric
+    """
+    metrics = [METRICS[m] if isinstance(m, str) else m for m in metrics]
+    columns = base_columns(metrics)
+    gram = stream_gram(columns, file_path, chunksize)[[GROUPS.index(group_a), GROUPS.index(group_b)]]
+    return summarize_groups(*ratio_stats(gram, metrics, columns), [m.name for m in metrics])
+
+def main(file_path=DATA_PATH):
+    metrics = get_metrics(dict.fromkeys(PROBLEM1_METRICS + PROBLEM2_METRICS))
+    names = [metric.name for metric in metrics]
+
+    # One pass over the file answers every comparison below
+    running = stream_stats(metrics, file_path)
+
+    print("===== PROBLEM 1: Commuting vs. Non-Commuting Hours (Control Group) =====")
+    table = running.compare(GROUPS.index((False, True)), GROUPS.index((False, False)), names)
+    print(table.loc[PROBLEM1_METRICS].to_string())
+
+    for commute in (True, False):
+        label = 'Commuting' if commute else 'Non-Commuting'
+        print(f"\n===== PROBLEM 2: 5-min vs. 2-min Wait, {label} Hours =====")
+        table = running.compare(GROUPS.index((True, commute)), GROUPS.index((False, commute)), names)
+        print(table.loc[PROBLEM2_METRICS].to_string())
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,143 @@
+"""
+Synthetic switchback data generator.
+
+Produces data in the switchbacks.csv schema for any number of cities and
+160-minute periods, with configurable treatment effects. Base levels and noise
+are roughly calibrated to the Boston experiment. Every period is randomly
+assigned to the 2-minute or 5-minute arm; commute periods are the 7:00 and
+15:00 periods of each weekday.
+
+Usage:
+    python synthetic.py n_periods [n_cities] [output.csv]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_loader import COMMUTE_PERIODS, PERIOD_LENGTH, PERIODS_PER_DAY, SERVICE_DAY_START
+
+START_DAY = pd.Timestamp('2018-02-19')
+
+# Base levels per period: (commute, non-commute)
+BASE_LEVELS = {
+    'total_rides': (5000.0, 3750.0),
+    'express_share': (0.70, 0.65),
+    'rider_cancellations': (250.0, 150.0),
+    'driver_payout_per_trip': (7.8, 7.3),
+    'match_rate': (0.75, 0.64),
+    'double_match_rate': (0.35, 0.32),
+}
+
+# Relative noise (coefficient of variation) per period
+NOISE = {
+    'total_rides': 0.09,
+    'express_share': 0.06,
+    'rider_cancellations': 0.15,
+    'driver_payout_per_trip': 0.07,
+    'match_rate': 0.08,
+    'double_match_rate': 0.12,
+}
+
+# Relative effect of the 5-minute wait, roughly as observed in Boston
+DEFAULT_EFFECTS = {
+    'total_rides': -0.01,
+    'express_share': 0.0,
+    'rider_cancellations': 0.13,
+    'driver_payout_per_trip': -0.05,
+    'match_rate': -0.05,
+    'double_match_rate': 0.08,
+}
+
+def generate_switchbacks(n_periods, n_cities=1, effects=None, seed=None, city_scale=None, start=0):
+    """
+    Generate a normalized switchback table (same dtypes as data_loader.load_data).
+
+    Args:
+        n_periods (int): Periods per city
+        n_cities (int): Number of cities; city i is named 'City<i>' (city 0 is 'Boston')
+        effects (dict): Relative treatment effects by metric, overriding DEFAULT_EFFECTS
+        seed (int): Random seed
+        city_scale (array-like): Demand multiplier per city; drawn log-normally if None
+        start (int): Index of the first period, to generate consecutive chunks
+
+    Returns:
+        DataFrame: n_periods * n_cities rows, ordered by city then period
+    """
+    rng = np.random.default_rng(seed)
+    effects = dict(DEFAULT_EFFECTS, **(effects or {}))
+    if city_scale is None:
+        city_scale = np.exp(np.random.default_rng(0).normal(0, 0.5, n_cities))
+        city_scale[0] = 1.0
+    n = n_periods * n_cities
+
+    city = np.repeat(np.arange(n_cities), n_periods)
+    period = np.tile(np.arange(start, start + n_periods), n_cities)
+    day, slot = np.divmod(period, PERIODS_PER_DAY)
+    commute = np.isin(slot, COMMUTE_PERIODS) & ((START_DAY.dayofweek + day) % 7 < 5)
+    treat = rng.random(n) < 0.5
+
+    def draw(metric):
+        base = np.where(commute, *BASE_LEVELS[metric])
+        lift = 1 + effects[metric] * treat
+        return base * lift * rng.normal(1, NOISE[metric], n)
+
+    rides = np.maximum(np.rint(draw('total_rides') * np.asarray(city_scale)[city]), 1).astype(np.int64)
+    express = rng.binomial(rides, np.clip(draw('express_share'), 0, 1))
+    matches = rng.binomial(rides, np.clip(draw('match_rate'), 0, 1))
+    double_share = np.clip(draw('double_match_rate') / np.maximum(draw('match_rate'), 1e-9), 0, 1)
+    double_matches = rng.binomial(matches, double_share)
+    cancellations = rng.poisson(np.maximum(draw('rider_cancellations'), 0) * np.asarray(city_scale)[city])
+    payout = np.round(rides * draw('driver_payout_per_trip'), 5)
+
+    names = ['Boston'] + [f'City{i}' for i in range(1, n_cities)]
+    period_start = START_DAY + SERVICE_DAY_START + pd.to_timedelta(day, unit='D') + slot * PERIOD_LENGTH
+    return pd.DataFrame({
+        'city_id': pd.Categorical.from_codes(city, names),
+        'period_start': period_start,
+        'wait_time': pd.Categorical.from_codes(treat.astype(int), ['2 mins', '5 mins']),
+        'treat': treat,
+        'commute': commute,
+        'trips_pool': (rides - express).astype('int32'),
+        'trips_express': express.astype('int32'),
+        'rider_cancellations': cancellations.astype('int32'),
+        'total_driver_payout': payout,
+        'total_matches': matches.astype('int32'),
+        'total_double_matches': double_matches.astype('int32'),
+    })
+
+def to_raw_csv(df, path, append=False):
+    """Write a normalized table in the raw switchbacks.csv format (';' separator, ',' decimals)."""
+    raw = df.copy()
+    # Match the export's unpadded day/month/hour, e.g. '19.2.2018 7:00'
+    start = raw['period_start']
+    raw['period_start'] = (
+        start.dt.day.astype(str) + '.' + start.dt.month.astype(str) + '.' + start.dt.year.astype(str)
+        + ' ' + start.dt.hour.astype(str) + ':' + start.dt.strftime('%M')
+    )
+    raw['treat'] = np.where(raw['treat'], 'TRUE', 'FALSE')
+    raw['commute'] = np.where(raw['commute'], 'TRUE', 'FALSE')
+    raw.to_csv(path, sep=';', decimal=',', index=False, mode='a' if append else 'w', header=not append)
+    return path
+
+def write_synthetic_csv(path, n_periods, n_cities=1, effects=None, seed=None, chunk_rows=1_000_000):
+    """
+    Generate and write a synthetic CSV in chunks, so output size is not limited by memory.
+
+    Rows are ordered by period chunk, then city, then period.
+    """
+    rng = np.random.default_rng(seed)
+    chunk_periods = max(1, chunk_rows // n_cities)
+    for start in range(0, n_periods, chunk_periods):
+        size = min(chunk_periods, n_periods - start)
+        chunk = generate_switchbacks(size, n_cities, effects, seed=rng.integers(2 ** 63), start=start)
+        to_raw_csv(chunk, path, append=start > 0)
+    return path
+
+if __name__ == "__main__":
+    n_periods = int(sys.argv[1])
+    n_cities = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    output = sys.argv[3] if len(sys.argv) > 3 else 'synthetic_switchbacks.csv'
+    write_synthetic_csv(output, n_periods, n_cities)
+    print(f"Synthetic data saved as '{output}'")
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+
+from incremental import ExperimentState, update
+from metric_engine import METRICS, metric_matrix
+from synthetic import generate_switchbacks, to_raw_csv
+
+def test_zero_denominator_period_does_not_poison_state(tmp_path):
+    df = generate_switchbacks(9 * 14, n_cities=2, seed=6)
+    # A period without trips: the per-trip ratio metrics are undefined there
+    df.loc[4, ['trips_pool', 'trips_express', 'total_matches', 'total_double_matches']] = 0
+    first, second = df.iloc[:100], df.iloc[100:]
+    paths = [to_raw_csv(first, str(tmp_path / 'delta1.csv')), to_raw_csv(second, str(tmp_path / 'delta2.csv'))]
+    state_path = str(tmp_path / 'state.json')
+    update(state_path, paths[:1])
+    results = update(state_path, paths[1:])
+
+    # The saved state is strict JSON and loads again
+    with open(state_path) as f:
+        json.load(f, parse_constant=pytest.fail)
+    state = ExperimentState.load(state_path)
+
+    city, treat, commute = str(df.loc[4, 'city_id']), bool(df.loc[4, 'treat']), bool(df.loc[4, 'commute'])
+    cell = df[(df['city_id'].astype(str) == city) & (df['treat'] == treat) & (df['commute'] == commute)]
+    names = ['total_rides', 'profit_per_trip', 'match_rate']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = metric_matrix(cell, [METRICS[name] for name in names])
+    table = state.compare(city, (treat, commute), (not treat, commute), names)
+    for j, name in enumerate(names):
+        finite = values[np.isfinite(values[:, j]), j]
+        assert table.loc[name, 'n_a'] == len(finite)
+        assert table.loc[name, 'mean_a'] == pytest.approx(finite.mean(), rel=1e-12)
+        assert table.loc[name, 'var_a'] == pytest.approx(finite.var(ddof=1), rel=1e-8)
+    assert results[['difference', 'p_value']].notna().all().all()
+
+def test_rejects_poisoned_state(tmp_path):
+    state = ExperimentState()
+    state.city_index('Boston')
+    state.running.mean[0, 0] = np.nan
+    data = {'metrics': state.metrics, 'cities': state.cities, 'applied': [], 'running': state.running.to_dict()}
+    path = tmp_path / 'state.json'
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError, match='rebuild'):
+        ExperimentState.load(str(path))
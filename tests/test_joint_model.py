@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from joint_model import benjamini_hochberg, holm
+
+def brute_force_bh(p_values):
+    """Adjusted p_(i) = min over j >= i of m * p_(j) / j, capped at 1."""
+    m = len(p_values)
+    order = np.argsort(p_values, kind='stable')
+    adjusted = np.empty(m)
+    for i in range(m):
+        adjusted[order[i]] = min(1.0, min(m * p_values[order[j]] / (j + 1) for j in range(i, m)))
+    return adjusted
+
+def brute_force_holm(p_values):
+    """Adjusted p_(i) = max over j <= i of (m - j) * p_(j) (0-based j), capped at 1."""
+    m = len(p_values)
+    order = np.argsort(p_values, kind='stable')
+    adjusted = np.empty(m)
+    for i in range(m):
+        adjusted[order[i]] = min(1.0, max((m - j) * p_values[order[j]] for j in range(i + 1)))
+    return adjusted
+
+@pytest.fixture
+def p_values():
+    rng = np.random.default_rng(2)
+    # Mix of tiny, ties and null p-values
+    return np.concatenate([rng.uniform(0, 0.01, 6), [0.03, 0.03, 0.03], rng.uniform(0, 1, 15)])
+
+@pytest.mark.parametrize('adjust, reference', [(benjamini_hochberg, brute_force_bh), (holm, brute_force_holm)])
+def test_matches_brute_force(p_values, adjust, reference):
+    np.testing.assert_allclose(adjust(p_values), reference(p_values), rtol=1e-12)
+
+@pytest.mark.parametrize('adjust, reference', [(benjamini_hochberg, brute_force_bh), (holm, brute_force_holm)])
+def test_shape_and_missing_values(p_values, adjust, reference):
+    # Adjusted over all entries of a 2-d array; NaNs stay NaN and do not count as tests
+    grid = p_values.copy()
+    grid[[3, 10]] = np.nan
+    grid = grid.reshape(4, 6)
+    adjusted = adjust(grid)
+    assert adjusted.shape == grid.shape
+    valid = ~np.isnan(grid)
+    np.testing.assert_array_equal(np.isnan(adjusted), ~valid)
+    np.testing.assert_allclose(adjusted[valid], reference(grid[valid]), rtol=1e-12)
+
+@pytest.mark.parametrize('adjust, method', [(benjamini_hochberg, 'fdr_bh'), (holm, 'holm')])
+def test_matches_statsmodels(p_values, adjust, method):
+    multitest = pytest.importorskip('statsmodels.stats.multitest')
+    _, expected, _, _ = multitest.multipletests(p_values, method=method)
+    np.testing.assert_allclose(adjust(p_values), expected, rtol=1e-12)
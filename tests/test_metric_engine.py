@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from metric_engine import compare_values, group_stats, welch_ttest
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(0)
+    n = 500
+    values = np.column_stack([
+        rng.normal(10, 2, n),
+        rng.poisson(3, n).astype(float),
+        # Large level with small spread: naive sums of squares lose the variance
+        1e9 + rng.normal(0, 1, n),
+    ])
+    codes = rng.integers(-1, 3, n)
+    return values, codes
+
+def test_group_stats_matches_numpy(sample):
+    values, codes = sample
+    counts, means, variances = group_stats(values, codes, 4)
+    for group in range(3):
+        rows = values[codes == group]
+        np.testing.assert_array_equal(counts[group], len(rows))
+        np.testing.assert_allclose(means[group], rows.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(variances[group], rows.var(axis=0, ddof=1), rtol=1e-9)
+    # Rows with a negative code are ignored; empty groups have no mean
+    np.testing.assert_array_equal(counts[3], 0)
+    assert np.isnan(means[3]).all()
+
+def test_welch_ttest_matches_scipy(sample):
+    # The 1e9-level column only checks variance precision; its means carry rounding
+    # error of the level's order in any implementation
+    values, codes = sample[0][:, :2], np.where(sample[1] < 2, sample[1], -1)
+    counts, means, variances = group_stats(values, codes, 2)
+    t_stat, p_value = welch_ttest(means[0], variances[0], counts[0], means[1], variances[1], counts[1])
+    expected = stats.ttest_ind(values[codes == 0], values[codes == 1], equal_var=False)
+    np.testing.assert_allclose(t_stat, expected.statistic, rtol=1e-10)
+    np.testing.assert_allclose(p_value, expected.pvalue, rtol=1e-10)
+
+def test_compare_values_matches_scipy(sample):
+    values, codes = sample[0][:, :2], sample[1]
+    table = compare_values(values, ['a', 'b'], codes == 0, codes == 1, alpha=0.05)
+    for j, name in enumerate(table.index):
+        a, b = values[codes == 0, j], values[codes == 1, j]
+        expected = stats.ttest_ind(a, b, equal_var=False)
+        interval = expected.confidence_interval(0.95)
+        row = table.loc[name]
+        assert row['n_a'] == len(a) and row['n_b'] == len(b)
+        assert row['difference'] == pytest.approx(a.mean() - b.mean(), rel=1e-10)
+        assert row['t_stat'] == pytest.approx(expected.statistic, rel=1e-10)
+        assert row['p_value'] == pytest.approx(expected.pvalue, rel=1e-10)
+        assert row['dof'] == pytest.approx(expected.df, rel=1e-10)
+        assert row['ci_low'] == pytest.approx(interval.low, rel=1e-10)
+        assert row['ci_high'] == pytest.approx(interval.high, rel=1e-10)
+        assert row['significant'] == (expected.pvalue < 0.05)
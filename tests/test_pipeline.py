@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import pipeline
+from data_loader import DATA_PATH
+
+def edited(monkeypatch, file_name):
+    """Make file_name in the project look edited to stage_keys."""
+    digest = pipeline._file_digest
+
+    def fake_digest(path):
+        if os.path.basename(path) == file_name:
+            return 'edited'
+        return digest(path)
+    monkeypatch.setattr(pipeline, '_file_digest', fake_digest)
+
+@pytest.fixture
+def stages(tmp_path, monkeypatch):
+    file_path = os.path.join(pipeline.PROJECT_DIR, DATA_PATH)
+    # Output files (summary CSV, PNG) land in the temporary directory
+    monkeypatch.chdir(tmp_path)
+    return pipeline.problem1_stages(file_path=file_path, plot=True)
+
+def test_plot_edit_only_reruns_plot(stages, tmp_path, monkeypatch):
+    pytest.importorskip('matplotlib')
+    cache = pipeline.StageCache(str(tmp_path / 'cache'))
+    assert set(pipeline.run_pipeline(stages, cache).values()) == {'computed'}
+
+    edited(monkeypatch, 'analyze_problem1.py')
+    status = pipeline.run_pipeline(stages, cache)
+    assert status['problem1/plot'] == 'computed'
+    for name in ['problem1/load', 'problem1/derive', 'problem1/test', 'problem1/tabulate']:
+        assert status[name] in ('cached', 'skipped')
+
+def test_keys_follow_called_modules(stages, monkeypatch):
+    before = pipeline.stage_keys(stages)
+    edited(monkeypatch, 'metric_engine.py')
+    after = pipeline.stage_keys(stages)
+    changed = {name for name in before if before[name] != after[name]}
+    # Load does not call metric_engine; everything downstream of derive depends on it
+    assert changed == {'problem1/derive', 'problem1/test', 'problem1/tabulate', 'problem1/plot'}
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import service_day
+from metric_engine import METRICS, metric_matrix
+from query_service import QueryService, SwitchbackIndex
+from synthetic import generate_switchbacks
+
+NAMES = ['total_rides', 'express_share', 'profit_per_trip', 'match_rate', 'rider_cancellations']
+
+@pytest.fixture(scope='module')
+def df():
+    df = generate_switchbacks(9 * 21, n_cities=3, seed=4)
+    # Periods without trips leave the per-trip ratio metrics undefined
+    df.loc[df.index[::17], ['trips_pool', 'trips_express']] = 0
+    return df
+
+@pytest.fixture(scope='module')
+def index(df):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return SwitchbackIndex(df)
+
+def groupby_moments(df, names, commute, start, end, cities):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = pd.DataFrame(metric_matrix(df, [METRICS[name] for name in names]), columns=names, index=df.index)
+    values = values.replace([np.inf, -np.inf], np.nan)
+    days = service_day(df['period_start'])
+    mask = df['commute'].isin(commute)
+    if start is not None:
+        mask &= days >= pd.Timestamp(start)
+    if end is not None:
+        mask &= days <= pd.Timestamp(end)
+    if cities is not None:
+        mask &= df['city_id'].astype(str).isin(cities)
+    grouped = values[mask].groupby(df.loc[mask, 'treat'])
+    arms = [True, False]
+    return (grouped.count().reindex(arms).to_numpy(dtype=float), grouped.mean().reindex(arms).to_numpy(),
+            grouped.var().reindex(arms).to_numpy())
+
+@pytest.mark.parametrize('commute, start, end, cities', [
+    ((True, False), None, None, None),
+    ((True,), None, None, None),
+    ((False,), '2018-02-21', '2018-03-02', None),
+    ((True, False), '2018-02-25', '2018-02-25', ['Boston']),
+    ((True,), '2018-02-20', None, ['Boston', 'City2']),
+    ((True, False), None, '2018-02-10', None),
+])
+def test_moments_match_groupby(df, index, commute, start, end, cities):
+    counts, means, variances = index.moments(NAMES, commute, start, end, cities)
+    expected = groupby_moments(df, NAMES, commute, start, end, cities)
+    np.testing.assert_array_equal(counts, np.nan_to_num(expected[0]))
+    np.testing.assert_allclose(means, expected[1], rtol=1e-9)
+    np.testing.assert_allclose(variances, expected[2], rtol=1e-7)
+
+def test_undefined_metrics_are_skipped(df, index):
+    counts, _, _ = index.moments(['total_rides', 'profit_per_trip'])
+    assert (counts[:, 1] < counts[:, 0]).all()
+
+def test_rejects_inverted_dates_and_emits_strict_json(index):
+    service = QueryService(index)
+    with pytest.raises(ValueError):
+        service.normalize({'metric': ['total_rides'], 'start': ['2018-03-01'], 'end': ['2018-02-20']})
+    # A range without periods has no means; the body must still be strict JSON
+    body = service.compare({'metric': ['total_rides,match_rate'], 'start': ['2030-01-01']})
+    for record in json.loads(body, parse_constant=pytest.fail)['results']:
+        assert record['mean_a'] is None
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from metric_engine import PROBLEM2_METRICS, compare_values, get_metrics, metric_matrix
+from sql_source import compare_segments, import_csv, sqlite_pool
+from synthetic import generate_switchbacks, to_raw_csv
+
+@pytest.fixture
+def pool(tmp_path):
+    df = generate_switchbacks(9 * 14, n_cities=2, seed=7)
+    # Periods without trips or matches leave the ratio metrics undefined (NULL in SQLite)
+    df.loc[df.index[::11], ['trips_pool', 'trips_express', 'total_matches', 'total_double_matches']] = 0
+    csv_path = to_raw_csv(df, str(tmp_path / 'switchbacks.csv'))
+    pool = sqlite_pool(import_csv(csv_path, str(tmp_path / 'switchbacks.sqlite')))
+    yield df, pool
+    pool.close()
+
+@pytest.mark.parametrize('aggregate', [True, False])
+def test_matches_in_memory_engine(pool, aggregate):
+    df, pool = pool
+    metrics = get_metrics(PROBLEM2_METRICS)
+    tables = compare_segments(pool, metrics, {'commute': {'commute': True}}, aggregate=aggregate)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = metric_matrix(df, metrics)
+    values = np.where(np.isfinite(values), values, np.nan)
+    commute = df['commute'].to_numpy()
+    treat = df['treat'].to_numpy()
+    for name, column in zip(PROBLEM2_METRICS, values.T):
+        defined = ~np.isnan(column)
+        expected = compare_values(column[:, None], [name], commute & treat & defined, commute & ~treat & defined)
+        row, reference = tables['commute'].loc[name], expected.loc[name]
+        assert row['n_a'] == reference['n_a'] and row['n_b'] == reference['n_b']
+        for field in ['mean_a', 'var_a', 'mean_b', 'var_b', 't_stat', 'p_value']:
+            assert row[field] == pytest.approx(reference[field], rel=1e-9)
+    # Ratio metrics lost the periods without trips, counts do not
+    counts = tables['commute']['n_a']
+    assert counts['match_rate'] < counts['total_rides']
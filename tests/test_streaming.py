@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from metric_engine import group_stats
+from streaming import RunningStats
+
+N_GROUPS = 5
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(1)
+    n = 2000
+    values = np.column_stack([rng.normal(100, 5, n), rng.exponential(2, n), 1e8 + rng.normal(0, 1, n)])
+    # Group 4 never occurs; rows coded -1 are ignored
+    codes = rng.choice([-1, 0, 1, 2, 3], size=n, p=[0.1, 0.5, 0.3, 0.05, 0.05])
+    return values, codes
+
+def assert_matches_one_shot(running, values, codes):
+    counts, means, variances = group_stats(values, codes, N_GROUPS)
+    np.testing.assert_array_equal(running.count, counts)
+    observed = counts[:, 0] > 0
+    np.testing.assert_allclose(running.mean[observed], means[observed], rtol=1e-12)
+    np.testing.assert_allclose(running.variance()[observed], variances[observed], rtol=1e-8)
+
+@pytest.mark.parametrize('chunk', [1, 7, 250, 2000])
+def test_chunked_updates_match_one_shot(sample, chunk):
+    values, codes = sample
+    running = RunningStats(N_GROUPS, values.shape[1])
+    for start in range(0, len(values), chunk):
+        running.update(values[start:start + chunk], codes[start:start + chunk])
+    assert_matches_one_shot(running, values, codes)
+
+def test_merge_matches_one_shot(sample):
+    values, codes = sample
+    parts = []
+    for rows in np.array_split(np.arange(len(values)), 4):
+        parts.append(RunningStats(N_GROUPS, values.shape[1]).update(values[rows], codes[rows]))
+    # Merge order does not matter
+    merged = RunningStats(N_GROUPS, values.shape[1])
+    for part in parts[::-1]:
+        merged.merge(part)
+    assert_matches_one_shot(merged, values, codes)
+
+def test_round_trip_and_resize(sample):
+    values, codes = sample
+    half = len(values) // 2
+    running = RunningStats(3, values.shape[1])
+    low = (codes < 3)[:half]
+    running.update(values[:half][low], codes[:half][low])
+    # Totals survive JSON serialization and grow to groups that appear later
+    running = RunningStats.from_dict(running.to_dict()).resize(N_GROUPS)
+    running.update(values[half:], codes[half:])
+    keep = np.r_[low, np.ones(len(values) - half, dtype=bool)]
+    assert_matches_one_shot(running, values[keep], codes[keep])
+
+def test_non_finite_values_are_skipped(sample):
+    values, codes = sample
+    values = values.copy()
+    rng = np.random.default_rng(3)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[5, 1] = np.inf
+    parts = [RunningStats(N_GROUPS, values.shape[1]).update(values[rows], codes[rows])
+             for rows in np.array_split(np.arange(len(values)), 3)]
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    for j in range(values.shape[1]):
+        for group in range(4):
+            column = values[codes == group, j]
+            column = column[np.isfinite(column)]
+            assert merged.count[group, j] == len(column)
+            assert merged.mean[group, j] == pytest.approx(column.mean(), rel=1e-12)
+            assert merged.variance()[group, j] == pytest.approx(column.var(ddof=1), rel=1e-8)
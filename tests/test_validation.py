@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import column_store
+from data_loader import clear_cache, load_data
+from synthetic import generate_switchbacks, to_raw_csv
+from validation import QUARANTINE_PATH, load_validated, validate_file
+
+@pytest.fixture
+def export(tmp_path):
+    """A clean synthetic export and a copy with two bad rows."""
+    df = generate_switchbacks(9 * 7, n_cities=2, seed=5)
+    clean_path = to_raw_csv(df, str(tmp_path / 'clean.csv'))
+    bad = df.copy()
+    bad.loc[3, 'total_double_matches'] = bad.loc[3, 'total_matches'] + 1
+    bad.loc[10, ['trips_pool', 'trips_express', 'total_matches', 'total_double_matches']] = 0
+    bad_path = to_raw_csv(bad, str(tmp_path / 'bad.csv'))
+    return df, clean_path, bad_path
+
+def test_clean_run_removes_stale_quarantine(export, tmp_path):
+    _, clean_path, bad_path = export
+    quarantine_path = str(tmp_path / 'quarantine.csv')
+    rows, counts, _ = validate_file(bad_path, quarantine_path)
+    assert counts.sum() == 2 and os.path.exists(quarantine_path)
+    rows, counts, _ = validate_file(clean_path, quarantine_path)
+    assert counts.sum() == 0 and not os.path.exists(quarantine_path)
+
+    with pytest.warns(UserWarning, match='2 of'):
+        load_validated(bad_path, quarantine_path)
+    assert os.path.exists(quarantine_path)
+    load_validated(clean_path, quarantine_path)
+    assert not os.path.exists(quarantine_path)
+
+def test_shared_loaders_drop_bad_rows(export, tmp_path, monkeypatch):
+    df, _, bad_path = export
+    # load_data quarantines to the default path, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.dirname(QUARANTINE_PATH))
+    clear_cache()
+    with pytest.warns(UserWarning):
+        loaded = load_data(bad_path)
+    assert len(loaded) == len(df) - 2
+    assert len(load_data(bad_path, validate=False)) == len(df)
+    stored = column_store.load_columns(['total_matches'], bad_path, str(tmp_path / 'store'))
+    assert len(stored) == len(df) - 2
+    clear_cache()
@@ -0,0 +1,197 @@
+"""
+Validation stage for switchback exports.
+
+Every row is checked against RULES, each a vectorized column expression, so
+validation adds a few array operations per chunk on top of parsing. Rows that
+break any rule are written to a quarantine side file (raw switchbacks.csv
+format plus a 'reasons' column listing the broken rules), and only clean rows
+are passed on. Each run replaces the quarantine file, so a file left by an
+earlier bad export never outlives a clean one. data_loader.load_data reads
+through load_validated, so the analyses only see clean rows. Duplicate periods are detected with a per-city bitmap of
+period slots, which also reveals missing periods (gaps in a city's schedule)
+once the whole file has been read. Because the bitmap is tiny, chunked
+validation of arbitrarily large files needs only bounded memory.
+
+Usage:
+    python validation.py [path/to/switchbacks.csv] [quarantine.csv]
+"""
+
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    DATA_PATH, PERIOD_LENGTH, PERIODS_PER_DAY, SERVICE_DAY_START, is_commute, period_numbers, read_switchbacks,
+)
+from streaming import DEFAULT_CHUNKSIZE
+from synthetic import to_raw_csv
+
+QUARANTINE_PATH = 'data/quarantine.csv'
+CONTROL_WAIT = '2 mins'
+
+def _rides(df):
+    return df['trips_pool'].to_numpy(dtype=np.int64) + df['trips_express'].to_numpy(dtype=np.int64)
+
+def _is_control_wait(wait_time):
+    """wait_time == CONTROL_WAIT, evaluated once per category rather than per row."""
+    wait_time = pd.Categorical(wait_time) if not isinstance(wait_time.dtype, pd.CategoricalDtype) else wait_time.array
+    matches = np.append(np.asarray(wait_time.categories == CONTROL_WAIT), False)
+    return matches[wait_time.codes]
+
+# Reason -> vectorized check returning True for rows that break the rule
+RULES = {
+    'double_matches_exceed_matches': lambda df: (
+        df['total_double_matches'].to_numpy() > df['total_matches'].to_numpy()
+    ),
+    'matches_exceed_trips': lambda df: df['total_matches'].to_numpy() > _rides(df),
+    'treat_inconsistent_with_wait_time': lambda df: (
+        df['treat'].to_numpy() == _is_control_wait(df['wait_time'])
+    ),
+    'commute_inconsistent_with_period_start': lambda df: (
+        df['commute'].to_numpy() != is_commute(df['period_start']).to_numpy()
+    ),
+    'period_start_off_schedule': lambda df: (
+        ((df['period_start'] - SERVICE_DAY_START).dt.floor('D') + SERVICE_DAY_START
+         - df['period_start']).to_numpy() % PERIOD_LENGTH.to_timedelta64() != np.timedelta64(0)
+    ),
+    'zero_trips': lambda df: _rides(df) == 0,
+}
+DUPLICATE_REASON = 'duplicate_period'
+
+class PeriodTracker:
+    """Per-city bitmap of the period slots seen so far, for duplicate and gap detection."""
+
+    def __init__(self):
+        self.seen = {}
+
+    def mark(self, cities, periods):
+        """
+        Record periods and return a mask of rows whose (city, period) was already seen,
+        earlier in the same batch or in a previous one.
+        """
+        duplicate = np.zeros(len(periods), dtype=bool)
+        cities = np.asarray(cities, dtype=str)
+        for city in np.unique(cities):
+            rows = np.flatnonzero(cities == city)
+            start, bitmap = self.seen.get(city, (periods[rows].min(), np.zeros(0, dtype=bool)))
+            low = min(start, periods[rows].min())
+            high = max(start + len(bitmap), periods[rows].max() + 1)
+            if low != start or high != start + len(bitmap):
+                grown = np.zeros(high - low, dtype=bool)
+                grown[start - low:start - low + len(bitmap)] = bitmap
+                start, bitmap = low, grown
+            slots = periods[rows] - start
+            first = np.zeros(len(rows), dtype=bool)
+            first[np.unique(slots, return_index=True)[1]] = True
+            duplicate[rows] = bitmap[slots] | ~first
+            bitmap[slots] = True
+            self.seen[city] = (start, bitmap)
+        return duplicate
+
+    def gaps(self):
+        """Periods missing between each city's first and last period."""
+        frames = []
+        for city, (start, bitmap) in self.seen.items():
+            missing = start + np.flatnonzero(~bitmap)
+            day, slot = np.divmod(missing, PERIODS_PER_DAY)
+            period_start = (pd.to_datetime(day, unit='D') + SERVICE_DAY_START
+                            + pd.to_timedelta(slot * PERIOD_LENGTH.total_seconds(), unit='s'))
+            frames.append(pd.DataFrame({'city_id': city, 'period_start': period_start}))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['city_id', 'period_start'])
+
+def check(df, tracker=None):
+    """
+    Evaluate all rules on df.
+
+    Args:
+        df (DataFrame): Normalized switchback rows (see data_loader.read_switchbacks)
+        tracker (PeriodTracker): Periods seen in earlier chunks; a new one if None
+
+    Returns:
+        DataFrame: One boolean column per rule (and DUPLICATE_REASON), True where the row breaks it
+    """
+    tracker = PeriodTracker() if tracker is None else tracker
+    violations = pd.DataFrame({reason: rule(df) for reason, rule in RULES.items()}, index=df.index)
+    violations[DUPLICATE_REASON] = tracker.mark(df['city_id'].astype(str).to_numpy(),
+                                                period_numbers(df['period_start']))
+    return violations
+
+def reasons(violations):
+    """';'-joined names of the broken rules for each row with at least one violation."""
+    bad = violations[violations.any(axis=1)]
+    names = np.array(bad.columns)
+    return pd.Series([';'.join(names[row]) for row in bad.to_numpy()], index=bad.index, dtype=object)
+
+def split(df, tracker=None):
+    """
+    Separate clean rows from rows to quarantine.
+
+    Returns:
+        tuple: (clean rows, quarantined rows with a 'reasons' column)
+    """
+    violations = check(df, tracker)
+    bad = violations.any(axis=1).to_numpy()
+    quarantined = df[bad].copy()
+    quarantined['reasons'] = reasons(violations)
+    return df[~bad], quarantined
+
+def clear_quarantine(quarantine_path=QUARANTINE_PATH):
+    """Remove the quarantine file of an earlier run, if any."""
+    if os.path.exists(quarantine_path):
+        os.remove(quarantine_path)
+
+def load_validated(file_path=DATA_PATH, quarantine_path=QUARANTINE_PATH):
+    """
+    Read a switchbacks CSV, quarantine bad rows to quarantine_path and return the clean rows.
+
+    The quarantine file is replaced on every call and only written if there are
+    bad rows; a warning reports how many were set aside.
+    """
+    clear_quarantine(quarantine_path)
+    df = read_switchbacks(file_path)
+    clean, quarantined = split(df)
+    if len(quarantined):
+        to_raw_csv(quarantined, quarantine_path)
+        warnings.warn(f"{len(quarantined)} of {len(df)} rows of '{file_path}' failed validation "
+                      f"and were quarantined to '{quarantine_path}'")
+    return clean.reset_index(drop=True)
+
+def validate_file(file_path=DATA_PATH, quarantine_path=QUARANTINE_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Validate a switchbacks CSV in chunks, writing bad rows to a fresh quarantine_path.
+
+    Returns:
+        tuple: (rows checked, Series of violation counts per reason, DataFrame of missing periods)
+    """
+    clear_quarantine(quarantine_path)
+    tracker = PeriodTracker()
+    counts = pd.Series(0, index=list(RULES) + [DUPLICATE_REASON])
+    rows = 0
+    written = False
+    for chunk in read_switchbacks(file_path, chunksize=chunksize):
+        violations = check(chunk, tracker)
+        counts += violations.sum()
+        rows += len(chunk)
+        bad = violations.any(axis=1).to_numpy()
+        if bad.any():
+            quarantined = chunk[bad].copy()
+            quarantined['reasons'] = reasons(violations)
+            to_raw_csv(quarantined, quarantine_path, append=written)
+            written = True
+    return rows, counts, tracker.gaps()
+
+def main(file_path=DATA_PATH, quarantine_path=QUARANTINE_PATH):
+    rows, counts, gaps = validate_file(file_path, quarantine_path)
+    print(f"===== VALIDATION OF '{file_path}' ({rows:,} rows) =====")
+    print(counts.to_string())
+    print(f"\nMissing periods: {len(gaps)}")
+    if len(gaps):
+        print(gaps.to_string(index=False))
+    if counts.any():
+        print(f"\nBad rows quarantined to '{quarantine_path}'")
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,398 @@
+"""
+Wait-time schedule optimizer: 2- or 5-minute wait per city x weekday x period-of-day.
+
+Estimation: for every slot (city, weekday, period of day) and arm, per-period
+profit (revenue minus total_driver_payout) and rider cancellations are
+estimated by empirical-Bayes shrinkage through a hierarchy of pools,
+slot -> (city, weekend, period of day) -> (city, period of day) -> city, each
+arm separately. Each level's cell means are pulled toward the level above with
+weight n / (n + sigma^2 / tau^2), where sigma^2 is the within-cell variance
+and tau^2 the method-of-moments variance of the cell means around their parent.
+With only one period per slot and arm (two weeks of data) slot effects cannot
+be told apart from noise, and the estimates fall back to the pools.
+
+Optimization: each slot gets the arm maximizing profit - penalty * cancellations.
+The penalty is swept over a grid in one array operation, and the most
+profitable schedule meeting the caps is kept. The caps are a total
+cancellation budget relative to the all-2-minute schedule and, optionally, a
+per-slot limit on the 5-minute arm's cancellations relative to the 2-minute arm.
+Caps are enforced on upper confidence bounds, not on the point estimates: the
+estimates are recomputed on Poisson-bootstrap resamples of whole city-days, and
+each slot's extra cancellations from the 5-minute arm enter the optimization at
+their upper quantile, so slots that only look cheap by chance do not spend the
+budget (the winner's curse of picking the best-looking slots).
+
+Evaluation: candidate schedules are scored offline on the logged switchback
+periods, all at once, with the replay (matched periods), self-normalized
+inverse propensity and doubly robust estimators, plus Poisson-bootstrap
+intervals that resample whole city-days, since periods of a day are
+correlated. main cross-fits by service-day parity: schedules are optimized on
+one half of the days and scored on the other, so the optimized schedule is not
+graded on the data it was fitted to, and held-out cap violations are flagged.
+
+Usage:
+    python wait_policy.py [--total-cap 1.0] [--slot-cap 1.1] [--cap-level 0.95] [--boot 2000] [--seed 0]
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from column_store import load_columns
+from data_loader import period_of_day, service_day
+from metric_engine import METRICS, REVENUE, Metric, base_columns, group_sums, metric_matrix
+from resampling import BATCH_ELEMENTS
+
+PROFIT = Metric('profit', dict(REVENUE, total_driver_payout=-1.0), None)
+OUTCOMES = [PROFIT, METRICS['rider_cancellations']]
+# Arm index -> wait time; arm 1 is the treatment (treat == True)
+ARMS = ['2 mins', '5 mins']
+SLOT_COLUMNS = ['city_id', 'weekday', 'period_of_day']
+# Shrinkage hierarchy, finest first
+LEVELS = [SLOT_COLUMNS, ['city_id', 'weekend', 'period_of_day'], ['city_id', 'period_of_day'], ['city_id']]
+PENALTIES = np.concatenate([[0.0], np.geomspace(1e-2, 1e5, 400)])
+DEFAULT_BOOT = 2000
+# Resamples of the slot estimates, and the one-sided level, for the cap upper bounds
+CAP_BOOT = 200
+CAP_LEVEL = 0.95
+
+def slot_frame(df):
+    """
+    Slot of every row and the table of slots.
+
+    Returns:
+        tuple: (slot code per row, DataFrame of slots with SLOT_COLUMNS, weekend and commute)
+    """
+    day = service_day(df['period_start'])
+    rows = pd.DataFrame({
+        'city_id': df['city_id'].astype(str).to_numpy(),
+        'weekday': day.dt.dayofweek.to_numpy(),
+        'period_of_day': period_of_day(df['period_start']).to_numpy(),
+        'commute': df['commute'].to_numpy(),
+    })
+    codes = rows.groupby(SLOT_COLUMNS, sort=True).ngroup().to_numpy()
+    slots = rows.groupby(SLOT_COLUMNS, sort=True).agg(commute=('commute', 'any')).reset_index()
+    slots.insert(2, 'weekend', slots['weekday'] >= 5)
+    return codes, slots
+
+def _level_codes(slots):
+    """Group code of every slot at each level of LEVELS."""
+    return [slots.groupby(columns, sort=True).ngroup().to_numpy() for columns in LEVELS]
+
+def _sum_cells(values, codes, n_groups):
+    """Sum (n_batch, n_cells, ...) values over the cell axis into n_groups groups."""
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    present = np.bincount(codes, minlength=n_groups) > 0
+    totals = np.zeros(values.shape[:1] + (n_groups,) + values.shape[2:])
+    totals[:, present] = np.add.reduceat(values[:, order], np.searchsorted(sorted_codes, np.flatnonzero(present)),
+                                         axis=1)
+    return totals
+
+def _shrink(counts, sums, squares, slots):
+    """
+    Shrunken means from per-(slot, arm) cell moments, for a batch of data sets.
+
+    Args:
+        counts (ndarray): (n_batch, n_slots * 2) (weighted) row counts per cell, cell = slot * 2 + arm
+        sums (ndarray): (n_batch, n_slots * 2, n_outcomes) sums per cell
+        squares (ndarray): (n_batch, n_slots * 2, n_outcomes) sums of squares per cell
+        slots (DataFrame): Slot table from slot_frame
+
+    Returns:
+        ndarray: (n_batch, n_slots, 2, n_outcomes) estimates
+    """
+    level_codes = _level_codes(slots)
+    cells = np.arange(len(slots) * 2)
+
+    def moments(codes):
+        n_groups = codes.max() + 1
+        group = codes[cells // 2] * 2 + cells % 2
+        return (_sum_cells(counts, group, n_groups * 2)[..., None], _sum_cells(sums, group, n_groups * 2),
+                _sum_cells(squares, group, n_groups * 2))
+
+    # Within-cell variance from the finest level that has repeated cells
+    sigma2 = np.full(sums.shape[:1] + sums.shape[2:], np.nan)
+    for codes in reversed(level_codes):
+        n, s, q = moments(codes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            within = np.where(n > 0, q - s ** 2 / n, 0.0).sum(axis=1)
+        dof = np.clip(n - 1, 0, None).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma2 = np.where(dof > 0, within / dof, sigma2)
+
+    # Coarsest to finest, each level shrunk toward its parent's estimates
+    top = np.zeros(len(slots), dtype=int)
+    n, s, _ = moments(top)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prior = s / n
+    parent_codes = top
+    for codes in reversed(level_codes):
+        n_groups = codes.max() + 1
+        n, s, _ = moments(codes)
+        parent_of_group = np.zeros(n_groups, dtype=int)
+        parent_of_group[codes] = parent_codes
+        groups = np.arange(n_groups * 2)
+        parent = prior[:, parent_of_group[groups // 2] * 2 + groups % 2]
+        observed = n > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = s / n
+            excess = np.where(observed, (means - parent) ** 2 - sigma2[:, None] / n, 0.0)
+            tau2 = np.maximum(np.nan_to_num(excess.sum(axis=1) / observed.sum(axis=1)), 0)[:, None]
+            weight = np.where(tau2 > 0, n / (n + sigma2[:, None] / tau2), 0.0)
+            prior = np.where(observed, weight * np.nan_to_num(means) + (1 - weight) * parent, parent)
+        parent_codes = codes
+    return prior.reshape(len(prior), len(slots), 2, -1)
+
+def slot_estimates(y, slot, arm, slots):
+    """
+    Shrunken mean of every outcome for every slot and arm.
+
+    Args:
+        y (ndarray): (n_rows, n_outcomes) outcomes
+        slot (ndarray): Slot code per row
+        arm (ndarray): Arm (0 or 1) per row
+        slots (DataFrame): Slot table from slot_frame
+
+    Returns:
+        ndarray: (n_slots, 2, n_outcomes) estimates
+    """
+    # Centered so that sums of squares keep their precision
+    center = y.mean(axis=0)
+    values = y - center
+    counts, sums = group_sums(values, slot * 2 + arm, len(slots) * 2)
+    _, squares = group_sums(values ** 2, slot * 2 + arm, len(slots) * 2)
+    return _shrink(counts[None], sums[None], squares[None], slots)[0] + center
+
+def bootstrap_estimates(y, slot, arm, slots, clusters=None, n_boot=CAP_BOOT, seed=0):
+    """
+    slot_estimates on Poisson-bootstrap resamples of whole clusters.
+
+    Each replicate weights every cluster by a Poisson(1) draw. Cell moments are
+    reduced per (cluster, cell) once, so a batch of replicates is one sparse
+    product of the weights with those moments.
+
+    Args:
+        clusters (ndarray): Cluster code per row (e.g. city and service day); rows if None
+
+    Returns:
+        ndarray: (n_boot, n_slots, 2, n_outcomes) estimates
+    """
+    clusters = np.arange(len(arm)) if clusters is None else pd.factorize(clusters)[0]
+    n_clusters, n_cells, m = clusters.max() + 1, len(slots) * 2, y.shape[1]
+    center = y.mean(axis=0)
+    values = y - center
+    # Moments of every (cluster, cell) pair, as a sparse (cells x stats, clusters) matrix
+    pairs, pair = np.unique(clusters * n_cells + slot * 2 + arm, return_inverse=True)
+    counts, sums = group_sums(values, pair, len(pairs))
+    _, squares = group_sums(values ** 2, pair, len(pairs))
+    stats = np.column_stack([counts, sums, squares])
+    rows = (pairs % n_cells)[:, None] * stats.shape[1] + np.arange(stats.shape[1])
+    moments = sparse.csr_matrix(
+        (stats.ravel(), (rows.ravel(), np.repeat(pairs // n_cells, stats.shape[1]))),
+        shape=(n_cells * stats.shape[1], n_clusters),
+    )
+
+    rng = np.random.default_rng(seed)
+    replicates = np.empty((n_boot, len(slots), 2, m))
+    batch_size = max(1, BATCH_ELEMENTS // max(n_clusters, moments.shape[0]))
+    for start in range(0, n_boot, batch_size):
+        weights = rng.poisson(1.0, size=(n_clusters, min(batch_size, n_boot - start))).astype(float)
+        totals = np.asarray(moments @ weights).T.reshape(-1, n_cells, stats.shape[1])
+        replicates[start:start + len(totals)] = _shrink(
+            totals[:, :, 0], totals[:, :, 1:1 + m], totals[:, :, 1 + m:], slots) + center
+    return replicates
+
+def optimize_schedule(estimates, total_cap=1.0, slot_cap=None, replicates=None, level=CAP_LEVEL,
+                      penalties=PENALTIES):
+    """
+    Choose an arm per slot to maximize expected profit under cancellation caps.
+
+    Args:
+        estimates (ndarray): (n_slots, 2, 2) expected profit and cancellations per slot and arm
+        total_cap (float): Allowed total expected cancellations relative to the all-2-minute schedule
+        slot_cap (float): If given, the 5-minute arm is only allowed in slots where its expected
+            cancellations are at most slot_cap times the 2-minute arm's
+        replicates (ndarray): (n_boot, n_slots, 2, 2) bootstrap estimates (see bootstrap_estimates);
+            if given, the caps hold at the level upper confidence bound instead of the point estimates
+        level (float): One-sided confidence level of the upper bounds
+        penalties (ndarray): Cancellation penalties swept (Lagrange multipliers)
+
+    Returns:
+        ndarray: Arm (0 or 1) per slot
+    """
+    profit, cancellations = estimates[:, :, 0], estimates[:, :, 1]
+    allowed = np.ones(profit.shape, dtype=bool)
+    if replicates is None:
+        if slot_cap is not None:
+            allowed[:, 1] = cancellations[:, 1] <= slot_cap * cancellations[:, 0]
+    else:
+        draws = replicates[..., 1]
+        if slot_cap is not None:
+            allowed[:, 1] = np.nanquantile(draws[:, :, 1] - slot_cap * draws[:, :, 0], level, axis=0) <= 0
+        # Each slot's extra cancellations from the 5-minute arm at their upper bound: slots
+        # that only look cheap by chance are not chosen, and the sum of the per-slot bounds
+        # bounds the schedule's total
+        cancellations = cancellations.copy()
+        cancellations[:, 1] = cancellations[:, 0] + np.nanquantile(draws[:, :, 1] - draws[:, :, 0], level, axis=0)
+    # (n_penalties, n_slots, 2) scores; disallowed arms never win
+    scores = profit[None] - penalties[:, None, None] * cancellations[None]
+    scores = np.where(allowed[None], scores, -np.inf)
+    choices = scores.argmax(axis=2)
+    slots = np.arange(len(profit))
+    total_profit = profit[slots, choices].sum(axis=1)
+    total_cancellations = cancellations[slots, choices].sum(axis=1)
+    feasible = total_cancellations <= total_cap * cancellations[:, 0].sum() + 1e-9
+    if not feasible.any():
+        return np.zeros(len(profit), dtype=int)
+    return choices[np.flatnonzero(feasible)[np.argmax(total_profit[feasible])]]
+
+def evaluate_schedules(y, slot, arm, schedules, estimates, propensity=None, clusters=None,
+                       n_boot=DEFAULT_BOOT, seed=0):
+    """
+    Offline estimates of the per-period outcomes each schedule would have produced.
+
+    Args:
+        y (ndarray): (n_rows, n_outcomes) logged outcomes
+        slot (ndarray): Slot code per row
+        arm (ndarray): Logged arm per row
+        schedules (dict): Name -> arm per slot
+        estimates (ndarray): (n_slots, 2, n_outcomes) outcome model for the doubly robust estimator
+        propensity (float): Probability that a period got the 5-minute arm; the observed share if None
+        clusters (ndarray): Cluster code per row resampled together in the bootstrap
+            (e.g. city and service day); every row is its own cluster if None
+        n_boot (int): Poisson bootstrap replicates for the doubly robust intervals
+
+    Returns:
+        DataFrame: indexed by (schedule, outcome) with matched, replay, ips (self-normalized),
+        dr, dr_low and dr_high
+    """
+    plan = np.array(list(schedules.values()))[:, slot]
+    matched = plan == arm
+    propensity = arm.mean() if propensity is None else propensity
+    logged_probability = np.where(arm == 1, propensity, 1 - propensity)
+    # (n_schedules, n_rows) importance weights and (n_schedules, n_rows, n_outcomes) DR terms
+    weights = matched / logged_probability
+    residual = y - estimates[slot, arm]
+    dr_terms = estimates[slot[None, :], plan] + weights[:, :, None] * residual[None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        replay = (matched.astype(float) @ y) / matched.sum(axis=1)[:, None]
+        # Dividing by the realized weight total instead of n keeps IPS stable when
+        # few periods match the schedule
+        ips = (weights @ y) / weights.sum(axis=1)[:, None]
+    # Poisson bootstrap over clusters, in batches of replicates to bound the weight matrix;
+    # replicates that draw no cluster at all are dropped
+    clusters = np.arange(len(arm)) if clusters is None else pd.factorize(clusters)[0]
+    n_clusters = clusters.max() + 1
+    sizes, terms = group_sums(dr_terms.transpose(1, 0, 2).reshape(len(arm), -1), clusters, n_clusters)
+    rng = np.random.default_rng(seed)
+    boot = np.empty((n_boot, terms.shape[1]))
+    batch_size = max(1, BATCH_ELEMENTS // n_clusters)
+    for start in range(0, n_boot, batch_size):
+        draws = rng.poisson(1.0, size=(min(batch_size, n_boot - start), n_clusters)).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            boot[start:start + len(draws)] = (draws @ terms) / (draws @ sizes)[:, None]
+    low, high = np.nanpercentile(boot, [2.5, 97.5], axis=0)
+
+    index = pd.MultiIndex.from_product([list(schedules), [o.name for o in OUTCOMES]],
+                                       names=['schedule', 'outcome'])
+    return pd.DataFrame({
+        'matched': np.repeat(matched.sum(axis=1), y.shape[1]),
+        'replay': replay.ravel(),
+        'ips': ips.ravel(),
+        'dr': dr_terms.mean(axis=1).ravel(),
+        'dr_low': low.ravel(),
+        'dr_high': high.ravel(),
+    }, index=index)
+
+def candidate_schedules(slots, optimized):
+    """Reference schedules alongside the optimized one."""
+    return {
+        'all 2-min': np.zeros(len(slots), dtype=int),
+        'all 5-min': np.ones(len(slots), dtype=int),
+        '5-min in commute hours': slots['commute'].to_numpy(dtype=int),
+        '5-min outside commute hours': (~slots['commute'].to_numpy()).astype(int),
+        'optimized': optimized,
+    }
+
+def cross_fit(y, slot, arm, slots, folds, total_cap=1.0, slot_cap=None, clusters=None,
+              level=CAP_LEVEL, n_boot=DEFAULT_BOOT, seed=0):
+    """
+    Optimize on all folds but one, score the candidate schedules on the held-out fold, for every fold.
+
+    Returns:
+        DataFrame: evaluate_schedules columns with a leading 'fold' index level, plus
+        cap_ratio (held-out doubly robust cancellations relative to all 2-min) and
+        over_cap on the cancellation rows
+    """
+    clusters = np.arange(len(arm)) if clusters is None else np.asarray(clusters)
+    tables = {}
+    for fold in np.unique(folds):
+        train, test = folds != fold, folds == fold
+        estimates = slot_estimates(y[train], slot[train], arm[train], slots)
+        replicates = bootstrap_estimates(y[train], slot[train], arm[train], slots, clusters[train], seed=seed)
+        schedule = optimize_schedule(estimates, total_cap, slot_cap, replicates, level)
+        tables[fold] = evaluate_schedules(
+            y[test], slot[test], arm[test], candidate_schedules(slots, schedule), estimates,
+            propensity=arm.mean(), clusters=clusters[test], n_boot=n_boot, seed=seed,
+        )
+    scores = pd.concat(tables, names=['fold'])
+    cancellations = scores.xs(OUTCOMES[1].name, level='outcome', drop_level=False)['dr']
+    baseline = cancellations.xs('all 2-min', level='schedule')
+    scores['cap_ratio'] = cancellations / baseline.reindex(cancellations.index.droplevel('schedule')).to_numpy()
+    scores['over_cap'] = (scores['cap_ratio'] > total_cap).astype('boolean').mask(scores['cap_ratio'].isna())
+    return scores
+
+def schedule_table(slots, schedule):
+    """Schedule as a city x weekday by period-of-day grid of wait times."""
+    table = slots[['city_id', 'weekday', 'period_of_day']].assign(wait_time=np.array(ARMS)[schedule])
+    return table.pivot(index=['city_id', 'weekday'], columns='period_of_day', values='wait_time')
+
+def main(total_cap=1.0, slot_cap=None, level=CAP_LEVEL, n_boot=DEFAULT_BOOT, seed=0):
+    df = load_columns(['city_id', 'period_start', 'treat', 'commute'] + base_columns(OUTCOMES))
+    y = metric_matrix(df, OUTCOMES)
+    slot, slots = slot_frame(df)
+    arm = df['treat'].to_numpy(dtype=int)
+    days = service_day(df['period_start'])
+    day_number = (days - days.min()).dt.days.to_numpy()
+    clusters = pd.factorize(df['city_id'])[0] * (day_number.max() + 1) + day_number
+
+    estimates = slot_estimates(y, slot, arm, slots)
+    replicates = bootstrap_estimates(y, slot, arm, slots, clusters, seed=seed)
+    schedule = optimize_schedule(estimates, total_cap, slot_cap, replicates, level)
+    print(f"===== OPTIMIZED WAIT-TIME SCHEDULE (cancellation budget {total_cap:.0%} of all 2-min"
+          f"{'' if slot_cap is None else f', slot cap {slot_cap:.0%}'}, at {level:.0%} confidence) =====")
+    print(schedule_table(slots, schedule).to_string())
+    expected = estimates[np.arange(len(slots)), schedule].sum(axis=0)
+    baseline = estimates[:, 0].sum(axis=0)
+    print(f"\nExpected profit per week: ${expected[0]:,.2f} (all 2-min: ${baseline[0]:,.2f})")
+    print(f"Expected cancellations per week: {expected[1]:,.1f} (all 2-min: {baseline[1]:,.1f})")
+
+    # Score schedules on days they were not optimized on
+    scores = cross_fit(y, slot, arm, slots, day_number % 2, total_cap, slot_cap, clusters, level, n_boot, seed)
+    held_out = scores.groupby(level=['schedule', 'outcome'], sort=False)[['replay', 'ips', 'dr']].mean()
+    print("\n===== CROSS-FITTED OFFLINE EVALUATION (mean per period, averaged over folds) =====")
+    print(held_out.unstack('outcome').to_string(float_format=lambda x: f'{x:,.2f}'))
+    print("\nPer fold (doubly robust, 95% bootstrap intervals; cancellations relative to all 2-min):")
+    columns = ['matched', 'dr', 'dr_low', 'dr_high', 'cap_ratio', 'over_cap']
+    print(scores[columns].to_string(float_format=lambda x: f'{x:,.2f}', na_rep=''))
+    violations = scores.xs('optimized', level='schedule')['over_cap'].fillna(False)
+    if violations.any():
+        folds = ', '.join(str(fold) for fold, _ in violations[violations].index)
+        print(f"\nWARNING: the optimized schedule exceeds the cancellation budget on held-out days (fold {folds})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--total-cap', type=float, default=1.0,
+                        help='total expected cancellations allowed, relative to the all-2-minute schedule')
+    parser.add_argument('--slot-cap', type=float, default=None,
+                        help="max ratio of the 5-minute arm's expected cancellations to the 2-minute arm's per slot")
+    parser.add_argument('--cap-level', type=float, default=CAP_LEVEL,
+                        help='one-sided confidence level at which the caps must hold')
+    parser.add_argument('--boot', type=int, default=DEFAULT_BOOT, help='bootstrap replicates for the evaluation')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args.total_cap, args.slot_cap, args.cap_level, args.boot, args.seed)